@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
+from corsheaders.defaults import default_headers
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -130,6 +131,82 @@ STATIC_URL = "static/"
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Chunked uploads (/api/uploads/): default and maximum part size in bytes
+UPLOAD_PART_SIZE = 8 * 1024 * 1024
+UPLOAD_MAX_PART_SIZE = 64 * 1024 * 1024
+
+# /api/files/{id}/download/ can hand the byte transfer to the front web server:
+#   None               - stream from Django (dev server)
+#   'x-accel-redirect' - nginx; map DOWNLOAD_OFFLOAD_PREFIX to MEDIA_ROOT as an internal location
+#   'x-sendfile'       - Apache mod_xsendfile / lighttpd; sends the absolute path
+DOWNLOAD_OFFLOAD = None
+DOWNLOAD_OFFLOAD_PREFIX = '/protected-media/'
+
+# save_content HTML -> DOCX conversion pool (api.jobs)
+CONVERSION_WORKERS = 2                       # concurrent conversion processes per web process
+CONVERSION_QUEUE_SIZE = 8                    # jobs allowed to wait before save_content returns 503
+CONVERSION_TIMEOUT = 60                      # seconds before a conversion process is killed
+CONVERSION_MEMORY_LIMIT = 512 * 1024 * 1024  # address-space limit per conversion process (POSIX only)
+CONVERSION_START_METHOD = 'spawn'
+CONVERSION_RETRY_AFTER = 5                   # seconds, sent with 503 when the pool is saturated
+CONVERSION_JOB_RETENTION_DAYS = 7            # finished jobs older than this are deleted (manage.py purge_conversion_jobs)
+
+# Per-user storage quota in bytes (None = unlimited); StorageUsage.quota_bytes overrides it
+STORAGE_QUOTA = None
+
+# Full-text search (api.search)
+SEARCH_MAX_TEXT = 500000                     # characters of extracted document text indexed per file
+SEARCH_INDEX_WORKERS = 1                     # background text extraction after uploads and saves
+
+# Server-side DOCX -> HTML render cache (api.render), keyed by content hash
+RENDER_CACHE_ROOT = BASE_DIR / 'render_cache'
+RENDER_PREWARM_WORKERS = 1                   # background renders after uploads and saves
+
+# Share expiry sweeper (api.expiry, manage.py sweep_share_expiry)
+SHARE_EXPIRY_REMINDER_HOURS = 24             # remind recipients this long before a share expires
+SHARE_EXPIRY_BATCH_SIZE = 500                # shares handled per transaction
+
+# POST /api/shares/bulk/ (api.sharing)
+BULK_SHARE_MAX = 10000                       # objects x recipients per request
+
+# POST /api/files/batch/ (api.batch)
+FILE_BATCH_MAX = 10000                       # files changed per request
+
+# Push notifications over Server-Sent Events (api.events, GET /api/events/; needs an ASGI server)
+EVENTS_BROKER = None                         # 'host:port' of `manage.py run_event_broker` when running several worker processes
+EVENTS_KEEPALIVE = 15                        # seconds between keep-alive comments on idle streams
+EVENTS_RETRY_MS = 3000                       # reconnect delay suggested to EventSource clients
+EVENTS_BACKLOG = 200                         # missed notifications replayed on resume (Last-Event-ID)
+EVENTS_QUEUE_SIZE = 100                      # undelivered events buffered per stream
+
+# Notification retention (api.notifications, manage.py purge_notifications); unread ones are kept
+NOTIFICATION_RETENTION_DAYS = 90             # read notifications older than this are deleted
+NOTIFICATION_MAX_READ = 500                  # read notifications kept per user beyond that
+
+# Buffered audit log writer (api.audit)
+AUDIT_BUFFER_SIZE = 100                      # entries per multi-row insert; 0 writes each entry immediately
+AUDIT_FLUSH_INTERVAL = 2                     # seconds before a partly filled buffer is written
+AUDIT_SPOOL_DIR = BASE_DIR / 'audit_spool'   # crash-safe copy of buffered entries, one file per process
+AUDIT_SPOOL_STALE = 60                       # seconds before an untouched spool file is treated as orphaned
+
+# Role cache (api.roles). Roles are always remembered for the rest of the request; with
+# PERMISSION_CACHE naming a CACHES alias they are also cached across requests. The cache
+# must be shared by all worker processes (e.g. django.core.cache.backends.redis.RedisCache),
+# or a revoked share stays usable in the other processes until the entry times out.
+PERMISSION_CACHE = None
+PERMISSION_CACHE_TIMEOUT = 300               # seconds a cached role is trusted at most
+
+# Authenticated users (api.authentication): read without the avatar on every request, or, with
+# AUTH_USER_CACHE naming a CACHES alias, cached by id and token version. Password changes,
+# deactivation and is_staff/is_superuser changes drop the entry, which only reaches processes
+# sharing the cache (e.g. Redis); with a per-process cache such as locmem other workers keep
+# accepting revoked tokens and demoted privileges until their entry times out.
+AUTH_USER_CACHE = None
+AUTH_USER_CACHE_TTL = 30                     # seconds
+
+# Edit locks are leases (api.locks); clients renew them with POST /api/files/{id}/heartbeat/
+FILE_LOCK_TTL = 120                          # seconds a lock lasts without a heartbeat
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -153,14 +230,20 @@ AUTH_USER_MODEL = 'api.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
-    ]
+        'api.authentication.JWTAuthentication',
+    ],
+    # Keyset pagination; clients may pass ?page_size= up to the class maximum
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.KeysetPagination',
+    'PAGE_SIZE': 50,
 }
 
 from datetime import timedelta
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=30),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
+    # Tokens carry the user's token_version so they can be revoked (api.authentication)
+    'TOKEN_OBTAIN_SERIALIZER': 'api.authentication.TokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'api.authentication.TokenRefreshSerializer',
 }
 
 
@@ -174,6 +257,9 @@ CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
 ]
 CORS_ALLOW_CREDENTIALS = True
+# Optimistic concurrency (api.concurrency): updates send If-Match, responses carry the version as ETag
+CORS_ALLOW_HEADERS = (*default_headers, 'if-match')
+CORS_EXPOSE_HEADERS = ['ETag']
 
 
 # Simple logging config so INFO logs (including our RegisterNoDB prints) appear
@@ -0,0 +1,173 @@
+"""
+Effective-access table maintenance.
+
+FileAccess / FolderAccess hold one row per grant a user has on an object:
+its ownership and each share of that object. They reproduce the visibility
+rules exactly: a FolderShare gives access to the folder, not to the files in
+it. Listing and permission checks read these rows with a single indexed
+lookup instead of joining the share tables and de-duplicating.
+
+Rows created from a share point back at it with a cascading foreign key, so
+deleting a share (or the object itself) removes its rows without extra work.
+Everything else goes through the helpers below; the model signals in
+api.signals call them, and code that bypasses signals (queryset.update,
+bulk_create) must call them itself. The helpers that change who can do what
+also invalidate the cached roles of api.roles.
+"""
+from django.db import transaction
+from django.db.models import Case, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import roles
+from .models import (
+    AccessLevel, File, FileAccess, FileShare, Folder, FolderAccess, FolderShare
+)
+
+BATCH_SIZE = 1000
+
+# Levels that satisfy a required level, e.g. EDIT is satisfied by OWNER too.
+SATISFIES = {
+    AccessLevel.VIEW: [AccessLevel.OWNER, AccessLevel.EDIT, AccessLevel.VIEW],
+    AccessLevel.EDIT: [AccessLevel.OWNER, AccessLevel.EDIT],
+    AccessLevel.OWNER: [AccessLevel.OWNER],
+}
+
+SHARED_LEVELS = [AccessLevel.EDIT, AccessLevel.VIEW]
+
+
+def not_expired(now=None):
+    now = now or timezone.now()
+    return Q(expires_at__isnull=True) | Q(expires_at__gt=now)
+
+
+def file_ids(user, levels=None):
+    """Subquery of file ids the user can currently access at one of ``levels``."""
+    qs = FileAccess.objects.filter(user=user).filter(not_expired())
+    if levels is not None:
+        qs = qs.filter(permission__in=levels)
+    return qs.values('file_id')
+
+
+def folder_ids(user, levels=None):
+    qs = FolderAccess.objects.filter(user=user).filter(not_expired())
+    if levels is not None:
+        qs = qs.filter(permission__in=levels)
+    return qs.values('folder_id')
+
+
+def has_access(user, obj, level=AccessLevel.VIEW):
+    """One-off check; views use the request's api.roles.Resolver instead."""
+    return roles.Resolver(user).allows(obj, level)
+
+
+def with_role(queryset, user):
+    """
+    Annotate a File or Folder queryset with ``access_role`` for ``user``:
+    OWNER, else the strongest live grant (EDIT before VIEW), else VIEW.
+    """
+    if queryset.model is File:
+        grants = FileAccess.objects.filter(file=OuterRef('pk'))
+    else:
+        grants = FolderAccess.objects.filter(folder=OuterRef('pk'))
+    best = grants.filter(user=user).filter(not_expired()).order_by(
+        Case(When(permission=AccessLevel.EDIT, then=Value(0)), default=Value(1))
+    ).values('permission')[:1]
+    return queryset.annotate(access_role=Case(
+        When(owner=user, then=Value(AccessLevel.OWNER)),
+        default=Coalesce(Subquery(best), Value(AccessLevel.VIEW)),
+    ))
+
+
+# --- maintenance -----------------------------------------------------------
+
+def _share_row(model, kind, share):
+    return model(
+        user_id=share.shared_with_id,
+        permission=share.permission,
+        expires_at=share.expires_at,
+        **{f'{kind}_id': getattr(share, f'{kind}_id'), f'{kind}_share': share},
+    )
+
+
+def folder_created(folder):
+    FolderAccess.objects.create(user_id=folder.owner_id, folder=folder, permission=AccessLevel.OWNER)
+
+
+def folder_owner_changed(folder):
+    FolderAccess.objects.filter(folder=folder, permission=AccessLevel.OWNER, folder_share__isnull=True).update(
+        user_id=folder.owner_id
+    )
+    roles.invalidate(folders=[folder.pk])
+
+
+def file_created(file):
+    FileAccess.objects.create(user_id=file.owner_id, file=file, permission=AccessLevel.OWNER)
+
+
+def file_owner_changed(file):
+    FileAccess.objects.filter(file=file, permission=AccessLevel.OWNER, file_share__isnull=True).update(
+        user_id=file.owner_id
+    )
+    roles.invalidate(files=[file.pk])
+
+
+def file_share_saved(share, created):
+    if created:
+        _share_row(FileAccess, 'file', share).save()
+    else:
+        FileAccess.objects.filter(file_share=share).update(
+            user_id=share.shared_with_id, permission=share.permission, expires_at=share.expires_at
+        )
+    roles.invalidate(files=[share.file_id])
+
+
+def folder_share_saved(share, created):
+    if created:
+        _share_row(FolderAccess, 'folder', share).save()
+    else:
+        FolderAccess.objects.filter(folder_share=share).update(
+            user_id=share.shared_with_id, permission=share.permission, expires_at=share.expires_at
+        )
+    roles.invalidate(folders=[share.folder_id])
+
+
+def file_share_deleted(share):
+    # Its access rows went with it (cascade)
+    roles.invalidate(files=[share.file_id])
+
+
+def folder_share_deleted(share):
+    roles.invalidate(folders=[share.folder_id])
+
+
+def file_shares_created(shares):
+    """file_share_saved for shares inserted with bulk_create."""
+    FileAccess.objects.bulk_create([_share_row(FileAccess, 'file', share) for share in shares], batch_size=BATCH_SIZE)
+    roles.invalidate(files={share.file_id for share in shares})
+
+
+def folder_shares_created(shares):
+    """folder_share_saved for shares inserted with bulk_create."""
+    FolderAccess.objects.bulk_create([_share_row(FolderAccess, 'folder', share) for share in shares], batch_size=BATCH_SIZE)
+    roles.invalidate(folders={share.folder_id for share in shares})
+
+
+def rebuild_all():
+    """Recompute both tables from scratch. Returns (folder_rows, file_rows)."""
+    counts = []
+    with transaction.atomic():
+        for kind, model, grants, shares in (
+            ('folder', Folder, FolderAccess, FolderShare),
+            ('file', File, FileAccess, FileShare),
+        ):
+            grants.objects.all().delete()
+            rows = [
+                grants(user_id=owner_id, permission=AccessLevel.OWNER, **{f'{kind}_id': pk})
+                for pk, owner_id in model.objects.values_list('pk', 'owner_id').iterator()
+            ]
+            rows += [_share_row(grants, kind, share) for share in shares.objects.iterator()]
+            grants.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+            counts.append(len(rows))
+        roles.invalidate(everything=True)
+    return tuple(counts)
@@ -0,0 +1,365 @@
+"""
+Buffered audit log writer.
+
+record() queues an AuditLog entry once the surrounding transaction commits
+(entries of rolled-back work are dropped, as before). Entries collect in a
+per-process buffer and are written with one multi-row INSERT, or COPY on
+PostgreSQL, when AUDIT_BUFFER_SIZE entries are waiting or every
+AUDIT_FLUSH_INTERVAL seconds, whichever comes first. AUDIT_BUFFER_SIZE = 0
+writes every entry immediately.
+
+Each buffered entry is also appended to this process's spool segment under
+AUDIT_SPOOL_DIR; a segment is removed once its entries are in the table. If
+a worker dies with a full buffer, or a flush fails, its segment stays behind
+and replay() (`manage.py flush_audit_spool`, also run when a process starts
+its flusher) loads it later. Entries keep the time they were recorded.
+
+Old rows are moved out of the hot table into monthly archive tables
+(api_auditlog_YYYY_MM) by archive(), see `manage.py archive_audit_log`.
+
+query() selects the entries a user may read (GET /api/audit/), filtered by
+file, folder, user, action and time, newest first; each filter has a
+composite index ending in (created_at, id). export() and aexport() stream
+those entries as CSV or NDJSON from a server-side cursor, a chunk at a time.
+"""
+import atexit
+import csv
+import io
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone as dt_timezone
+from itertools import islice
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import AuditLog, File, Folder, User
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ('user_id', 'file_id', 'folder_id', 'action', 'details', 'created_at')
+
+_buffer = []
+_lock = threading.Lock()        # buffer and spool segment
+_flush_lock = threading.Lock()  # one flush at a time
+_segment = None                 # (path, file handle) of the current spool segment
+_flusher = None
+
+
+def record(action, user=None, file=None, folder=None, details=None):
+    """Log ``action``; written after the current transaction commits."""
+    entry = {
+        'action': action,
+        'user_id': getattr(user, 'pk', user),
+        'file_id': _id(getattr(file, 'pk', file)),
+        'folder_id': _id(getattr(folder, 'pk', folder)),
+        'details': details or {},
+        'created_at': timezone.now().isoformat(),
+    }
+    transaction.on_commit(lambda: _enqueue(entry))
+
+
+def _id(value):
+    return None if value is None else str(value)
+
+
+def _enqueue(entry):
+    if not settings.AUDIT_BUFFER_SIZE:
+        write([entry])
+        return
+    with _lock:
+        _spool(entry)
+        _buffer.append(entry)
+        full = len(_buffer) >= settings.AUDIT_BUFFER_SIZE
+    _start_flusher()
+    if full:
+        flush()
+
+
+def _spool(entry):
+    global _segment
+    if _segment is None:
+        directory = Path(settings.AUDIT_SPOOL_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f'audit-{os.getpid()}-{uuid.uuid4().hex}.jsonl'
+        _segment = (path, open(path, 'a', encoding='utf-8'))
+    handle = _segment[1]
+    handle.write(json.dumps(entry) + '\n')
+    handle.flush()  # in the OS page cache: survives the process, not the machine
+
+
+def flush():
+    """Write everything buffered in this process. Returns the number of entries written."""
+    global _segment
+    with _flush_lock:
+        with _lock:
+            entries = _buffer[:]
+            del _buffer[:]
+            segment, _segment = _segment, None
+        if segment:
+            segment[1].close()
+        if not entries:
+            return 0
+        try:
+            write(entries)
+        except Exception:
+            logger.exception("Writing %d audit entries failed; kept in %s for replay", len(entries), segment[0])
+            return 0
+        if segment:
+            segment[0].unlink(missing_ok=True)
+        return len(entries)
+
+
+def _start_flusher():
+    global _flusher
+    if _flusher is None and settings.AUDIT_FLUSH_INTERVAL:
+        with _lock:
+            if _flusher is None:
+                _flusher = threading.Thread(target=_flush_periodically, name='audit-flush', daemon=True)
+                _flusher.start()
+                atexit.register(flush)
+
+
+def _flush_periodically():
+    try:
+        replay()
+    except Exception:
+        logger.exception("Replaying the audit spool failed")
+    while True:
+        time.sleep(settings.AUDIT_FLUSH_INTERVAL)
+        try:
+            flush()
+        except Exception:
+            logger.exception("Periodic audit flush failed")
+        finally:
+            close_old_connections()
+
+
+def replay(min_age=None):
+    """
+    Load spool segments left behind by dead processes or failed flushes.
+    Segments younger than ``min_age`` seconds (default AUDIT_SPOOL_STALE)
+    may belong to a live process and are left alone. Returns entries written.
+    """
+    min_age = settings.AUDIT_SPOOL_STALE if min_age is None else min_age
+    directory = Path(settings.AUDIT_SPOOL_DIR)
+    if not directory.is_dir():
+        return 0
+    current = _segment[0] if _segment else None
+    written = 0
+    for path in sorted(directory.glob('audit-*.jsonl')):
+        if path == current or time.time() - path.stat().st_mtime < min_age:
+            continue
+        claimed = path.with_suffix(f'.replay-{os.getpid()}')
+        try:
+            path.rename(claimed)  # another replaying process got there first if this fails
+        except OSError:
+            continue
+        entries = []
+        with open(claimed, encoding='utf-8') as handle:
+            for line in handle:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    pass  # torn last line of a crashed writer
+        try:
+            write(entries)
+        except Exception:
+            claimed.rename(path)
+            raise
+        claimed.unlink()
+        written += len(entries)
+    return written
+
+
+def write(entries):
+    """Insert ``entries`` (dicts as built by record()) in one statement per batch."""
+    if not entries:
+        return
+    _drop_dangling(entries)
+    rows = [
+        (e['user_id'], e['file_id'], e['folder_id'], e['action'], e['details'], parse_datetime(e['created_at']))
+        for e in entries
+    ]
+    with transaction.atomic():
+        if connection.vendor == 'postgresql' and _copy(rows):
+            return
+        AuditLog.objects.bulk_create(
+            [AuditLog(**dict(zip(COLUMNS, row))) for row in rows], batch_size=settings.AUDIT_BUFFER_SIZE or 500
+        )
+
+
+def _drop_dangling(entries):
+    # The object may be gone by the time its entry is written (a purge, say);
+    # keep the id in the details rather than failing the whole batch.
+    for column, model in (('file_id', File), ('folder_id', Folder), ('user_id', User)):
+        ids = {e[column] for e in entries if e[column] is not None}
+        if not ids:
+            continue
+        existing = {str(pk) for pk in model.objects.filter(pk__in=ids).values_list('pk', flat=True)}
+        for entry in entries:
+            if entry[column] is not None and str(entry[column]) not in existing:
+                entry['details'] = {**entry['details'], column[:-3]: str(entry[column])}
+                entry[column] = None
+
+
+def _copy(rows):
+    """COPY the rows in (psycopg 3). Returns False if the driver cannot."""
+    with connection.cursor() as cursor:
+        raw = cursor.cursor
+        if not hasattr(raw, 'copy'):
+            return False
+        columns = ', '.join(connection.ops.quote_name(c) for c in COLUMNS)
+        with raw.copy(f'COPY {AuditLog._meta.db_table} ({columns}) FROM STDIN') as copy:
+            for row in rows:
+                copy.write_row(row[:4] + (json.dumps(row[4]), row[5]))
+    return True
+
+
+# --- archiving -------------------------------------------------------------
+
+def archive_table(year, month):
+    return f'{AuditLog._meta.db_table}_{year:04d}_{month:02d}'
+
+
+def archive_tables():
+    pattern = re.compile(rf'^{AuditLog._meta.db_table}_\d{{4}}_\d{{2}}$')
+    return sorted(t for t in connection.introspection.table_names() if pattern.match(t))
+
+
+def _month_start(year, month):
+    year, month = year + (month - 1) // 12, (month - 1) % 12 + 1
+    return datetime(year, month, 1, tzinfo=dt_timezone.utc)
+
+
+def archive(months, batch_size=5000):
+    """
+    Move rows from before the start of the month ``months`` months ago into
+    their monthly archive tables, in batches. Returns {table: rows moved}.
+    """
+    now = timezone.now()
+    cutoff = _month_start(now.year, now.month - months)
+    oldest = AuditLog.objects.filter(created_at__lt=cutoff).order_by('created_at').values_list('created_at', flat=True).first()
+    moved = {}
+    if oldest is None:
+        return moved
+    oldest = oldest.astimezone(dt_timezone.utc)
+    start = _month_start(oldest.year, oldest.month)
+    qn = connection.ops.quote_name
+    hot = qn(AuditLog._meta.db_table)
+    while start < cutoff:
+        end = _month_start(start.year, start.month + 1)
+        table = archive_table(start.year, start.month)
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute(f'CREATE TABLE IF NOT EXISTS {qn(table)} (LIKE {hot} INCLUDING DEFAULTS)')
+            else:
+                cursor.execute(f'CREATE TABLE IF NOT EXISTS {qn(table)} AS SELECT * FROM {hot} WHERE 0')
+        rows = AuditLog.objects.filter(created_at__gte=start, created_at__lt=end).order_by('id')
+        while True:
+            with transaction.atomic():
+                ids = list(rows.values_list('id', flat=True)[:batch_size])
+                if not ids:
+                    break
+                placeholders = ', '.join(['%s'] * len(ids))
+                with connection.cursor() as cursor:
+                    cursor.execute(f'INSERT INTO {qn(table)} SELECT * FROM {hot} WHERE id IN ({placeholders})', ids)
+                    cursor.execute(f'DELETE FROM {hot} WHERE id IN ({placeholders})', ids)
+            moved[table] = moved.get(table, 0) + len(ids)
+        start = end
+    return moved
+
+
+# --- querying and export ---------------------------------------------------
+
+EXPORT_COLUMNS = ('id', 'created_at', 'action', 'user', 'username', 'file', 'folder', 'details')
+EXPORT_FIELDS = ('id', 'created_at', 'action', 'user_id', 'user__username', 'file_id', 'folder_id', 'details')
+EXPORT_FORMATS = {'csv': 'text/csv; charset=utf-8', 'ndjson': 'application/x-ndjson'}
+EXPORT_CHUNK_SIZE = 2000  # rows per cursor fetch and per streamed chunk
+
+
+def visible(user):
+    """Entries ``user`` may read: every entry for staff, otherwise those on their own files and folders and their own actions."""
+    if user.is_staff:
+        return AuditLog.objects.all()
+    return AuditLog.objects.filter(
+        Q(user=user)
+        | Q(file_id__in=File.objects.filter(owner=user).values('pk'))
+        | Q(folder_id__in=Folder.objects.filter(owner=user).values('pk'))
+    )
+
+
+def query(viewer, file=None, folder=None, user=None, action=None, since=None, until=None):
+    """Entries ``viewer`` may read, narrowed by any of the filters (``since`` inclusive, ``until`` exclusive)."""
+    queryset = visible(viewer)
+    filters = {'file_id': file, 'folder_id': folder, 'user_id': user, 'action': action,
+               'created_at__gte': since, 'created_at__lt': until}
+    return queryset.filter(**{lookup: value for lookup, value in filters.items() if value is not None})
+
+
+def _export_rows(queryset):
+    return queryset.order_by('-created_at', '-id').values_list(*EXPORT_FIELDS)
+
+
+class _Chunker:
+    """Formats rows into text, handing it out every EXPORT_CHUNK_SIZE rows."""
+
+    def __init__(self, fmt):
+        self.fmt = fmt
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+        self.rows = 0
+        if fmt == 'csv':
+            self.writer.writerow(EXPORT_COLUMNS)
+
+    def add(self, row):
+        entry = dict(zip(EXPORT_COLUMNS, row))
+        entry['created_at'] = entry['created_at'].isoformat()
+        if self.fmt == 'csv':
+            entry['details'] = json.dumps(entry['details'])
+            self.writer.writerow(entry.values())
+        else:
+            self.buffer.write(json.dumps(entry, default=str) + '\n')
+        self.rows += 1
+        return self.rows >= EXPORT_CHUNK_SIZE
+
+    def take(self):
+        text = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        self.rows = 0
+        return text
+
+
+def export(queryset, fmt):
+    """Yield ``queryset`` as ``fmt`` ('csv' or 'ndjson') text, reading it through a server-side cursor."""
+    chunker = _Chunker(fmt)
+    for row in _export_rows(queryset).iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        if chunker.add(row):
+            yield chunker.take()
+    yield chunker.take()
+
+
+async def aexport(queryset, fmt):
+    """export() for ASGI servers, which would otherwise read a sync stream into memory first."""
+    chunker = _Chunker(fmt)
+    # Same cursor as export(), fetched a chunk at a time in a worker thread
+    # (QuerySet.aiterator() runs values_list() queries on the event loop)
+    rows = _export_rows(queryset).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    while True:
+        chunk = await sync_to_async(list)(islice(rows, EXPORT_CHUNK_SIZE))
+        for row in chunk:
+            chunker.add(row)
+        yield chunker.take()
+        if len(chunk) < EXPORT_CHUNK_SIZE:
+            return
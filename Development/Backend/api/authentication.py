@@ -0,0 +1,115 @@
+"""
+JWT authentication without loading the whole user row.
+
+SimpleJWT's JWTAuthentication reads every column of api_user on each
+request, the base64 avatar included. JWTAuthentication here takes the user
+from a short-lived cache entry keyed by user id and token version, and on a
+miss selects only USER_FIELDS. The result is an ordinary User instance whose
+other fields are deferred: reading one (user.avatar) loads it then.
+
+Tokens carry the user's token_version in the ``ver`` claim (tokens without
+it count as version 0). Changing the password or deactivating the account
+bumps token_version (api.signals; call revoke() after queryset updates),
+which rejects every access and refresh token issued before it. Changing
+is_staff or is_superuser keeps the tokens but drops the cached identity.
+
+The cache is off unless AUTH_USER_CACHE names a CACHES alias shared by every
+worker process (e.g. Redis); then each request reads the row. Cached entries
+are dropped as the change commits, so it takes effect at once in every
+process sharing the cache. Any other process keeps serving its own entry,
+with the old password, active flag and privileges, for up to
+AUTH_USER_CACHE_TTL seconds.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import F
+from rest_framework_simplejwt import authentication, serializers
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import User
+
+VERSION_CLAIM = 'ver'
+
+# What authentication and permission checks read, in model field order (User.from_db needs it)
+USER_FIELDS = tuple(
+    field.attname for field in User._meta.concrete_fields
+    if field.attname in {'id', 'username', 'email', 'first_name', 'last_name', 'is_active', 'is_staff', 'is_superuser', 'token_version'}
+)
+
+
+def _cache():
+    alias = settings.AUTH_USER_CACHE
+    return caches[alias] if alias else None
+
+
+def _key(user_id, version):
+    return f'auth:user:{user_id}:{version}'
+
+
+def _forget_on_commit(user_id, version):
+    cache = _cache()
+    if cache is not None:
+        transaction.on_commit(lambda: cache.delete(_key(user_id, version)))
+
+
+def forget(user):
+    """Drop the cached identity of ``user`` once the transaction commits, keeping its tokens valid."""
+    version = User.objects.filter(pk=user.pk).values_list('token_version', flat=True).first()
+    if version is not None:
+        _forget_on_commit(user.pk, version)
+
+
+def revoke(user):
+    """Reject every token issued to ``user`` so far and forget the cached identity."""
+    version = User.objects.filter(pk=user.pk).values_list('token_version', flat=True).first()
+    if version is None:
+        return
+    User.objects.filter(pk=user.pk).update(token_version=F('token_version') + 1)
+    if 'token_version' in user.__dict__:
+        user.token_version = version + 1
+    _forget_on_commit(user.pk, version)
+
+
+class JWTAuthentication(authentication.JWTAuthentication):
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken("Token contained no recognizable user identification")
+        version = validated_token.get(VERSION_CLAIM, 0)
+
+        cache = _cache()
+        key = _key(user_id, version)
+        row = cache.get(key) if cache is not None else None
+        if row is None:
+            row = User.objects.filter(pk=user_id).values_list(*USER_FIELDS).first()
+            if row is None:
+                raise AuthenticationFailed("User not found", code='user_not_found')
+            fields = dict(zip(USER_FIELDS, row))
+            if not fields['is_active']:
+                raise AuthenticationFailed("User is inactive", code='user_inactive')
+            if fields['token_version'] != version:
+                raise AuthenticationFailed("Token has been revoked", code='token_revoked')
+            if cache is not None:
+                cache.set(key, row, settings.AUTH_USER_CACHE_TTL)
+        return User.from_db(DEFAULT_DB_ALIAS, USER_FIELDS, row)
+
+
+class TokenObtainPairSerializer(serializers.TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token[VERSION_CLAIM] = user.token_version  # copied into the access tokens it issues
+        return token
+
+
+class TokenRefreshSerializer(serializers.TokenRefreshSerializer):
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        user_id = refresh.payload.get(api_settings.USER_ID_CLAIM)
+        current = User.objects.filter(pk=user_id).values_list('token_version', flat=True).first()
+        if current is not None and current != refresh.payload.get(VERSION_CLAIM, 0):
+            raise AuthenticationFailed("Token has been revoked", code='token_revoked')
+        return super().validate(attrs)
@@ -0,0 +1,135 @@
+"""
+Batch file operations.
+
+Applies one operation (move, add/remove tags, archive, delete, restore) to a
+list of files or to every file in a folder's subtree. The files are selected
+with the permission filter in SQL, then changed with set-based UPDATEs in
+chunks of BATCH_SIZE inside one transaction.
+
+queryset.update() and bulk_update() skip the File signals, so the derived
+data those keep in step is updated here in bulk instead: storage counters
+(api.usage), tag links (api.tags) and search keywords (api.search). They
+skip File.save() too, so the UPDATEs bump each file's version themselves
+(api.concurrency). Audit rows are bulk-inserted, one per file, tagged with
+a shared batch id.
+"""
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import access, search, tags, usage
+from .models import AccessLevel, AuditLog, File, FolderClosure
+
+BATCH_SIZE = 500
+
+ACTIVE, ARCHIVED, DELETED = File.FileStatus.ACTIVE, File.FileStatus.ARCHIVED, File.FileStatus.DELETED
+
+# operation: (statuses it applies to, resulting status or None)
+OPERATIONS = {
+    'move': ((ACTIVE, ARCHIVED), None),
+    'add_tags': ((ACTIVE, ARCHIVED), None),
+    'remove_tags': ((ACTIVE, ARCHIVED), None),
+    'archive': ((ACTIVE,), ARCHIVED),
+    'delete': ((ACTIVE, ARCHIVED), DELETED),
+    'restore': ((DELETED, ARCHIVED), ACTIVE),
+}
+
+
+class TooManyFiles(Exception):
+    pass
+
+
+def select(user, operation, ids=None, folder=None):
+    """Files ``user`` may edit that ``operation`` applies to, by id list and/or subtree."""
+    statuses, _ = OPERATIONS[operation]
+    queryset = File.objects.filter(
+        status__in=statuses, pk__in=access.file_ids(user, access.SATISFIES[AccessLevel.EDIT])
+    )
+    if ids is not None:
+        queryset = queryset.filter(pk__in=ids)
+    if folder is not None:
+        queryset = queryset.filter(folder_id__in=FolderClosure.objects.filter(ancestor=folder).values('descendant_id'))
+    return queryset
+
+
+def apply(user, operation, ids=None, folder=None, target=None, names=()):
+    """
+    Run ``operation`` and return the ids of the files it changed. ``target``
+    is the destination folder of a move (None: top level), ``names`` the
+    tags to add or remove.
+    """
+    with transaction.atomic():
+        rows = list(
+            select(user, operation, ids, folder).select_for_update(of=('self',))
+            .order_by('pk').values_list('pk', 'owner_id', 'folder_id', 'size', 'status', 'tags', 'metadata')
+        )
+        if len(rows) > settings.FILE_BATCH_MAX:
+            raise TooManyFiles(f"At most {settings.FILE_BATCH_MAX} files per batch.")
+        batch_id = str(uuid.uuid4())
+        changed = []
+        for start in range(0, len(rows), BATCH_SIZE):
+            chunk = rows[start:start + BATCH_SIZE]
+            if operation == 'move':
+                changed += _move(chunk, target)
+            elif operation in ('add_tags', 'remove_tags'):
+                changed += _retag(chunk, operation, names)
+            else:
+                changed += _set_status(chunk, OPERATIONS[operation][1])
+        _audit(user, operation, changed, batch_id, target, names)
+    return [row[0] for row in changed]
+
+
+def _move(rows, target):
+    target_id = target.pk if target else None
+    rows = [row for row in rows if row[2] != target_id]
+    pks = [row[0] for row in rows]
+    File.objects.filter(pk__in=pks).update(folder_id=target_id, updated_at=timezone.now(), version=F('version') + 1)
+    usage.files_changed((row[1:5], (row[1], target_id) + row[3:5]) for row in rows)
+    return rows
+
+
+def _set_status(rows, status):
+    File.objects.filter(pk__in=[row[0] for row in rows]).update(
+        status=status, updated_at=timezone.now(), version=F('version') + 1
+    )
+    usage.files_changed((row[1:5], row[1:4] + (status,)) for row in rows)
+    return rows
+
+
+def _retag(rows, operation, names):
+    wanted = tags.normalize(names)
+    files, changed = [], []
+    for row in rows:
+        current = row[5] if isinstance(row[5], list) else []
+        present = {str(value).strip().casefold() for value in current if value is not None}
+        if operation == 'add_tags':
+            new = current + [name for slug, name in wanted.items() if slug not in present]
+        else:
+            new = [value for value in current if value is None or str(value).strip().casefold() not in wanted]
+        if new != current:
+            files.append(File(pk=row[0], tags=new, metadata=row[6], updated_at=timezone.now(), version=F('version') + 1))
+            changed.append(row)
+    File.objects.bulk_update(files, ['tags', 'updated_at', 'version'], batch_size=BATCH_SIZE)
+    pks = [file.pk for file in files]
+    if operation == 'add_tags':
+        tags.files_tagged(pks, wanted)
+    else:
+        tags.files_untagged(pks, list(wanted))
+    search.keywords_changed(files)
+    return changed
+
+
+def _audit(user, operation, rows, batch_id, target, names):
+    action = AuditLog.Action.DELETE if operation == 'delete' else AuditLog.Action.EDIT
+    details = {'action': operation, 'batch': batch_id}
+    if operation == 'move':
+        details['folder'] = str(target.pk) if target else None
+    elif operation in ('add_tags', 'remove_tags'):
+        details['tags'] = list(names)
+    AuditLog.objects.bulk_create(
+        [AuditLog(user=user, file_id=row[0], action=action, details=details) for row in rows],
+        batch_size=BATCH_SIZE,
+    )
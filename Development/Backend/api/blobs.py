@@ -0,0 +1,76 @@
+"""
+Reference counting for content-addressed blobs (see api.storage).
+
+Every File row pointing at a blob holds one reference. A blob's bytes are
+removed from storage only when its last reference is released.
+
+Writing and deleting are serialized on the Blob row. The storage puts or
+reuses a blob's bytes inside claim(), which holds the row lock (creating the
+row with no references if needed) until the enclosing transaction commits,
+so the File row that takes the reference must be saved in that same
+transaction. Bytes are only deleted under the same lock, after checking that
+the row still has no references. A concurrent upload of the same content
+therefore either waits and rewrites the bytes, or holds the lock first and
+keeps them.
+"""
+from contextlib import contextmanager
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from . import render
+from .models import Blob
+from .storage import blob_name, blob_storage, digest_from_name
+
+
+@contextmanager
+def claim(digest, size):
+    """Hold ``digest``'s Blob row while its bytes are put in place or reused."""
+    outer = transaction.get_connection().in_atomic_block
+    with transaction.atomic():
+        if not Blob.objects.select_for_update().filter(pk=digest).exists():
+            try:
+                with transaction.atomic():
+                    Blob.objects.create(sha256=digest, size=size, ref_count=0)
+            except IntegrityError:
+                # Inserted by a concurrent upload, which has committed by now
+                Blob.objects.select_for_update().filter(pk=digest).exists()
+        yield
+        if outer:
+            # Removed again if the writer's transaction commits without taking a reference
+            name = blob_name(digest)
+            transaction.on_commit(lambda: _delete_if_unreferenced(digest, name))
+
+
+def acquire(name, count=1):
+    digest = digest_from_name(name)
+    if not digest:
+        return
+    updated = Blob.objects.filter(pk=digest).update(ref_count=F('ref_count') + count)
+    if updated:
+        return
+    try:
+        with transaction.atomic():
+            Blob.objects.create(sha256=digest, size=blob_storage.size(name), ref_count=count)
+    except IntegrityError:
+        # Created concurrently by another upload of the same content
+        Blob.objects.filter(pk=digest).update(ref_count=F('ref_count') + count)
+
+
+def release(name, count=1):
+    digest = digest_from_name(name)
+    if not digest:
+        return
+    Blob.objects.filter(pk=digest).update(ref_count=F('ref_count') - count)
+    if Blob.objects.filter(pk=digest, ref_count__lte=0).exists():
+        transaction.on_commit(lambda: _delete_if_unreferenced(digest, name))
+
+
+def _delete_if_unreferenced(digest, name):
+    with transaction.atomic():
+        # The lock claim() takes: no upload can be reusing the bytes meanwhile
+        if not Blob.objects.select_for_update().filter(pk=digest, ref_count__lte=0).exists():
+            return
+        blob_storage.delete(name)
+        render.discard(digest)
+        Blob.objects.filter(pk=digest).delete()
@@ -0,0 +1,187 @@
+"""
+Document conversion routines run inside worker processes (see api.jobs).
+
+Kept free of Django imports so a freshly spawned worker only has to load
+python-docx / htmldocx before it can start.
+"""
+
+
+def limit_memory(max_bytes):
+    if not max_bytes:
+        return
+    try:
+        import resource
+    except ImportError:  # Windows: no per-process address-space limit
+        return
+    resource.setrlimit(resource.RLIMIT_AS, (max_bytes, max_bytes))
+
+
+def run(func_name, args, error_path):
+    """
+    Child-process entry point: call ``func_name(*args)`` from this module and
+    record any error message at ``error_path`` for the supervising thread.
+    """
+    try:
+        globals()[func_name](*args)
+    except BaseException as e:
+        with open(error_path, 'w', encoding='utf-8') as fh:
+            fh.write(str(e) or e.__class__.__name__)
+        raise SystemExit(1)
+
+
+def html_to_docx(html, out_path, max_bytes=None):
+    """Render ``html`` into a new DOCX written at ``out_path``."""
+    limit_memory(max_bytes)
+    from docx import Document
+    from htmldocx import HtmlToDocx
+
+    document = Document()
+    HtmlToDocx().add_html_to_document(html, document)
+    document.save(out_path)
+
+
+# --- block-level patching ---------------------------------------------------
+#
+# Top-level body paragraphs and tables are addressed by the Word 2010
+# ``w14:paraId`` of the paragraph (for tables, of their first paragraph).
+# Documents without paraIds get deterministic ones derived from the content
+# version, so the ids a client read from GET /files/{id}/blocks/ resolve to
+# the same blocks when its patch is applied, and are persisted from then on.
+
+W14_PARA_ID = '{http://schemas.microsoft.com/office/word/2010/wordml}paraId'
+W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+
+class PatchError(Exception):
+    pass
+
+
+def _is_block(el):
+    return el.tag in (W_NS + 'p', W_NS + 'tbl')
+
+
+def _id_holder(el):
+    if el.tag == W_NS + 'tbl':
+        return next(el.iter(W_NS + 'p'), None)
+    return el
+
+
+def block_id(el):
+    holder = _id_holder(el)
+    return holder.get(W14_PARA_ID) if holder is not None else None
+
+
+def set_block_id(el, value):
+    holder = _id_holder(el)
+    if holder is not None:
+        holder.set(W14_PARA_ID, value)
+
+
+def derived_id(seed, index):
+    import hashlib
+    digest = hashlib.sha256(f'{seed}:{index}'.encode()).digest()
+    # paraId must be below 0x80000000
+    return '%08X' % (int.from_bytes(digest[:4], 'big') & 0x7FFFFFFF)
+
+
+def unused_id(taken, seed, index):
+    """derived_id(seed, index), re-derived until it is not in ``taken``."""
+    candidate, attempt = derived_id(seed, index), 0
+    while candidate in taken:
+        attempt += 1
+        candidate = derived_id(f'{seed}#{attempt}', index)
+    return candidate
+
+
+def ensure_block_ids(document, seed):
+    blocks = [el for el in document.element.body.iterchildren() if _is_block(el)]
+    taken = {block_id(el) for el in blocks}
+    seen = set()
+    for index, el in enumerate(blocks):
+        # A block without an id, or repeating an earlier block's, gets a fresh one
+        if not block_id(el) or block_id(el) in seen:
+            new_id = unused_id(taken, seed, index)
+            set_block_id(el, new_id)
+            taken.add(new_id)
+        seen.add(block_id(el))
+    return blocks
+
+
+def describe_blocks(document, seed):
+    described = []
+    for el in ensure_block_ids(document, seed):
+        text = ''.join(t.text or '' for t in el.iter(W_NS + 't'))
+        kind = 'table' if el.tag == W_NS + 'tbl' else 'paragraph'
+        described.append({'id': block_id(el), 'type': kind, 'text': text})
+    return described
+
+
+def fragment_elements(html):
+    from copy import deepcopy
+    from docx import Document
+    from htmldocx import HtmlToDocx
+
+    scratch = Document()
+    HtmlToDocx().add_html_to_document(html, scratch)
+    return [deepcopy(el) for el in scratch.element.body.iterchildren() if _is_block(el)]
+
+
+def apply_changes(document, changes, seed):
+    """
+    Apply ``changes`` in order. Each change is one of
+    {"op": "replace", "id", "html"}, {"op": "delete", "id"} or
+    {"op": "insert", "after": id-or-null, "id", "html"}. An insert's id
+    must not already be in use.
+    """
+    body = document.element.body
+    index = {block_id(el): el for el in ensure_block_ids(document, seed)}
+
+    def target(block):
+        try:
+            return index[block]
+        except KeyError:
+            raise PatchError(f"Unknown block id {block!r}")
+
+    for number, change in enumerate(changes):
+        op = change['op']
+        if op == 'delete':
+            body.remove(target(change['id']))
+            del index[change['id']]
+            continue
+
+        if op == 'insert' and change['id'] in index:
+            raise PatchError(f"Block id {change['id']!r} is already in use")
+        new = fragment_elements(change['html'])
+        if op == 'replace':
+            old = target(change['id'])
+            for el in new:
+                old.addprevious(el)
+            body.remove(old)
+            del index[change['id']]
+        elif op == 'insert':
+            after = change.get('after')
+            if after:
+                anchor = target(after)
+                for el in reversed(new):
+                    anchor.addnext(el)
+            else:
+                for el in reversed(new):
+                    body.insert(0, el)
+        else:
+            raise PatchError(f"Unknown operation {op!r}")
+
+        # First new block carries the caller's id; extras get fresh ones
+        for offset, el in enumerate(new):
+            new_id = change['id'] if offset == 0 else unused_id(index, f'{seed}:{number}', offset)
+            set_block_id(el, new_id)
+            index[new_id] = el
+
+
+def patch_docx(in_path, changes, seed, out_path, max_bytes=None):
+    """Apply block ``changes`` to the DOCX at ``in_path`` and write ``out_path``."""
+    limit_memory(max_bytes)
+    from docx import Document
+
+    document = Document(in_path)
+    apply_changes(document, changes, seed)
+    document.save(out_path)
@@ -0,0 +1,128 @@
+"""
+Authenticated file downloads with conditional requests and byte ranges.
+
+When DOWNLOAD_OFFLOAD is configured the response carries only headers and
+the front web server (nginx X-Accel-Redirect or Apache/lighttpd X-Sendfile)
+streams the bytes, including Range handling, so Python workers are freed
+immediately.
+"""
+import mimetypes
+import re
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, quote_etag
+
+from .storage import digest_from_name
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+STREAM_CHUNK = 64 * 1024
+
+
+def content_version(file):
+    """Opaque token that changes whenever the file's bytes change."""
+    digest = digest_from_name(file.file.name)
+    if digest:
+        return digest
+    # Legacy (non content-addressed) names: bytes only change together with updated_at
+    return f'{file.pk.hex}-{int(file.updated_at.timestamp() * 1000000)}'
+
+
+def etag_for(file):
+    return quote_etag(content_version(file))
+
+
+def parse_range(header, size):
+    """
+    Parse a single ``bytes=`` range. Returns (start, end) inclusive, None to
+    serve the whole file, or False if the range cannot be satisfied.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match:
+        # Absent, malformed or multi-range: RFC 9110 allows ignoring it
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def content_type(file):
+    if file.type and '/' in file.type:
+        return file.type
+    return mimetypes.guess_type(file.name)[0] or 'application/octet-stream'
+
+
+def _read_range(fh, start, end):
+    try:
+        fh.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = fh.read(min(STREAM_CHUNK, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+    finally:
+        fh.close()
+
+
+def _offloaded(file):
+    mode = getattr(settings, 'DOWNLOAD_OFFLOAD', None)
+    response = HttpResponse()
+    if mode == 'x-accel-redirect':
+        response['X-Accel-Redirect'] = settings.DOWNLOAD_OFFLOAD_PREFIX.rstrip('/') + '/' + file.file.name
+    elif mode == 'x-sendfile':
+        response['X-Sendfile'] = file.file.path
+    else:
+        return None
+    # The front server computes the length and honours Range itself
+    return response
+
+
+def file_response(request, file, as_attachment=True):
+    etag = etag_for(file)
+    # Whole seconds: If-Modified-Since has no fraction, so a float would never compare equal
+    last_modified = int(file.updated_at.timestamp())
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    response = _offloaded(file)
+    if response is None:
+        size = file.file.size
+        requested = None
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if not if_range or if_range.strip() == etag:
+            requested = parse_range(request.META.get('HTTP_RANGE'), size)
+
+        if requested is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+        elif requested:
+            start, end = requested
+            response = StreamingHttpResponse(_read_range(file.file.open('rb'), start, end), status=206)
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response['Content-Length'] = str(end - start + 1)
+        else:
+            response = FileResponse(file.file.open('rb'))
+        response['Accept-Ranges'] = 'bytes'
+
+    if response.status_code != 416:
+        response['Content-Type'] = content_type(file)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = 'private, no-cache'
+    response['Content-Disposition'] = content_disposition_header(as_attachment, file.name)
+    return response
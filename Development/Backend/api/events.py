@@ -0,0 +1,158 @@
+"""
+Push delivery of notifications.
+
+GET /api/events/ is a Server-Sent Events stream of the user's new
+Notification rows (share, expiry and system events alike). The event id is
+the notification id, so a client that reconnects with Last-Event-ID is sent
+what it missed from the table before live events resume.
+
+Notifications are published after their transaction commits, through
+api.notifications.created() (called by the post_save signal and by bulk
+inserts). Each process fans events out to its own open
+streams. With EVENTS_BROKER set to the address of `manage.py
+run_event_broker`, events go through that relay instead, which repeats
+every message to every connected worker process. If the relay is down,
+events are delivered in-process only and other processes' clients catch up
+on their next reconnect.
+"""
+import asyncio
+import json
+import logging
+import socket
+import threading
+import time
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+_subscribers = defaultdict(set)  # user id -> {(loop, queue)}
+_lock = threading.Lock()
+_broker = None
+
+
+def payload(notification):
+    return {
+        'id': notification.pk,
+        'title': notification.title,
+        'message': notification.message,
+        'type': notification.type,
+        'is_read': notification.is_read,
+        'created_at': notification.created_at.isoformat() if notification.created_at else None,
+    }
+
+
+async def connect():
+    """Connect to EVENTS_BROKER if configured, waiting in a worker thread rather than on the event loop."""
+    if _broker is None and settings.EVENTS_BROKER:
+        await sync_to_async(_connect_broker, thread_sensitive=False)()
+
+
+def subscribe(user_id):
+    """Register a stream for ``user_id``; call from the event loop serving it, after connect()."""
+    queue = asyncio.Queue(maxsize=settings.EVENTS_QUEUE_SIZE)
+    entry = (asyncio.get_running_loop(), queue)
+    with _lock:
+        _subscribers[user_id].add(entry)
+    return entry
+
+
+def unsubscribe(user_id, entry):
+    with _lock:
+        _subscribers[user_id].discard(entry)
+        if not _subscribers[user_id]:
+            del _subscribers[user_id]
+
+
+def _offer(queue, event):
+    # A stream that has fallen this far behind reconnects and resumes from the table
+    if not queue.full():
+        queue.put_nowait(event)
+
+
+def deliver(user_id, event):
+    """Hand ``event`` to this process's streams for ``user_id`` (thread-safe)."""
+    with _lock:
+        entries = list(_subscribers.get(user_id, ()))
+    for loop, queue in entries:
+        try:
+            loop.call_soon_threadsafe(_offer, queue, event)
+        except RuntimeError:
+            pass  # loop already closed
+
+
+def publish(user_id, event):
+    broker = _connect_broker()
+    if broker is None or not broker.send(user_id, event):
+        deliver(user_id, event)
+
+
+def notifications_created(notifications):
+    """Publish notifications once the surrounding transaction commits."""
+    events = [(n.user_id, payload(n)) for n in notifications if n.pk is not None]
+    if events:
+        transaction.on_commit(lambda: [publish(user_id, event) for user_id, event in events])
+
+
+def _connect_broker():
+    global _broker
+    if _broker is None and settings.EVENTS_BROKER:
+        with _lock:
+            if _broker is None:
+                _broker = BrokerClient(settings.EVENTS_BROKER)
+    return _broker
+
+
+def parse_address(address):
+    host, _, port = address.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+class BrokerClient:
+    """
+    Connection to the run_event_broker relay. Messages are JSON lines
+    {"user": id, "event": {...}}; a reader thread delivers what the relay
+    repeats back, including this process's own messages.
+    """
+
+    RETRY_SECONDS = 5
+
+    def __init__(self, address):
+        self.address = parse_address(address)
+        self.sock = None
+        self.send_lock = threading.Lock()
+        self.connected = threading.Event()
+        threading.Thread(target=self._run, name='events-broker', daemon=True).start()
+        self.connected.wait(1)
+
+    def send(self, user_id, event):
+        if not self.connected.is_set():
+            return False
+        line = json.dumps({'user': user_id, 'event': event}).encode() + b'\n'
+        try:
+            with self.send_lock:
+                self.sock.sendall(line)
+            return True
+        except OSError:
+            return False
+
+    def _run(self):
+        warned = False
+        while True:
+            try:
+                with socket.create_connection(self.address) as sock:
+                    self.sock = sock
+                    self.connected.set()
+                    warned = False
+                    for line in sock.makefile('rb'):
+                        message = json.loads(line)
+                        deliver(message['user'], message['event'])
+            except (OSError, ValueError, KeyError) as e:
+                if not warned:
+                    logger.warning("Event broker %s:%s unavailable (%s); delivering in-process only", *self.address, e)
+                    warned = True
+            self.connected.clear()
+            time.sleep(self.RETRY_SECONDS)
@@ -0,0 +1,122 @@
+"""
+Share expiry.
+
+Permission checks already ignore shares past their ``expires_at`` (see
+access.not_expired). This module does the rest on a schedule
+(`manage.py sweep_share_expiry`): it reminds recipients shortly before a
+share expires, and once it has expired records an EXPIRY audit row holding
+the share's details, notifies the recipient and deletes the share. The
+FileAccess/FolderAccess rows created from it go with it (cascade).
+
+Both passes work through the partial ``*_expires_idx`` indexes in batches of
+SHARE_EXPIRY_BATCH_SIZE shares, one transaction per batch. A batch's
+notifications and audit rows commit together with the reminder_sent_at
+update or the delete that marks its shares done, so an interrupted sweep
+leaves nothing half-processed and the next run picks up where it stopped.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import notifications
+from .models import AuditLog, FileShare, FolderShare, Notification, NotificationType
+
+KINDS = ((FileShare, 'file'), (FolderShare, 'folder'))
+
+
+def _claim(queryset, kind, size):
+    # skip_locked lets two sweeps run side by side without handling a share twice
+    fields = ('shared_with', 'granted_by', 'permission', 'expires_at', f'{kind}__name')
+    return list(
+        queryset.select_related(kind).only(*fields)
+        .select_for_update(skip_locked=True, of=('self',))
+        .order_by('expires_at', 'id')[:size]
+    )
+
+
+def _batches(queryset, kind, size, apply):
+    done = 0
+    while True:
+        with transaction.atomic():
+            shares = _claim(queryset, kind, size)
+            if shares:
+                apply(shares)
+        done += len(shares)
+        if len(shares) < size:
+            return done
+
+
+def _notification(share, title, message):
+    return Notification(
+        user_id=share.shared_with_id, title=title, message=message, type=NotificationType.EXPIRY
+    )
+
+
+def send_reminders(now=None, hours=None, batch_size=None):
+    """Notify recipients of shares expiring within ``hours``; each share is reminded once."""
+    now = now or timezone.now()
+    hours = settings.SHARE_EXPIRY_REMINDER_HOURS if hours is None else hours
+    batch_size = batch_size or settings.SHARE_EXPIRY_BATCH_SIZE
+    sent = 0
+    for model, kind in KINDS:
+        pending = model.objects.filter(
+            expires_at__gt=now, expires_at__lte=now + timedelta(hours=hours), reminder_sent_at__isnull=True
+        )
+
+        def remind(shares, model=model, kind=kind):
+            notifications.created(Notification.objects.bulk_create([
+                _notification(
+                    share, "Share Expiring Soon",
+                    f"Your access to {kind} '{getattr(share, kind).name}' expires on "
+                    f"{timezone.localtime(share.expires_at):%Y-%m-%d %H:%M}.",
+                )
+                for share in shares
+            ]))
+            model.objects.filter(pk__in=[share.pk for share in shares]).update(reminder_sent_at=now)
+
+        sent += _batches(pending, kind, batch_size, remind)
+    return sent
+
+
+def expire(now=None, batch_size=None):
+    """Audit, notify and delete every share whose ``expires_at`` has passed."""
+    now = now or timezone.now()
+    batch_size = batch_size or settings.SHARE_EXPIRY_BATCH_SIZE
+    expired = 0
+    for model, kind in KINDS:
+        pending = model.objects.filter(expires_at__lte=now)
+
+        def remove(shares, model=model, kind=kind):
+            AuditLog.objects.bulk_create([
+                AuditLog(
+                    action=AuditLog.Action.EXPIRY,
+                    **{f'{kind}_id': getattr(share, f'{kind}_id')},
+                    details={
+                        'share': share.pk,
+                        'shared_with': share.shared_with_id,
+                        'granted_by': share.granted_by_id,
+                        'permission': share.permission,
+                        'expires_at': share.expires_at.isoformat(),
+                    },
+                )
+                for share in shares
+            ])
+            notifications.created(Notification.objects.bulk_create([
+                _notification(
+                    share, "Share Expired",
+                    f"Your access to {kind} '{getattr(share, kind).name}' has expired.",
+                )
+                for share in shares
+            ]))
+            model.objects.filter(pk__in=[share.pk for share in shares]).delete()
+
+        expired += _batches(pending, kind, batch_size, remove)
+    return expired
+
+
+def sweep(now=None, hours=None, batch_size=None):
+    """Run both passes. Returns (reminded, expired)."""
+    now = now or timezone.now()
+    return send_reminders(now, hours, batch_size), expire(now, batch_size)
@@ -0,0 +1,91 @@
+"""
+Folder hierarchy index.
+
+FolderClosure stores every (ancestor, descendant, depth) pair of the folder
+tree, so subtrees, breadcrumbs and "everything under this folder" are a
+single join instead of one query per level. Deleting a folder removes its
+rows through the foreign-key cascade (after api.signals has detached the
+subtree); creation and moves go through the helpers below.
+"""
+from django.db import transaction
+
+from .models import Folder, FolderClosure
+
+
+def folder_created(folder):
+    rows = [FolderClosure(ancestor_id=folder.pk, descendant_id=folder.pk, depth=0)]
+    if folder.parent_id:
+        rows += [
+            FolderClosure(ancestor_id=ancestor_id, descendant_id=folder.pk, depth=depth + 1)
+            for ancestor_id, depth in FolderClosure.objects.filter(
+                descendant_id=folder.parent_id
+            ).values_list('ancestor_id', 'depth')
+        ]
+    FolderClosure.objects.bulk_create(rows)
+
+
+def detach(folder):
+    """Drop the links from ``folder``'s subtree to the ancestors above it. Returns [(descendant, depth)]."""
+    subtree = list(FolderClosure.objects.filter(ancestor_id=folder.pk).values_list('descendant_id', 'depth'))
+    subtree_ids = [pk for pk, _ in subtree]
+    FolderClosure.objects.filter(descendant_id__in=subtree_ids).exclude(ancestor_id__in=subtree_ids).delete()
+    return subtree
+
+
+def folder_moved(folder):
+    """Re-attach ``folder`` and its whole subtree under ``folder.parent_id``."""
+    with transaction.atomic():
+        subtree = detach(folder)
+        if folder.parent_id:
+            ancestors = FolderClosure.objects.filter(descendant_id=folder.parent_id).values_list('ancestor_id', 'depth')
+            FolderClosure.objects.bulk_create([
+                FolderClosure(ancestor_id=ancestor_id, descendant_id=pk, depth=up + down + 1)
+                for ancestor_id, up in ancestors
+                for pk, down in subtree
+            ], batch_size=1000)
+
+
+def is_descendant(folder, candidate):
+    """True if ``candidate`` is ``folder`` itself or lies anywhere beneath it."""
+    return FolderClosure.objects.filter(ancestor_id=folder.pk, descendant_id=candidate.pk).exists()
+
+
+def expected_links():
+    """Compute the closure from Folder.parent. Returns ({(ancestor, descendant): depth}, cycles)."""
+    parents = dict(Folder.objects.values_list('pk', 'parent_id').iterator())
+    links = {}
+    cycles = []
+    for pk in parents:
+        node, depth, seen = pk, 0, set()
+        while node is not None:
+            if node in seen:
+                cycles.append(pk)
+                break
+            seen.add(node)
+            links[(node, pk)] = depth
+            node = parents.get(node)
+            depth += 1
+    return links, cycles
+
+
+def check():
+    """Compare stored rows with the adjacency list. Returns (missing, extra, cycles)."""
+    expected, cycles = expected_links()
+    stored = {
+        (a, d): depth
+        for a, d, depth in FolderClosure.objects.values_list('ancestor_id', 'descendant_id', 'depth').iterator()
+    }
+    missing = {key for key, depth in expected.items() if stored.get(key) != depth}
+    extra = {key for key in stored if key not in expected}
+    return missing, extra, cycles
+
+
+def rebuild():
+    expected, cycles = expected_links()
+    with transaction.atomic():
+        FolderClosure.objects.all().delete()
+        FolderClosure.objects.bulk_create([
+            FolderClosure(ancestor_id=a, descendant_id=d, depth=depth)
+            for (a, d), depth in expected.items()
+        ], batch_size=1000)
+    return len(expected), cycles
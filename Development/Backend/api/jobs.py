@@ -0,0 +1,212 @@
+"""
+Bounded background pool for document conversion.
+
+save_content hands the HTML to this pool and returns a job id straight away.
+At most CONVERSION_WORKERS conversions run at once, each in its own child
+process with a wall-clock timeout (CONVERSION_TIMEOUT) and an address-space
+limit (CONVERSION_MEMORY_LIMIT), so a pathological document cannot pin a web
+worker or exhaust memory. Up to CONVERSION_QUEUE_SIZE further jobs may wait;
+beyond that submit() raises PoolSaturated and the caller should back off.
+
+The file body, size, updated_at and the EDIT audit entry are written by the
+supervising thread once the child process has produced the DOCX. Block
+patches (save_content mode=patch) go through the same pool and are only
+committed if the file is still at the content version they were made from,
+and a save sent with If-Match only if the file is still at that version
+(api.concurrency).
+
+Jobs only live in the pool of the process that accepted them. A job left
+PENDING or RUNNING by a restart is marked FAILED once it is older than any
+live job can be (fail_orphaned(), run when a process starts its pool and by
+`manage.py purge_conversion_jobs`), and finished jobs are deleted after
+CONVERSION_JOB_RETENTION_DAYS (purge()).
+"""
+import math
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File as DjangoFile
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from . import audit, conversion, locks, render
+from .downloads import content_version
+from .models import AuditLog, ConversionJob, File
+
+
+class PoolSaturated(Exception):
+    pass
+
+
+class ConversionFailed(Exception):
+    pass
+
+
+class ConversionPool:
+
+    def __init__(self, workers, queue_size, timeout, memory_limit, start_method):
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.context = multiprocessing.get_context(start_method)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='conversion')
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+
+    def submit(self, job, func_name, args, base=None, version=None):
+        """Run ``conversion.<func_name>(*args, out_path, memory_limit)`` for ``job``."""
+        if not self.slots.acquire(blocking=False):
+            raise PoolSaturated()
+        try:
+            self.executor.submit(self._run, job.pk, func_name, args, base, version)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def _run(self, job_id, func_name, args, base, version):
+        close_old_connections()
+        try:
+            ConversionJob.objects.filter(pk=job_id).update(status=ConversionJob.JobStatus.RUNNING)
+            fd, out_path = tempfile.mkstemp(suffix='.docx')
+            os.close(fd)
+            try:
+                self._convert(func_name, (*args, out_path, self.memory_limit), out_path + '.err')
+                finish(job_id, out_path, base, version)
+            finally:
+                for path in (out_path, out_path + '.err'):
+                    if os.path.exists(path):
+                        os.unlink(path)
+        except Exception as e:
+            ConversionJob.objects.filter(pk=job_id).update(
+                status=ConversionJob.JobStatus.FAILED, error=str(e) or e.__class__.__name__,
+                finished_at=timezone.now(),
+            )
+        finally:
+            self.slots.release()
+            close_old_connections()
+
+    def _convert(self, func_name, args, error_path):
+        process = self.context.Process(
+            target=conversion.run, args=(func_name, args, error_path), daemon=True
+        )
+        process.start()
+        process.join(self.timeout)
+        if process.is_alive():
+            process.kill()
+            process.join()
+            raise ConversionFailed(f"Conversion timed out after {self.timeout} seconds")
+        if process.exitcode != 0:
+            message = f"Conversion failed (exit code {process.exitcode})"
+            if os.path.exists(error_path):
+                with open(error_path, encoding='utf-8') as fh:
+                    message = fh.read() or message
+            raise ConversionFailed(message)
+
+
+@transaction.atomic
+def finish(job_id, out_path, base=None, version=None):
+    job = ConversionJob.objects.select_related('user').get(pk=job_id)
+    # Row lock so concurrent patches against the same base cannot both land
+    file = File.objects.select_for_update().get(pk=job.file_id)
+    if base is not None and content_version(file) != base:
+        raise ConversionFailed("The document changed while the patch was being applied; reload and retry.")
+    if version is not None and file.version != version:
+        raise ConversionFailed("The file changed while it was being saved (If-Match); your changes were not applied.")
+    if locks.holder(file) not in (None, job.user_id):
+        raise ConversionFailed("Another user locked the file while it was being saved; your changes were not applied.")
+    with open(out_path, 'rb') as fh:
+        # Content-addressed storage: the previous blob is released on save
+        file.file.save(file.name, DjangoFile(fh), save=False)
+    file.size = file.file.size
+    file.save()
+
+    audit.record(
+        user=job.user,
+        file=file,
+        action=AuditLog.Action.EDIT,
+        details={'action': 'save_content', 'job': str(job.pk)}
+    )
+    job.status = ConversionJob.JobStatus.SUCCEEDED
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'finished_at'])
+    transaction.on_commit(lambda: render.prewarm(file))
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Whatever a previous run of this process left behind has no pool to finish it
+            fail_orphaned()
+            _pool = ConversionPool(
+                workers=settings.CONVERSION_WORKERS,
+                queue_size=settings.CONVERSION_QUEUE_SIZE,
+                timeout=settings.CONVERSION_TIMEOUT,
+                memory_limit=settings.CONVERSION_MEMORY_LIMIT,
+                start_method=settings.CONVERSION_START_METHOD,
+            )
+        return _pool
+
+
+def _submit(file, user, func_name, args, base=None, version=None):
+    job = ConversionJob.objects.create(file=file, user=user)
+    try:
+        get_pool().submit(job, func_name, args, base, version)
+    except PoolSaturated:
+        job.delete()
+        raise
+    return job
+
+
+def submit(file, user, html, version=None):
+    """
+    Queue a full HTML -> DOCX conversion. Raises PoolSaturated when the pool
+    is full. With ``version`` it is only saved if the file is still at it.
+    """
+    return _submit(file, user, 'html_to_docx', (html,), version=version)
+
+
+def submit_patch(file, user, changes, base, version=None):
+    """Queue a block patch against content version ``base`` of ``file``."""
+    return _submit(file, user, 'patch_docx', (file.file.path, changes, base), base=base, version=version)
+
+
+def max_job_age():
+    """Longest a job can stay PENDING or RUNNING in a live pool: every slot ahead of it timing out."""
+    waves = math.ceil((settings.CONVERSION_WORKERS + settings.CONVERSION_QUEUE_SIZE) / settings.CONVERSION_WORKERS)
+    return timedelta(seconds=waves * settings.CONVERSION_TIMEOUT)
+
+
+def fail_orphaned():
+    """
+    Mark PENDING/RUNNING jobs FAILED once no pool can still be working on
+    them (a process restarted or was killed). Returns how many.
+    """
+    now = timezone.now()
+    return ConversionJob.objects.filter(
+        status__in=[ConversionJob.JobStatus.PENDING, ConversionJob.JobStatus.RUNNING],
+        created_at__lt=now - max_job_age(),
+    ).update(
+        status=ConversionJob.JobStatus.FAILED,
+        error="The server restarted before this conversion finished; your changes were not applied.",
+        finished_at=now,
+    )
+
+
+def purge(days=None, batch_size=1000):
+    """Delete finished jobs older than the retention period. Returns how many."""
+    days = settings.CONVERSION_JOB_RETENTION_DAYS if days is None else days
+    finished = ConversionJob.objects.filter(finished_at__lt=timezone.now() - timedelta(days=days))
+    deleted = 0
+    while True:
+        pks = list(finished.order_by('finished_at').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        deleted += ConversionJob.objects.filter(pk__in=pks).delete()[0]
@@ -0,0 +1,67 @@
+"""
+Edit locks as leases.
+
+A lock is a lease recorded on the File row (locked_by, locked_at,
+lock_expires_at). It lasts FILE_LOCK_TTL seconds and the editor keeps it
+alive with heartbeats (POST /api/files/{id}/heartbeat/). A lease that is not
+renewed lapses on its own: it blocks nobody, the API shows the file as
+unlocked and the next acquire() takes it over. Locks taken before leases
+existed have no expiry and count as lapsed.
+
+acquire(), heartbeat() and release() are each a single conditional UPDATE,
+so two editors racing for a file cannot both win. Only users with EDIT
+access (api.access) match it. They bypass File.save() and its signals, which
+lock fields do not affect, and leave updated_at alone.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+
+from . import access
+from .models import AccessLevel, File
+
+
+def _lapsed(now):
+    return Q(locked_by__isnull=True) | Q(lock_expires_at__isnull=True) | Q(lock_expires_at__lte=now)
+
+
+def _editable(file_id, user):
+    return File.objects.filter(
+        pk=file_id, status=File.FileStatus.ACTIVE, pk__in=access.file_ids(user, access.SATISFIES[AccessLevel.EDIT])
+    )
+
+
+def holder(file, now=None):
+    """Id of the user whose lease on ``file`` is live, or None. Reads the loaded row only."""
+    now = now or timezone.now()
+    if file.locked_by_id is not None and file.lock_expires_at is not None and file.lock_expires_at > now:
+        return file.locked_by_id
+    return None
+
+
+def acquire(file_id, user, ttl=None):
+    """Take the lease, or renew it if ``user`` holds it. Returns its expiry, or None if refused."""
+    now = timezone.now()
+    expires = now + timedelta(seconds=ttl or settings.FILE_LOCK_TTL)
+    renewing = Q(locked_by=user, lock_expires_at__gt=now)
+    taken = _editable(file_id, user).filter(_lapsed(now) | Q(locked_by=user)).update(
+        locked_by=user,
+        locked_at=Case(When(renewing, then=F('locked_at')), default=Value(now)),
+        lock_expires_at=expires,
+    )
+    return expires if taken else None
+
+
+def heartbeat(file_id, user, ttl=None):
+    """Extend ``user``'s live lease. Returns the new expiry, or None if the lease was lost."""
+    now = timezone.now()
+    expires = now + timedelta(seconds=ttl or settings.FILE_LOCK_TTL)
+    renewed = _editable(file_id, user).filter(locked_by=user, lock_expires_at__gt=now).update(lock_expires_at=expires)
+    return expires if renewed else None
+
+
+def release(file_id, user):
+    """Give up ``user``'s lease. Returns False if they did not hold one."""
+    return bool(File.objects.filter(pk=file_id, locked_by=user).update(locked_by=None, locked_at=None, lock_expires_at=None))
@@ -0,0 +1,78 @@
+import os
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api import blobs
+from api.models import File
+from api.storage import BLOB_PREFIX, blob_storage
+
+
+class Command(BaseCommand):
+    help = (
+        "Move legacy uploads (e.g. media/uploads/...) into the content-addressed blob store, "
+        "repointing File rows in bulk so identical content is stored once."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Report what would change without writing.")
+        parser.add_argument(
+            '--delete-orphans', action='store_true',
+            help="Also delete files under uploads/ that no File row references.",
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        names = (
+            File.objects.exclude(file='').exclude(file__startswith=f'{BLOB_PREFIX}/')
+            .values_list('file', flat=True).distinct().order_by('file')
+        )
+        moved = rows = missing = 0
+        blobs_seen = set()
+        for name in names.iterator():
+            if not blob_storage.exists(name):
+                missing += 1
+                self.stderr.write(f"missing on disk: {name}")
+                continue
+            if dry_run:
+                moved += 1
+                continue
+            # Saving through the blob storage hashes while streaming and
+            # reuses an existing blob when the content is already stored.
+            # One transaction, so the blob stays locked until it is referenced.
+            with transaction.atomic():
+                with blob_storage.open(name, 'rb') as fh:
+                    new_name = blob_storage.save(name, fh)
+                count = File.objects.filter(file=name).update(file=new_name)
+                blobs.acquire(new_name, count)
+            blob_storage.delete(name)
+            blobs_seen.add(new_name)
+            moved += 1
+            rows += count
+
+        orphans = self.orphans()
+        for path in orphans:
+            if options['delete_orphans'] and not dry_run:
+                blob_storage.delete(path)
+                self.stdout.write(f"deleted orphan: {path}")
+            else:
+                self.stdout.write(f"orphan: {path}")
+
+        prefix = "[dry run] " if dry_run else ""
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}{moved} legacy files processed into {len(blobs_seen)} blobs "
+            f"({rows} rows repointed, {missing} missing, {len(orphans)} orphans)."
+        ))
+
+    def orphans(self):
+        root = blob_storage.path('uploads')
+        if not os.path.isdir(root):
+            return []
+        referenced = set(File.objects.filter(file__startswith='uploads/').values_list('file', flat=True))
+        found = []
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                rel = os.path.relpath(os.path.join(dirpath, filename), blob_storage.location).replace(os.sep, '/')
+                if rel not in referenced:
+                    found.append(rel)
+        return sorted(found)
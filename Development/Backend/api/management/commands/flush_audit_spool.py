@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from api import audit
+
+
+class Command(BaseCommand):
+    help = "Write audit entries left in the spool directory by crashed workers or failed flushes."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-age', type=int, default=None,
+            help="Only replay spool files untouched for this many seconds (default: settings.AUDIT_SPOOL_STALE).",
+        )
+
+    def handle(self, *args, **options):
+        written = audit.replay(options['min_age'])
+        self.stdout.write(self.style.SUCCESS(f"Replayed {written} audit entries."))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from api import jobs
+
+
+class Command(BaseCommand):
+    help = (
+        "Mark conversion jobs orphaned by a restart as failed, then delete finished jobs older than "
+        "the retention period, in batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help="Retention (default: settings.CONVERSION_JOB_RETENTION_DAYS).")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows deleted per statement (default: 1000).")
+
+    def handle(self, *args, **options):
+        orphaned = jobs.fail_orphaned()
+        deleted = jobs.purge(options['days'], options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Marked {orphaned} orphaned jobs as failed and deleted {deleted} finished jobs."
+        ))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from api import notifications
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete read notifications older than the retention period and read notifications beyond "
+        "the per-user limit, in batches. Unread notifications are kept."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help="Retention (default: settings.NOTIFICATION_RETENTION_DAYS).")
+        parser.add_argument('--keep', type=int, default=None, help="Read notifications kept per user (default: settings.NOTIFICATION_MAX_READ).")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows deleted per statement (default: 1000).")
+
+    def handle(self, *args, **options):
+        expired, surplus = notifications.purge(options['days'], options['keep'], options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {expired} expired and {surplus} surplus read notifications."
+        ))
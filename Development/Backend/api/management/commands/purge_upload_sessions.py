@@ -0,0 +1,23 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api import uploads
+from api.models import UploadSession
+
+
+class Command(BaseCommand):
+    help = "Abort chunked upload sessions that have seen no activity for a while and delete their parts."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24, help="Inactivity threshold (default: 24).")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options['hours'])
+        stale = UploadSession.objects.filter(status=UploadSession.SessionStatus.ACTIVE, updated_at__lt=cutoff)
+        count = 0
+        for session in stale.iterator():
+            uploads.abort(session)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f"Aborted {count} stale upload sessions."))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from api import access
+
+
+class Command(BaseCommand):
+    help = "Rebuild the FileAccess/FolderAccess tables from ownership and share rows."
+
+    def handle(self, *args, **options):
+        folder_rows, file_rows = access.rebuild_all()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt access table: {folder_rows} folder rows, {file_rows} file rows."
+        ))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import hierarchy
+
+
+class Command(BaseCommand):
+    help = "Rebuild the FolderClosure hierarchy index from Folder.parent, or check it with --check."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help="Only report differences between the index and Folder.parent; exit non-zero if any.",
+        )
+
+    def handle(self, *args, **options):
+        if options['check']:
+            missing, extra, cycles = hierarchy.check()
+            for ancestor, descendant in sorted(missing, key=str):
+                self.stdout.write(f"missing or wrong depth: {ancestor} -> {descendant}")
+            for ancestor, descendant in sorted(extra, key=str):
+                self.stdout.write(f"stale: {ancestor} -> {descendant}")
+            for pk in cycles:
+                self.stdout.write(f"cycle through folder {pk}")
+            if missing or extra or cycles:
+                raise CommandError(
+                    f"Folder tree index is inconsistent: {len(missing)} missing, {len(extra)} stale, {len(cycles)} cycles."
+                )
+            self.stdout.write(self.style.SUCCESS("Folder tree index is consistent."))
+            return
+
+        rows, cycles = hierarchy.rebuild()
+        for pk in cycles:
+            self.stderr.write(f"cycle through folder {pk}; its path was truncated")
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt folder tree index: {rows} rows."))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api import tags
+
+
+class Command(BaseCommand):
+    help = "Rebuild the normalized tag index (Tag, FileTag, FolderTag) from the File/Folder tags fields."
+
+    def handle(self, *args, **options):
+        file_links, folder_links = tags.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt tag index: {file_links} file links, {folder_links} folder links."))
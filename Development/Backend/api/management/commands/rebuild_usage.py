@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import usage
+
+
+class Command(BaseCommand):
+    help = "Recompute the StorageUsage/FolderUsage counters from File rows, or check them with --check."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help="Only report counters that differ from the File rows; exit non-zero if any.",
+        )
+
+    def handle(self, *args, **options):
+        if options['check']:
+            users, folders = usage.check()
+            for pk in users:
+                self.stdout.write(f"user {pk}: counter out of date")
+            for pk in folders:
+                self.stdout.write(f"folder {pk}: counter out of date")
+            if users or folders:
+                raise CommandError(
+                    f"Storage counters are inconsistent: {len(users)} users, {len(folders)} folders."
+                )
+            self.stdout.write(self.style.SUCCESS("Storage counters are consistent."))
+            return
+
+        users, folders = usage.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt storage counters: {users} users, {folders} folders."))
@@ -0,0 +1,47 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.events import parse_address
+
+
+class Command(BaseCommand):
+    help = (
+        "Relay push notification events between web worker processes. Point EVENTS_BROKER "
+        "at the address it listens on; every line one worker sends is repeated to all of them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--bind', default=settings.EVENTS_BROKER or '127.0.0.1:8765',
+            help="host:port to listen on (default: settings.EVENTS_BROKER or 127.0.0.1:8765).",
+        )
+
+    def handle(self, *args, **options):
+        host, port = parse_address(options['bind'])
+        try:
+            asyncio.run(self.serve(host, port))
+        except KeyboardInterrupt:
+            pass
+
+    async def serve(self, host, port):
+        workers = set()
+
+        async def relay(reader, writer):
+            workers.add(writer)
+            try:
+                while line := await reader.readline():
+                    for worker in list(workers):
+                        worker.write(line)
+                    await asyncio.gather(*(w.drain() for w in list(workers)), return_exceptions=True)
+            except ConnectionError:
+                pass
+            finally:
+                workers.discard(writer)
+                writer.close()
+
+        server = await asyncio.start_server(relay, host, port)
+        self.stdout.write(self.style.SUCCESS(f"Relaying events on {host}:{port}"))
+        async with server:
+            await server.serve_forever()
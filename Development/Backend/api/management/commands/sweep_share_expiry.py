@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from api import expiry
+
+
+class Command(BaseCommand):
+    help = (
+        "Remind recipients of shares about to expire, then audit, notify and delete expired shares. "
+        "Safe to re-run after an interruption; schedule it e.g. every 15 minutes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours', type=int, default=None,
+            help="Reminder window before expiry (default: settings.SHARE_EXPIRY_REMINDER_HOURS).",
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=None,
+            help="Shares handled per transaction (default: settings.SHARE_EXPIRY_BATCH_SIZE).",
+        )
+
+    def handle(self, *args, **options):
+        reminded, expired = expiry.sweep(hours=options['hours'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Sent {reminded} expiry reminders; expired {expired} shares."))
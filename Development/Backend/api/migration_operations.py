@@ -0,0 +1,67 @@
+"""
+Index operations that do not block writes on PostgreSQL.
+
+Like django.contrib.postgres.operations.AddIndexConcurrently, but usable on
+every backend (and without a PostgreSQL driver installed): on PostgreSQL the
+index is built or dropped CONCURRENTLY, elsewhere the plain DDL is used.
+Migrations using them must set ``atomic = False``.
+"""
+from django.db import NotSupportedError, migrations
+
+
+def _concurrent(schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return False
+    if schema_editor.connection.in_atomic_block:
+        raise NotSupportedError(
+            "Concurrent index operations must run in a migration with atomic = False."
+        )
+    return True
+
+
+class AddIndexConcurrently(migrations.AddIndex):
+
+    def describe(self):
+        description = super().describe()
+        return f"Concurrently {description[0].lower()}{description[1:]}"
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            if _concurrent(schema_editor):
+                schema_editor.add_index(model, self.index, concurrently=True)
+            else:
+                schema_editor.add_index(model, self.index)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            if _concurrent(schema_editor):
+                schema_editor.remove_index(model, self.index, concurrently=True)
+            else:
+                schema_editor.remove_index(model, self.index)
+
+
+class RemoveIndexConcurrently(migrations.RemoveIndex):
+
+    def describe(self):
+        description = super().describe()
+        return f"Concurrently {description[0].lower()}{description[1:]}"
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            index = from_state.models[app_label, self.model_name_lower].get_index_by_name(self.name)
+            if _concurrent(schema_editor):
+                schema_editor.remove_index(model, index, concurrently=True)
+            else:
+                schema_editor.remove_index(model, index)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            index = to_state.models[app_label, self.model_name_lower].get_index_by_name(self.name)
+            if _concurrent(schema_editor):
+                schema_editor.add_index(model, index, concurrently=True)
+            else:
+                schema_editor.add_index(model, index)
@@ -0,0 +1,201 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:30
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def populate_access(apps, schema_editor):
+    Folder = apps.get_model("api", "Folder")
+    File = apps.get_model("api", "File")
+    FolderShare = apps.get_model("api", "FolderShare")
+    FileShare = apps.get_model("api", "FileShare")
+    FolderAccess = apps.get_model("api", "FolderAccess")
+    FileAccess = apps.get_model("api", "FileAccess")
+
+    FolderAccess.objects.bulk_create(
+        [
+            FolderAccess(user_id=owner_id, folder_id=pk, permission="OWNER")
+            for pk, owner_id in Folder.objects.values_list("pk", "owner_id")
+        ]
+        + [
+            FolderAccess(
+                user_id=s.shared_with_id,
+                folder_id=s.folder_id,
+                permission=s.permission,
+                expires_at=s.expires_at,
+                folder_share=s,
+            )
+            for s in FolderShare.objects.all()
+        ],
+        batch_size=1000,
+    )
+    rows = [
+        FileAccess(user_id=owner_id, file_id=pk, permission="OWNER")
+        for pk, owner_id in File.objects.values_list("pk", "owner_id")
+    ]
+    rows += [
+        FileAccess(
+            user_id=s.shared_with_id,
+            file_id=s.file_id,
+            permission=s.permission,
+            expires_at=s.expires_at,
+            file_share=s,
+        )
+        for s in FileShare.objects.all()
+    ]
+    for s in FolderShare.objects.all():
+        rows += [
+            FileAccess(
+                user_id=s.shared_with_id,
+                file_id=pk,
+                permission=s.permission,
+                expires_at=s.expires_at,
+                folder_share=s,
+            )
+            for pk in File.objects.filter(folder_id=s.folder_id).values_list(
+                "pk", flat=True
+            )
+        ]
+    FileAccess.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0012_alter_auditlog_action_alter_file_size_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FileAccess",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "permission",
+                    models.CharField(
+                        choices=[
+                            ("OWNER", "Owner"),
+                            ("EDIT", "Edit"),
+                            ("VIEW", "View Only"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                ("expires_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "file",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="access",
+                        to="api.file",
+                    ),
+                ),
+                (
+                    "file_share",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="access",
+                        to="api.fileshare",
+                    ),
+                ),
+                (
+                    "folder_share",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="file_access",
+                        to="api.foldershare",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="file_access",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["user", "file", "permission", "expires_at"],
+                        name="fileaccess_lookup_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="FolderAccess",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "permission",
+                    models.CharField(
+                        choices=[
+                            ("OWNER", "Owner"),
+                            ("EDIT", "Edit"),
+                            ("VIEW", "View Only"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                ("expires_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "folder",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="access",
+                        to="api.folder",
+                    ),
+                ),
+                (
+                    "folder_share",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="access",
+                        to="api.foldershare",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="folder_access",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["user", "folder", "permission", "expires_at"],
+                        name="folderaccess_lookup_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(populate_access, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0013_effective_access"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="file",
+            index=models.Index(fields=["updated_at", "id"], name="file_updated_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="file",
+            index=models.Index(
+                fields=["owner", "updated_at", "id"], name="file_owner_updated_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="fileshare",
+            index=models.Index(
+                fields=["created_at", "id"], name="fileshare_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="fileshare",
+            index=models.Index(
+                fields=["shared_with", "created_at", "id"],
+                name="fileshare_recipient_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="folder",
+            index=models.Index(fields=["updated_at", "id"], name="folder_updated_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="folder",
+            index=models.Index(
+                fields=["owner", "updated_at", "id"], name="folder_owner_updated_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="foldershare",
+            index=models.Index(
+                fields=["created_at", "id"], name="foldershare_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="foldershare",
+            index=models.Index(
+                fields=["shared_with", "created_at", "id"],
+                name="foldershare_recipient_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(
+                fields=["user", "created_at", "id"],
+                name="notification_user_created_idx",
+            ),
+        ),
+    ]
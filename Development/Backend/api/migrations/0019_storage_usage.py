@@ -0,0 +1,156 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:44
+
+import re
+from collections import defaultdict
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+SIZE_RE = re.compile(r"^\s*([\d.]+)\s*([kmgt]?i?b|bytes?)?\s*$", re.IGNORECASE)
+UNITS = {"k": 1024, "m": 1024**2, "g": 1024**3, "t": 1024**4}
+
+
+def parse_size(value):
+    """Bytes from legacy strings such as "2048", "2.4 MB" or "12 KB"."""
+    match = SIZE_RE.match(value or "")
+    if not match:
+        return 0
+    try:
+        number = float(match.group(1))
+    except ValueError:
+        return 0
+    unit = (match.group(2) or "b")[0].lower()
+    return int(number * UNITS.get(unit, 1))
+
+
+def populate_size_bytes(apps, schema_editor):
+    File = apps.get_model("api", "File")
+    batch = []
+    for f in File.objects.only("pk", "file", "size").iterator(chunk_size=1000):
+        try:
+            # The stored bytes are authoritative when they are still present
+            f.size_bytes = f.file.size if f.file else parse_size(f.size)
+        except (OSError, ValueError):
+            f.size_bytes = parse_size(f.size)
+        batch.append(f)
+        if len(batch) >= 1000:
+            File.objects.bulk_update(batch, ["size_bytes"])
+            batch = []
+    File.objects.bulk_update(batch, ["size_bytes"])
+
+
+def populate_usage(apps, schema_editor):
+    File = apps.get_model("api", "File")
+    Folder = apps.get_model("api", "Folder")
+    FolderClosure = apps.get_model("api", "FolderClosure")
+    FolderUsage = apps.get_model("api", "FolderUsage")
+    StorageUsage = apps.get_model("api", "StorageUsage")
+
+    StorageUsage.objects.bulk_create(
+        [
+            StorageUsage(
+                user_id=row["owner_id"], used_bytes=row["b"] or 0, file_count=row["n"]
+            )
+            for row in File.objects.values("owner_id").annotate(
+                b=Sum("size"), n=Count("pk")
+            )
+        ],
+        batch_size=1000,
+    )
+    direct = {
+        row["folder_id"]: (row["b"] or 0, row["n"])
+        for row in File.objects.filter(status="ACTIVE", folder__isnull=False)
+        .values("folder_id")
+        .annotate(b=Sum("size"), n=Count("pk"))
+    }
+    totals = defaultdict(lambda: [0, 0])
+    for ancestor_id, descendant_id in FolderClosure.objects.values_list(
+        "ancestor_id", "descendant_id"
+    ).iterator():
+        b, n = direct.get(descendant_id, (0, 0))
+        totals[ancestor_id][0] += b
+        totals[ancestor_id][1] += n
+    FolderUsage.objects.bulk_create(
+        [
+            FolderUsage(
+                folder_id=pk,
+                bytes=direct.get(pk, (0, 0))[0],
+                file_count=direct.get(pk, (0, 0))[1],
+                total_bytes=totals[pk][0],
+                total_files=totals[pk][1],
+            )
+            for pk in Folder.objects.values_list("pk", flat=True)
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0018_conversion_jobs"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FolderUsage",
+            fields=[
+                (
+                    "folder",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="usage",
+                        serialize=False,
+                        to="api.folder",
+                    ),
+                ),
+                ("bytes", models.BigIntegerField(default=0)),
+                ("file_count", models.IntegerField(default=0)),
+                ("total_bytes", models.BigIntegerField(default=0)),
+                ("total_files", models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="StorageUsage",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="storage_usage",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("used_bytes", models.BigIntegerField(default=0)),
+                ("file_count", models.IntegerField(default=0)),
+                ("quota_bytes", models.BigIntegerField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="file",
+            name="size_bytes",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_size_bytes, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name="file",
+            name="size",
+        ),
+        migrations.RenameField(
+            model_name="file",
+            old_name="size_bytes",
+            new_name="size",
+        ),
+        migrations.RunPython(populate_usage, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="file",
+            index=models.Index(
+                fields=["owner", "status", "size", "id"], name="file_owner_size_idx"
+            ),
+        ),
+    ]
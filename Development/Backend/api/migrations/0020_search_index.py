@@ -0,0 +1,139 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+POSTGRES_INDEX = [
+    """
+    ALTER TABLE api_searchdocument ADD COLUMN vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(keywords, '')), 'B') ||
+        setweight(to_tsvector('simple', coalesce(description, '')), 'C') ||
+        setweight(to_tsvector('simple', coalesce(body, '')), 'D')
+    ) STORED
+    """,
+    "CREATE INDEX api_searchdocument_vector_idx ON api_searchdocument USING GIN (vector)",
+]
+POSTGRES_DROP = [
+    "DROP INDEX IF EXISTS api_searchdocument_vector_idx",
+    "ALTER TABLE api_searchdocument DROP COLUMN IF EXISTS vector",
+]
+
+SQLITE_COLUMNS = "title, description, keywords, body"
+SQLITE_INDEX = [
+    f"""
+    CREATE VIRTUAL TABLE api_searchdocument_fts USING fts5(
+        {SQLITE_COLUMNS}, content='api_searchdocument', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    f"""
+    CREATE TRIGGER api_searchdocument_fts_ai AFTER INSERT ON api_searchdocument BEGIN
+        INSERT INTO api_searchdocument_fts(rowid, {SQLITE_COLUMNS})
+        VALUES (new.id, new.title, new.description, new.keywords, new.body);
+    END
+    """,
+    f"""
+    CREATE TRIGGER api_searchdocument_fts_ad AFTER DELETE ON api_searchdocument BEGIN
+        INSERT INTO api_searchdocument_fts(api_searchdocument_fts, rowid, {SQLITE_COLUMNS})
+        VALUES ('delete', old.id, old.title, old.description, old.keywords, old.body);
+    END
+    """,
+    f"""
+    CREATE TRIGGER api_searchdocument_fts_au AFTER UPDATE ON api_searchdocument BEGIN
+        INSERT INTO api_searchdocument_fts(api_searchdocument_fts, rowid, {SQLITE_COLUMNS})
+        VALUES ('delete', old.id, old.title, old.description, old.keywords, old.body);
+        INSERT INTO api_searchdocument_fts(rowid, {SQLITE_COLUMNS})
+        VALUES (new.id, new.title, new.description, new.keywords, new.body);
+    END
+    """,
+]
+SQLITE_DROP = [
+    "DROP TRIGGER IF EXISTS api_searchdocument_fts_ai",
+    "DROP TRIGGER IF EXISTS api_searchdocument_fts_ad",
+    "DROP TRIGGER IF EXISTS api_searchdocument_fts_au",
+    "DROP TABLE IF EXISTS api_searchdocument_fts",
+]
+
+
+def _run(schema_editor, statements):
+    for sql in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def create_fulltext_index(apps, schema_editor):
+    # Other backends fall back to substring matching in api.search
+    _run(schema_editor, {"postgresql": POSTGRES_INDEX, "sqlite": SQLITE_INDEX})
+
+
+def drop_fulltext_index(apps, schema_editor):
+    _run(schema_editor, {"postgresql": POSTGRES_DROP, "sqlite": SQLITE_DROP})
+
+
+def _words(value):
+    if isinstance(value, dict):
+        return [w for k, v in value.items() for w in [str(k)] + _words(v)]
+    if isinstance(value, (list, tuple)):
+        return [w for v in value for w in _words(v)]
+    return [] if value is None else [str(value)]
+
+
+def populate_documents(apps, schema_editor):
+    # Names, descriptions, tags and metadata; document text is extracted by
+    # `manage.py rebuild_search_index`
+    File = apps.get_model("api", "File")
+    SearchDocument = apps.get_model("api", "SearchDocument")
+    SearchDocument.objects.bulk_create(
+        (
+            SearchDocument(
+                file_id=f.pk,
+                title=f.name,
+                description=f.description,
+                keywords=" ".join(_words(f.tags) + _words(f.metadata)),
+            )
+            for f in File.objects.only(
+                "pk", "name", "description", "tags", "metadata"
+            ).iterator(chunk_size=1000)
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0019_storage_usage"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SearchDocument",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("title", models.TextField(blank=True)),
+                ("description", models.TextField(blank=True)),
+                ("keywords", models.TextField(blank=True)),
+                ("body", models.TextField(blank=True)),
+                ("content_version", models.CharField(blank=True, max_length=64)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "file",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="search_document",
+                        to="api.file",
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(create_fulltext_index, drop_fulltext_index),
+        migrations.RunPython(populate_documents, migrations.RunPython.noop),
+    ]
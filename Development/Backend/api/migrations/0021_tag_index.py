@@ -0,0 +1,159 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_tags(apps, schema_editor):
+    Tag = apps.get_model("api", "Tag")
+    links = [
+        (apps.get_model("api", "File"), apps.get_model("api", "FileTag"), "file_id"),
+        (
+            apps.get_model("api", "Folder"),
+            apps.get_model("api", "FolderTag"),
+            "folder_id",
+        ),
+    ]
+    rows = []
+    names = {}
+    for model, link_model, column in links:
+        for pk, values in model.objects.values_list("pk", "tags").iterator():
+            if not isinstance(values, list):
+                continue
+            for value in values:
+                name = str(value).strip()[:100] if value is not None else ""
+                if name:
+                    # As api.tags.normalize: cut again after casefolding, which can lengthen it
+                    slug = name.casefold()[:100]
+                    names.setdefault(slug, name)
+                    rows.append((link_model, column, pk, slug))
+    Tag.objects.bulk_create(
+        [Tag(slug=slug, name=name) for slug, name in names.items()], batch_size=1000
+    )
+    ids = dict(Tag.objects.values_list("slug", "id"))
+    for _, link_model, column in links:
+        link_model.objects.bulk_create(
+            [
+                link_model(**{column: pk, "tag_id": ids[slug]})
+                for model, col, pk, slug in rows
+                if model is link_model
+            ],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0020_search_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Tag",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=100)),
+                ("slug", models.CharField(max_length=100, unique=True)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["slug"],
+                        name="tag_slug_prefix_idx",
+                        opclasses=["varchar_pattern_ops"],
+                    )
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="FolderTag",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "folder",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="tag_links",
+                        to="api.folder",
+                    ),
+                ),
+                (
+                    "tag",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="folder_links",
+                        to="api.tag",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["tag", "folder"], name="foldertag_tag_idx")
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("folder", "tag"), name="foldertag_unique_pair"
+                    )
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="FileTag",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "file",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="tag_links",
+                        to="api.file",
+                    ),
+                ),
+                (
+                    "tag",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="file_links",
+                        to="api.tag",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["tag", "file"], name="filetag_tag_idx")
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("file", "tag"), name="filetag_unique_pair"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(populate_tags, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:53
+
+from django.db import migrations, models
+
+from api.migration_operations import AddIndexConcurrently, RemoveIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # CREATE/DROP INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ("api", "0021_tag_index"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="file",
+            index=models.Index(
+                condition=models.Q(("status", "ACTIVE")),
+                fields=["owner", "updated_at", "id"],
+                name="file_active_owner_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="file",
+            index=models.Index(
+                condition=models.Q(("status", "ACTIVE")),
+                fields=["folder", "updated_at", "id"],
+                name="file_active_folder_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="fileshare",
+            index=models.Index(
+                fields=["shared_with", "permission", "expires_at"],
+                name="fileshare_access_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="folder",
+            index=models.Index(
+                condition=models.Q(("status", "ACTIVE")),
+                fields=["owner", "updated_at", "id"],
+                name="folder_active_owner_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="folder",
+            index=models.Index(
+                condition=models.Q(("status", "ACTIVE")),
+                fields=["parent", "updated_at", "id"],
+                name="folder_active_parent_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="foldershare",
+            index=models.Index(
+                fields=["shared_with", "permission", "expires_at"],
+                name="foldershare_access_idx",
+            ),
+        ),
+        # Superseded by the partial indexes above; dropped once those exist
+        RemoveIndexConcurrently(
+            model_name="file",
+            name="file_owner_updated_idx",
+        ),
+        RemoveIndexConcurrently(
+            model_name="folder",
+            name="folder_owner_updated_idx",
+        ),
+    ]
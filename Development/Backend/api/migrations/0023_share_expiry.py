@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:56
+
+from django.db import migrations, models
+
+from api.migration_operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ("api", "0022_hot_path_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="fileshare",
+            name="reminder_sent_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="foldershare",
+            name="reminder_sent_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        AddIndexConcurrently(
+            model_name="fileshare",
+            index=models.Index(
+                condition=models.Q(("expires_at__isnull", False)),
+                fields=["expires_at", "id"],
+                name="fileshare_expires_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="foldershare",
+            index=models.Index(
+                condition=models.Q(("expires_at__isnull", False)),
+                fields=["expires_at", "id"],
+                name="foldershare_expires_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:09
+
+import django.utils.timezone
+from django.db import migrations, models
+
+from api.migration_operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ("api", "0024_notification_counters"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="auditlog",
+            name="created_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        AddIndexConcurrently(
+            model_name="auditlog",
+            index=models.Index(
+                fields=["created_at", "id"], name="auditlog_created_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:13
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+from api.migration_operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ("api", "0025_audit_log_writer"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="auditlog",
+            index=models.Index(
+                fields=["file", "created_at", "id"], name="auditlog_file_idx"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="auditlog",
+            index=models.Index(
+                fields=["folder", "created_at", "id"], name="auditlog_folder_idx"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="auditlog",
+            index=models.Index(
+                fields=["user", "created_at", "id"], name="auditlog_user_idx"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="auditlog",
+            index=models.Index(
+                fields=["action", "created_at", "id"], name="auditlog_action_idx"
+            ),
+        ),
+        # The composite indexes above now serve the foreign keys; drop their own
+        migrations.AlterField(
+            model_name="auditlog",
+            name="file",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                to="api.file",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="auditlog",
+            name="folder",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                to="api.folder",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="auditlog",
+            name="user",
+            field=models.ForeignKey(
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0027_user_token_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="file",
+            name="lock_expires_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
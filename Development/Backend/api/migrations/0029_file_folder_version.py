@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0028_file_lock_lease"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="file",
+            name="version",
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.AddField(
+            model_name="folder",
+            name="version",
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
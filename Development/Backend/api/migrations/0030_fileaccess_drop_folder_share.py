@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:02
+
+from django.db import migrations
+
+
+def drop_inherited_rows(apps, schema_editor):
+    # Folder shares never gave access to the files inside the folder
+    FileAccess = apps.get_model("api", "FileAccess")
+    FileAccess.objects.filter(folder_share__isnull=False).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0029_file_folder_version"),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_inherited_rows, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name="fileaccess",
+            name="folder_share",
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0030_fileaccess_drop_folder_share"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="conversionjob",
+            index=models.Index(
+                fields=["status", "created_at"], name="conversionjob_status_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="conversionjob",
+            index=models.Index(
+                fields=["finished_at"], name="conversionjob_finished_idx"
+            ),
+        ),
+    ]
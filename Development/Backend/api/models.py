@@ -3,15 +3,19 @@ from django.contrib.auth.models import AbstractUser
 from django.utils import timezone
 import uuid
 
+from .concurrency import Versioned
+from .storage import get_blob_storage
+
 class User(AbstractUser):
     avatar = models.TextField(blank=True, null=True) # Base64 or URL
     bio = models.TextField(blank=True, null=True)
     phone_number = models.CharField(max_length=20, blank=True, null=True)
+    token_version = models.PositiveIntegerField(default=0) # in every JWT; bumped to revoke them, see api.authentication
 
     def __str__(self):
         return self.username
 
-class Folder(models.Model):
+class Folder(Versioned, models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     name = models.CharField(max_length=255)
     color = models.CharField(max_length=50, default='#3B82F6')
@@ -20,6 +24,7 @@ class Folder(models.Model):
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='folders')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    version = models.PositiveIntegerField(default=1, editable=False) # bumped by every save; the ETag, see api.concurrency
     class FolderStatus(models.TextChoices):
         ACTIVE = 'ACTIVE', 'Active'
         DELETED = 'DELETED', 'Deleted'
@@ -27,14 +32,55 @@ class Folder(models.Model):
 
     status = models.CharField(max_length=10, choices=FolderStatus.choices, default=FolderStatus.ACTIVE)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination order (see api.pagination)
+            models.Index(fields=['updated_at', 'id'], name='folder_updated_idx'),
+            # Listings only ever show ACTIVE rows; partial indexes skip the trash
+            models.Index(
+                fields=['owner', 'updated_at', 'id'], name='folder_active_owner_idx',
+                condition=models.Q(status='ACTIVE'),
+            ),
+            models.Index(
+                fields=['parent', 'updated_at', 'id'], name='folder_active_parent_idx',
+                condition=models.Q(status='ACTIVE'),
+            ),
+        ]
+
     def __str__(self):
         return self.name
 
-class File(models.Model):
+class Blob(models.Model):
+    # Content-addressed file body shared by every File row with the same bytes.
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    size = models.BigIntegerField()
+    ref_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.sha256
+
+class FolderClosure(models.Model):
+    # Closure table over Folder.parent: one row per (ancestor, descendant) pair,
+    # including each folder paired with itself at depth 0. Maintained by
+    # api.hierarchy; rebuild/check with `manage.py rebuild_folder_tree`.
+    ancestor = models.ForeignKey(Folder, on_delete=models.CASCADE, related_name='descendant_links')
+    descendant = models.ForeignKey(Folder, on_delete=models.CASCADE, related_name='ancestor_links')
+    depth = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['ancestor', 'descendant'], name='folderclosure_unique_pair'),
+        ]
+        indexes = [
+            models.Index(fields=['descendant', 'depth'], name='folderclosure_ancestors_idx'),
+        ]
+
+class File(Versioned, models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    file = models.FileField(upload_to='uploads/')
+    file = models.FileField(upload_to='uploads/', storage=get_blob_storage) # content-addressed, see api.storage
     name = models.CharField(max_length=255)
-    size = models.CharField(max_length=100) # e.g., "2.4 MB"
+    size = models.BigIntegerField(default=0) # bytes
     type = models.CharField(max_length=255) # e.g., "pdf", "image"
     folder = models.ForeignKey(Folder, on_delete=models.CASCADE, null=True, blank=True, related_name='files')
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='files')
@@ -43,6 +89,7 @@ class File(models.Model):
     metadata = models.JSONField(default=dict, blank=True) # For arbitrary metadata like author
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    version = models.PositiveIntegerField(default=1, editable=False) # bumped by every save; the ETag, see api.concurrency
     class FileStatus(models.TextChoices):
         ACTIVE = 'ACTIVE', 'Active'
         DELETED = 'DELETED', 'Deleted'
@@ -51,12 +98,180 @@ class File(models.Model):
     status = models.CharField(max_length=10, choices=FileStatus.choices, default=FileStatus.ACTIVE)
     locked_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='locked_files')
     locked_at = models.DateTimeField(null=True, blank=True)
+    lock_expires_at = models.DateTimeField(null=True, blank=True) # lease end; renewed by heartbeats, see api.locks
     is_notarized = models.BooleanField(default=False)
     notarized_file = models.FileField(upload_to='notarized/', null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination order (see api.pagination)
+            models.Index(fields=['updated_at', 'id'], name='file_updated_idx'),
+            models.Index(
+                fields=['owner', 'updated_at', 'id'], name='file_active_owner_idx',
+                condition=models.Q(status='ACTIVE'),
+            ),
+            models.Index(
+                fields=['folder', 'updated_at', 'id'], name='file_active_folder_idx',
+                condition=models.Q(status='ACTIVE'),
+            ),
+            # Largest files / usage breakdown (see api.usage)
+            models.Index(fields=['owner', 'status', 'size', 'id'], name='file_owner_size_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
+class StorageUsage(models.Model):
+    # Running per-user totals maintained by api.usage. Every stored file counts,
+    # including files in the trash, until it is purged.
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='storage_usage')
+    used_bytes = models.BigIntegerField(default=0)
+    file_count = models.IntegerField(default=0)
+    quota_bytes = models.BigIntegerField(null=True, blank=True) # None: settings.STORAGE_QUOTA
+
+    def __str__(self):
+        return f"{self.user} uses {self.used_bytes} bytes"
+
+class FolderUsage(models.Model):
+    # Running totals of ACTIVE files, directly in the folder and in its whole
+    # subtree, maintained by api.usage through the FolderClosure table.
+    folder = models.OneToOneField(Folder, on_delete=models.CASCADE, primary_key=True, related_name='usage')
+    bytes = models.BigIntegerField(default=0)
+    file_count = models.IntegerField(default=0)
+    total_bytes = models.BigIntegerField(default=0)
+    total_files = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.folder} holds {self.total_bytes} bytes"
+
+class SearchDocument(models.Model):
+    # Searchable text of a file, kept in sync by api.search. The full-text
+    # index itself is database specific and created in migration 0020: a
+    # generated tsvector column with a GIN index on PostgreSQL, an FTS5
+    # external-content table on SQLite.
+    file = models.OneToOneField(File, on_delete=models.CASCADE, related_name='search_document')
+    title = models.TextField(blank=True)
+    description = models.TextField(blank=True)
+    keywords = models.TextField(blank=True) # tags and metadata values
+    body = models.TextField(blank=True) # text extracted from the content
+    content_version = models.CharField(max_length=64, blank=True) # version ``body`` was extracted from
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Search document for {self.file_id}"
+
+class Tag(models.Model):
+    # Normalized index of the free-form ``tags`` lists on File and Folder,
+    # maintained by api.tags. ``slug`` is the case-folded name tags match on.
+    name = models.CharField(max_length=100)
+    slug = models.CharField(max_length=100, unique=True)
+
+    class Meta:
+        indexes = [
+            # Prefix LIKE for autocomplete on PostgreSQL (ignored elsewhere)
+            models.Index(fields=['slug'], name='tag_slug_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ]
+
+    def __str__(self):
+        return self.name
+
+class FileTag(models.Model):
+    file = models.ForeignKey(File, on_delete=models.CASCADE, related_name='tag_links')
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='file_links')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['file', 'tag'], name='filetag_unique_pair'),
+        ]
+        indexes = [
+            models.Index(fields=['tag', 'file'], name='filetag_tag_idx'),
+        ]
+
+class FolderTag(models.Model):
+    folder = models.ForeignKey(Folder, on_delete=models.CASCADE, related_name='tag_links')
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='folder_links')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['folder', 'tag'], name='foldertag_unique_pair'),
+        ]
+        indexes = [
+            models.Index(fields=['tag', 'folder'], name='foldertag_tag_idx'),
+        ]
+
+class UploadSession(models.Model):
+    # A resumable chunked upload. Parts arrive independently (any order, in
+    # parallel) and are assembled into a File row on completion.
+    class SessionStatus(models.TextChoices):
+        ACTIVE = 'ACTIVE', 'Active'
+        COMPLETED = 'COMPLETED', 'Completed'
+        ABORTED = 'ABORTED', 'Aborted'
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    name = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=255, default='application/octet-stream')
+    total_size = models.BigIntegerField()
+    part_size = models.PositiveIntegerField()
+    folder = models.ForeignKey(Folder, on_delete=models.CASCADE, null=True, blank=True, related_name='upload_sessions')
+    description = models.TextField(blank=True)
+    tags = models.JSONField(default=list, blank=True)
+    metadata = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=SessionStatus.choices, default=SessionStatus.ACTIVE)
+    file = models.ForeignKey(File, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def part_count(self):
+        return max(1, -(-self.total_size // self.part_size))
+
+    def expected_part_size(self, number):
+        if number < self.part_count:
+            return self.part_size
+        return self.total_size - self.part_size * (self.part_count - 1)
+
+    def __str__(self):
+        return f"Upload {self.name} ({self.status})"
+
+class UploadPart(models.Model):
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE, related_name='parts')
+    number = models.PositiveIntegerField() # 1-based
+    size = models.PositiveIntegerField()
+    storage_name = models.CharField(max_length=500)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['session', 'number'], name='uploadpart_unique_number'),
+        ]
+
+class ConversionJob(models.Model):
+    # Background HTML -> DOCX conversion started by save_content (see api.jobs)
+    class JobStatus(models.TextChoices):
+        PENDING = 'PENDING', 'Pending'
+        RUNNING = 'RUNNING', 'Running'
+        SUCCEEDED = 'SUCCEEDED', 'Succeeded'
+        FAILED = 'FAILED', 'Failed'
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    file = models.ForeignKey(File, on_delete=models.CASCADE, related_name='conversion_jobs')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversion_jobs')
+    status = models.CharField(max_length=10, choices=JobStatus.choices, default=JobStatus.PENDING)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Orphan sweep and retention purge (api.jobs)
+            models.Index(fields=['status', 'created_at'], name='conversionjob_status_idx'),
+            models.Index(fields=['finished_at'], name='conversionjob_finished_idx'),
+        ]
+
+    def __str__(self):
+        return f"Conversion {self.id} ({self.status})"
+
 class SharePermission(models.TextChoices):
     VIEW = 'VIEW', 'View Only'
     EDIT = 'EDIT', 'Edit'
@@ -67,18 +282,81 @@ class FolderShare(models.Model):
     permission = models.CharField(max_length=10, choices=SharePermission.choices, default=SharePermission.VIEW)
     expires_at = models.DateTimeField(null=True, blank=True)
     granted_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='granted_folder_shares')
+    # Set once the expiry reminder went out; cleared when expires_at changes
+    reminder_sent_at = models.DateTimeField(null=True, blank=True)
     message = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='foldershare_created_idx'),
+            models.Index(fields=['shared_with', 'created_at', 'id'], name='foldershare_recipient_idx'),
+            # Permission checks: recipient + level, expiry filtered from the index
+            models.Index(fields=['shared_with', 'permission', 'expires_at'], name='foldershare_access_idx'),
+            # Expiry sweeper: only rows that can expire
+            models.Index(
+                fields=['expires_at', 'id'], name='foldershare_expires_idx',
+                condition=models.Q(expires_at__isnull=False),
+            ),
+        ]
+
 class FileShare(models.Model):
     file = models.ForeignKey(File, on_delete=models.CASCADE, related_name='shares')
     shared_with = models.ForeignKey(User, on_delete=models.CASCADE, related_name='shared_files')
     permission = models.CharField(max_length=10, choices=SharePermission.choices, default=SharePermission.VIEW)
     expires_at = models.DateTimeField(null=True, blank=True)
     granted_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='granted_file_shares')
+    # Set once the expiry reminder went out; cleared when expires_at changes
+    reminder_sent_at = models.DateTimeField(null=True, blank=True)
     message = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='fileshare_created_idx'),
+            models.Index(fields=['shared_with', 'created_at', 'id'], name='fileshare_recipient_idx'),
+            # Permission checks: recipient + level, expiry filtered from the index
+            models.Index(fields=['shared_with', 'permission', 'expires_at'], name='fileshare_access_idx'),
+            # Expiry sweeper: only rows that can expire
+            models.Index(
+                fields=['expires_at', 'id'], name='fileshare_expires_idx',
+                condition=models.Q(expires_at__isnull=False),
+            ),
+        ]
+
+class AccessLevel(models.TextChoices):
+    OWNER = 'OWNER', 'Owner'
+    EDIT = 'EDIT', 'Edit'
+    VIEW = 'VIEW', 'View Only'
+
+class FolderAccess(models.Model):
+    # Materialized view of who can see a folder. One row per grant: the owner
+    # row plus one per FolderShare. Kept in sync by api.access / api.signals.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='folder_access')
+    folder = models.ForeignKey(Folder, on_delete=models.CASCADE, related_name='access')
+    permission = models.CharField(max_length=10, choices=AccessLevel.choices)
+    expires_at = models.DateTimeField(null=True, blank=True)
+    folder_share = models.ForeignKey(FolderShare, on_delete=models.CASCADE, null=True, blank=True, related_name='access')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'folder', 'permission', 'expires_at'], name='folderaccess_lookup_idx'),
+        ]
+
+class FileAccess(models.Model):
+    # Same as FolderAccess for files: the owner row plus one per FileShare.
+    # Shares of the containing folder do not reach the files in it.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='file_access')
+    file = models.ForeignKey(File, on_delete=models.CASCADE, related_name='access')
+    permission = models.CharField(max_length=10, choices=AccessLevel.choices)
+    expires_at = models.DateTimeField(null=True, blank=True)
+    file_share = models.ForeignKey(FileShare, on_delete=models.CASCADE, null=True, blank=True, related_name='access')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'file', 'permission', 'expires_at'], name='fileaccess_lookup_idx'),
+        ]
+
 class NotificationType(models.TextChoices):
     EXPIRY = 'EXPIRY', 'Expiry Reminder'
     SHARE = 'SHARE', 'Document Shared'
@@ -92,9 +370,27 @@ class Notification(models.Model):
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id'], name='notification_user_created_idx'),
+            # Mark-read only ever touches unread rows
+            models.Index(fields=['user', 'id'], name='notification_unread_idx', condition=models.Q(is_read=False)),
+            # Retention sweep (api.notifications.purge)
+            models.Index(fields=['created_at', 'id'], name='notification_read_idx', condition=models.Q(is_read=True)),
+        ]
+
     def __str__(self):
         return f"{self.title} - {self.user.username}"
 
+class NotificationCounter(models.Model):
+    # Unread notifications per user, maintained by api.notifications so the
+    # badge count is a primary key lookup.
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='notification_counter')
+    unread = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user} has {self.unread} unread notifications"
+
 class AuditLog(models.Model):
     class Action(models.TextChoices):
         GRANT = 'GRANT', 'Access Granted'
@@ -105,12 +401,24 @@ class AuditLog(models.Model):
         DELETE = 'DELETE', 'File Deleted'
         EDIT = 'EDIT', 'File Content Modified'
 
-    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
-    file = models.ForeignKey(File, on_delete=models.CASCADE, null=True, blank=True)
-    folder = models.ForeignKey(Folder, on_delete=models.CASCADE, null=True, blank=True)
+    # No single-column FK indexes: the composite ones below lead with each column
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, db_index=False)
+    file = models.ForeignKey(File, on_delete=models.CASCADE, null=True, blank=True, db_index=False)
+    folder = models.ForeignKey(Folder, on_delete=models.CASCADE, null=True, blank=True, db_index=False)
     action = models.CharField(max_length=20, choices=Action.choices)
     details = models.JSONField(default=dict, blank=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(default=timezone.now) # set when recorded; api.audit writes in batches later
+
+    class Meta:
+        indexes = [
+            # Archiving by month (api.audit.archive)
+            models.Index(fields=['created_at', 'id'], name='auditlog_created_idx'),
+            # Audit trails (GET /api/audit/), newest first for one file, folder, user or action
+            models.Index(fields=['file', 'created_at', 'id'], name='auditlog_file_idx'),
+            models.Index(fields=['folder', 'created_at', 'id'], name='auditlog_folder_idx'),
+            models.Index(fields=['user', 'created_at', 'id'], name='auditlog_user_idx'),
+            models.Index(fields=['action', 'created_at', 'id'], name='auditlog_action_idx'),
+        ]
 
     def __str__(self):
         return f"{self.action} by {self.user.username if self.user else 'System'}"
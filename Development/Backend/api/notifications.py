@@ -0,0 +1,99 @@
+"""
+Notification bookkeeping.
+
+NotificationCounter keeps each user's unread count so the badge is a single
+primary key lookup. New notifications add to it (api.signals for single
+saves, created() for bulk inserts) and mark_read() subtracts exactly the rows
+it flipped, in the same transaction. Marking read only touches unread rows,
+through the partial ``notification_unread_idx``.
+
+purge() is the retention sweep (`manage.py purge_notifications`): it deletes
+read notifications past NOTIFICATION_RETENTION_DAYS, and read notifications
+beyond the newest NOTIFICATION_MAX_READ per user, in batches. Unread ones are
+never removed, so the counters are unaffected.
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, Value, When
+from django.utils import timezone
+
+from . import events
+from .models import Notification, NotificationCounter
+
+
+def adjust(user_id, delta):
+    if not delta:
+        return
+    if NotificationCounter.objects.filter(user_id=user_id).update(unread=F('unread') + delta) or delta < 0:
+        return
+    try:
+        with transaction.atomic():
+            NotificationCounter.objects.create(user_id=user_id, unread=delta)
+    except IntegrityError:
+        NotificationCounter.objects.filter(user_id=user_id).update(unread=F('unread') + delta)
+
+
+def created(notifications):
+    """Count and publish new notifications (call after bulk_create)."""
+    notifications = list(notifications)
+    counts = Counter(n.user_id for n in notifications if not n.is_read)
+    if len(counts) == 1:
+        adjust(*counts.popitem())
+    elif counts:
+        # Every recipient in two statements: make sure the rows exist, then add per-user amounts
+        NotificationCounter.objects.bulk_create(
+            [NotificationCounter(user_id=user_id) for user_id in counts], ignore_conflicts=True
+        )
+        NotificationCounter.objects.filter(user_id__in=counts).update(unread=F('unread') + Case(
+            *[When(user_id=user_id, then=Value(count)) for user_id, count in counts.items()], default=Value(0)
+        ))
+    events.notifications_created(notifications)
+    return notifications
+
+
+def unread_count(user):
+    return NotificationCounter.objects.filter(user=user).values_list('unread', flat=True).first() or 0
+
+
+def mark_read(user, ids=None):
+    """Mark the user's unread notifications (or those among ``ids``) read. Returns how many changed."""
+    unread = Notification.objects.filter(user=user, is_read=False)
+    if ids is not None:
+        unread = unread.filter(pk__in=ids)
+    with transaction.atomic():
+        changed = unread.update(is_read=True)
+        adjust(user.pk, -changed)
+    return changed
+
+
+def _delete_batches(queryset, batch_size):
+    deleted = 0
+    while True:
+        pks = list(queryset.order_by('id').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        deleted += Notification.objects.filter(pk__in=pks).delete()[0]
+
+
+def purge(days=None, keep=None, batch_size=1000):
+    """Delete old and surplus read notifications. Returns (expired, surplus) counts."""
+    days = settings.NOTIFICATION_RETENTION_DAYS if days is None else days
+    keep = settings.NOTIFICATION_MAX_READ if keep is None else keep
+    cutoff = timezone.now() - timedelta(days=days)
+    expired = _delete_batches(Notification.objects.filter(is_read=True, created_at__lt=cutoff), batch_size)
+
+    surplus = 0
+    heavy = (
+        Notification.objects.filter(is_read=True).values('user_id')
+        .annotate(n=Count('pk')).filter(n__gt=keep).values_list('user_id', flat=True)
+    )
+    for user_id in list(heavy):
+        read = Notification.objects.filter(user_id=user_id, is_read=True)
+        newest_dropped = next(iter(read.order_by('-id').values_list('pk', flat=True)[keep:keep + 1]), None)
+        if newest_dropped is not None:
+            surplus += _delete_batches(read.filter(pk__lte=newest_dropped), batch_size)
+    return expired, surplus
+
@@ -0,0 +1,146 @@
+"""
+Server-side DOCX -> HTML rendering with an on-disk cache.
+
+Rendered HTML is stored under RENDER_CACHE_ROOT keyed by the file's content
+version (the blob SHA-256), so each version is rendered once no matter how
+many users open it, and a new save or upload simply produces a new key.
+Embedded images are written next to the HTML and referenced through signed,
+immutable asset URLs instead of being inlined as base64.
+
+Rendering needs the optional ``mammoth`` package; without it the endpoint
+reports that server rendering is unavailable and clients render locally.
+"""
+import itertools
+import logging
+import mimetypes
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from xml.parsers.expat import ExpatError
+
+from django.conf import settings
+from django.core import signing
+from django.db import close_old_connections
+
+from .downloads import content_version
+
+logger = logging.getLogger(__name__)
+
+ASSET_PLACEHOLDER = '__RENDER_ASSETS__'
+SIGNING_SALT = 'api.render.assets'
+DOCX_TYPES = ('application/vnd.openxmlformats-officedocument.wordprocessingml.document',)
+
+_prewarm_executor = None
+_prewarm_lock = threading.Lock()
+
+
+class RenderUnavailable(Exception):
+    pass
+
+
+class DocumentUnreadable(Exception):
+    """The file could not be parsed as a DOCX document."""
+
+
+def is_renderable(file):
+    return file.type in DOCX_TYPES or file.name.lower().endswith('.docx')
+
+
+def cache_dir(version):
+    return os.path.join(settings.RENDER_CACHE_ROOT, version[:2], version)
+
+
+def asset_token(version):
+    return signing.Signer(salt=SIGNING_SALT).sign(version)
+
+
+def version_from_token(token):
+    """The content version an asset token was issued for; raises BadSignature."""
+    return signing.Signer(salt=SIGNING_SALT).unsign(token)
+
+
+def render(file):
+    """Return (version, html) for the file's current content, rendering on a cache miss."""
+    version = content_version(file)
+    index = os.path.join(cache_dir(version), 'index.html')
+    if not os.path.exists(index):
+        _render_into_cache(file, version)
+    with open(index, encoding='utf-8') as fh:
+        return version, fh.read()
+
+
+def _render_into_cache(file, version):
+    try:
+        import mammoth
+    except ImportError:
+        raise RenderUnavailable("Server-side rendering requires the 'mammoth' package.")
+
+    os.makedirs(settings.RENDER_CACHE_ROOT, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=settings.RENDER_CACHE_ROOT, prefix='tmp-')
+    counter = itertools.count(1)
+
+    def save_image(image):
+        name = f'image{next(counter)}{mimetypes.guess_extension(image.content_type) or ".bin"}'
+        with image.open() as src, open(os.path.join(tmp, name), 'wb') as out:
+            shutil.copyfileobj(src, out)
+        return {'src': f'{ASSET_PLACEHOLDER}/{name}'}
+
+    try:
+        with file.file.open('rb') as fh:
+            try:
+                result = mammoth.convert_to_html(fh, convert_image=mammoth.images.img_element(save_image))
+            except (zipfile.BadZipFile, ExpatError, KeyError, ValueError) as e:
+                raise DocumentUnreadable(str(e)) from e
+            except OSError as e:
+                # mammoth reports a missing document part as a bare IOError; real I/O errors carry an errno
+                if e.errno is not None:
+                    raise
+                raise DocumentUnreadable(str(e)) from e
+        with open(os.path.join(tmp, 'index.html'), 'w', encoding='utf-8') as out:
+            out.write(result.value)
+
+        final = cache_dir(version)
+        os.makedirs(os.path.dirname(final), exist_ok=True)
+        try:
+            os.rename(tmp, final)
+        except OSError:
+            # Another worker rendered the same version first
+            shutil.rmtree(tmp, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+
+def discard(version):
+    shutil.rmtree(cache_dir(version), ignore_errors=True)
+
+
+def prewarm(file):
+    """Render ``file`` in the background so the first viewer hits the cache."""
+    global _prewarm_executor
+    if not is_renderable(file):
+        return
+    if _prewarm_executor is None:
+        with _prewarm_lock:
+            if _prewarm_executor is None:
+                _prewarm_executor = ThreadPoolExecutor(
+                    max_workers=settings.RENDER_PREWARM_WORKERS, thread_name_prefix='render-prewarm'
+                )
+    _prewarm_executor.submit(_prewarm, file.pk)
+
+
+def _prewarm(file_pk):
+    from .models import File
+
+    close_old_connections()
+    try:
+        render(File.objects.get(pk=file_pk))
+    except (RenderUnavailable, DocumentUnreadable):
+        pass
+    except Exception:
+        logger.exception("Pre-rendering file %s failed", file_pk)
+    finally:
+        close_old_connections()
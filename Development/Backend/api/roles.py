@@ -0,0 +1,172 @@
+"""
+Permission resolution.
+
+Decides a user's role on files and folders (OWNER, EDIT, VIEW, or None for
+no access) from the effective-access rows kept by api.access, for one object
+or for many in a single query. Views use the Resolver of their request
+(for_request), which remembers every role it has resolved, so repeated checks
+on the same object within a request cost nothing.
+
+With PERMISSION_CACHE set to a cache alias, roles are also kept across
+requests. Cache keys carry version stamps (one per file, one per folder and
+a global one). When the grants on an object change, api.access drops its
+stamp once the transaction commits (see invalidate()), so entries stored
+under the old stamp are never read again and just age out. An entry that
+depends on an expiring grant is kept no longer than that grant lasts.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+from . import access
+from .models import AccessLevel, File, FileAccess, Folder, FolderAccess
+
+RANK = {AccessLevel.VIEW: 1, AccessLevel.EDIT: 2, AccessLevel.OWNER: 3}
+NO_ACCESS = ''  # cached stand-in for None, which the cache API uses for a miss
+GLOBAL_STAMP = 'roles:v'
+
+KINDS = (
+    ('file', File, FileAccess),
+    ('folder', Folder, FolderAccess),
+)
+
+
+def _cache():
+    alias = settings.PERMISSION_CACHE
+    return caches[alias] if alias else None
+
+
+def _kind(obj):
+    return 'file' if isinstance(obj, File) else 'folder'
+
+
+def _stamp_key(kind, pk):
+    return f'roles:v:{kind}:{pk}'
+
+
+def invalidate(files=(), folders=(), everything=False):
+    """Drop cached roles on these files and folders (or all) once the transaction commits."""
+    cache = _cache()
+    if cache is None:
+        return
+    keys = [_stamp_key('file', pk) for pk in files] + [_stamp_key('folder', pk) for pk in folders]
+    if everything:
+        keys.append(GLOBAL_STAMP)
+    if keys:
+        # Not before: a reader could cache the old grants under the new stamp
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def _stamps(cache, keys):
+    stamps = cache.get_many(keys)
+    for key in keys:
+        if key not in stamps:
+            cache.add(key, time.time_ns())
+            stamps[key] = cache.get(key)
+    return stamps
+
+
+def _cache_keys(cache, user, objs):
+    wanted = {GLOBAL_STAMP} | {_stamp_key(_kind(obj), obj.pk) for obj in objs}
+    stamps = _stamps(cache, list(wanted))
+    keys = {}
+    for obj in objs:
+        kind = _kind(obj)
+        parts = [stamps[GLOBAL_STAMP], user.pk, kind, obj.pk, stamps[_stamp_key(kind, obj.pk)]]
+        keys[(kind, obj.pk)] = 'roles:' + ':'.join(str(part) for part in parts)
+    return keys
+
+
+def _load(user, objs):
+    """Roles and seconds until the first grant involved expires (None: never), from the access rows."""
+    found = {}
+    for kind, model, grants in KINDS:
+        pks = [obj.pk for obj in objs if isinstance(obj, model)]
+        if not pks:
+            continue
+        rows = grants.objects.filter(user=user, **{f'{kind}_id__in': pks}).filter(access.not_expired())
+        best, expiry = {}, {}
+        for pk, permission, expires_at in rows.values_list(f'{kind}_id', 'permission', 'expires_at'):
+            if RANK[permission] > RANK.get(best.get(pk), 0):
+                best[pk] = permission
+            if expires_at is not None and (pk not in expiry or expires_at < expiry[pk]):
+                expiry[pk] = expires_at
+        now = timezone.now()
+        for pk in pks:
+            lasts = expiry.get(pk)
+            found[(kind, pk)] = (best.get(pk), None if lasts is None else (lasts - now).total_seconds())
+    return found
+
+
+def _resolve(user, objs):
+    if user.pk is None:
+        return {(_kind(obj), obj.pk): None for obj in objs}
+    cache = _cache()
+    keys = _cache_keys(cache, user, objs) if cache else {}
+    cached = cache.get_many(list(keys.values())) if keys else {}
+    roles, missing = {}, []
+    for obj in objs:
+        value = cached.get(keys.get((_kind(obj), obj.pk)))
+        if value is None:
+            missing.append(obj)
+        else:
+            roles[(_kind(obj), obj.pk)] = value or None
+    if not missing:
+        return roles
+
+    by_timeout = {}
+    for key, (role, lasts) in _load(user, missing).items():
+        roles[key] = role
+        if cache:
+            timeout = settings.PERMISSION_CACHE_TIMEOUT if lasts is None else min(settings.PERMISSION_CACHE_TIMEOUT, int(lasts))
+            if timeout > 0:
+                by_timeout.setdefault(timeout, {})[keys[key]] = role or NO_ACCESS
+    for timeout, entries in by_timeout.items():
+        cache.set_many(entries, timeout)
+    return roles
+
+
+class Resolver:
+    """One user's roles, remembered for the resolver's lifetime (a request)."""
+
+    def __init__(self, user):
+        self.user = user
+        self.memo = {}
+
+    def role(self, obj):
+        """OWNER, EDIT, VIEW, or None if the user has no access to the file or folder."""
+        return self.roles([obj])[obj.pk]
+
+    def allows(self, obj, level=AccessLevel.VIEW):
+        return self.role(obj) in access.SATISFIES[level]
+
+    def roles(self, objs):
+        """{pk: role} for many files and/or folders, resolving what is not yet known in one query per kind."""
+        result, pending = {}, []
+        for obj in objs:
+            key = (_kind(obj), obj.pk)
+            if self.user.pk is not None and obj.owner_id == self.user.pk:
+                result[obj.pk] = AccessLevel.OWNER
+            elif key in self.memo:
+                result[obj.pk] = self.memo[key]
+            else:
+                pending.append(obj)
+        if pending:
+            for (kind, pk), role in _resolve(self.user, pending).items():
+                self.memo[(kind, pk)] = result[pk] = role
+        return result
+
+    def remember(self, obj, role):
+        """Record a role resolved elsewhere, e.g. annotated by access.with_role."""
+        self.memo[(_kind(obj), obj.pk)] = role
+
+
+def for_request(request):
+    """The Resolver for ``request.user``, created on first use."""
+    resolver = getattr(request, '_roles', None)
+    if resolver is None or resolver.user is not request.user:
+        resolver = request._roles = Resolver(request.user)
+    return resolver
@@ -0,0 +1,212 @@
+"""
+Full-text search over files.
+
+Each File has a SearchDocument row holding its name, description, tags and
+metadata values and the text extracted from its content. Migration 0020
+indexes those columns natively: a weighted tsvector column with a GIN index
+on PostgreSQL, an FTS5 table kept in step by triggers on SQLite. Other
+backends fall back to substring matching.
+
+Name/description/tag/metadata changes are written in the same transaction as
+the File save (api.signals). Text extraction for new content runs after the
+commit on a small background pool, so uploads and save_content never wait on
+parsing a document.
+"""
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+from . import access
+from .downloads import content_version
+from .models import File, SearchDocument
+
+logger = logging.getLogger(__name__)
+
+TERM_RE = re.compile(r'[^\W_]+')
+MAX_TERMS = 10
+TEXT_TYPES = ('.txt', '.md', '.csv', '.json', '.xml', '.html', '.htm', '.log', '.rtf')
+
+# Postgres: weights A-D on title, keywords, description, body (see 0020)
+POSTGRES_MATCH = "SELECT file_id FROM api_searchdocument WHERE vector @@ to_tsquery('simple', %s)"
+POSTGRES_RANK = (
+    "SELECT ts_rank_cd(vector, to_tsquery('simple', %s)) FROM api_searchdocument "
+    "WHERE api_searchdocument.file_id = api_file.id"
+)
+# SQLite: bm25 column weights in FTS5 column order (title, description, keywords, body)
+SQLITE_MATCH = (
+    "SELECT d.file_id FROM api_searchdocument_fts JOIN api_searchdocument d "
+    "ON d.id = api_searchdocument_fts.rowid WHERE api_searchdocument_fts MATCH %s"
+)
+SQLITE_RANK = (
+    "SELECT -bm25(api_searchdocument_fts, 10.0, 2.0, 4.0, 1.0) FROM api_searchdocument_fts "
+    "JOIN api_searchdocument d ON d.id = api_searchdocument_fts.rowid "
+    "WHERE api_searchdocument_fts MATCH %s AND d.file_id = api_file.id"
+)
+
+_executor = None
+_executor_lock = threading.Lock()
+_fts_tables = {}
+
+
+def terms(query):
+    return [term.lower() for term in TERM_RE.findall(query or '')][:MAX_TERMS]
+
+
+def backend():
+    if connection.vendor == 'postgresql':
+        return 'postgresql'
+    if connection.vendor == 'sqlite':
+        name = connection.settings_dict['NAME']
+        if name not in _fts_tables:
+            _fts_tables[name] = 'api_searchdocument_fts' in connection.introspection.table_names()
+        return 'sqlite' if _fts_tables[name] else None
+    return None
+
+
+def search(user, query):
+    """
+    Active files ``user`` can see that match every term of ``query`` (each
+    as a prefix), best first. Access filtering is part of the same query.
+    """
+    words = terms(query)
+    queryset = File.objects.filter(status='ACTIVE', pk__in=access.file_ids(user))
+    if not words:
+        return queryset.none()
+
+    engine = backend()
+    if engine == 'postgresql':
+        expression = ' & '.join(f'{word}:*' for word in words)
+        match, rank = POSTGRES_MATCH, POSTGRES_RANK
+    elif engine == 'sqlite':
+        expression = ' '.join(f'"{word}"*' for word in words)
+        match, rank = SQLITE_MATCH, SQLITE_RANK
+    else:
+        condition = Q()
+        for word in words:
+            condition &= (
+                Q(search_document__title__icontains=word) | Q(search_document__description__icontains=word)
+                | Q(search_document__keywords__icontains=word) | Q(search_document__body__icontains=word)
+            )
+        return queryset.filter(condition).annotate(rank=Value(0.0, output_field=FloatField())).order_by('-updated_at')
+
+    return queryset.filter(pk__in=RawSQL(match, [expression])).annotate(
+        rank=RawSQL(rank, [expression], output_field=FloatField())
+    ).order_by('-rank', '-updated_at')
+
+
+def _words(value):
+    if isinstance(value, dict):
+        return [w for k, v in value.items() for w in [str(k)] + _words(v)]
+    if isinstance(value, (list, tuple)):
+        return [w for v in value for w in _words(v)]
+    return [] if value is None else [str(value)]
+
+
+def keywords(file):
+    return ' '.join(_words(file.tags) + _words(file.metadata))
+
+
+def fields_for(file):
+    return {'title': file.name, 'description': file.description, 'keywords': keywords(file)}
+
+
+def file_saved(file, content_changed):
+    """Refresh the indexed fields of ``file``; queue text extraction if its content changed."""
+    fields = fields_for(file)
+    if not SearchDocument.objects.filter(file_id=file.pk).update(**fields):
+        SearchDocument.objects.create(file_id=file.pk, **fields)
+    if content_changed and file.file:
+        pk = file.pk
+        transaction.on_commit(lambda: queue_extraction(pk))
+
+
+def keywords_changed(files):
+    """Refresh the keywords of many files whose tags or metadata were updated in bulk."""
+    by_file = {file.pk: file for file in files}
+    documents = list(SearchDocument.objects.filter(file_id__in=by_file).only('id', 'file_id'))
+    for document in documents:
+        document.keywords = keywords(by_file[document.file_id])
+    SearchDocument.objects.bulk_update(documents, ['keywords'], batch_size=500)
+
+
+def extract_text(file):
+    """Plain text of a DOCX, PDF or text file, capped at SEARCH_MAX_TEXT characters."""
+    limit = settings.SEARCH_MAX_TEXT
+    name = file.name.lower()
+    with file.file.open('rb') as fh:
+        if name.endswith('.docx'):
+            from docx import Document
+            document = Document(fh)
+            parts = [p.text for p in document.paragraphs]
+            parts += [cell.text for table in document.tables for row in table.rows for cell in row.cells]
+            text = '\n'.join(parts)
+        elif name.endswith('.pdf') or file.type == 'application/pdf':
+            try:
+                from pypdf import PdfReader
+            except ImportError:
+                return ''
+            text, reader = '', PdfReader(fh)
+            for page in reader.pages:
+                text += (page.extract_text() or '') + '\n'
+                if len(text) >= limit:
+                    break
+        elif name.endswith(TEXT_TYPES) or file.type.startswith('text/'):
+            text = fh.read(limit * 4).decode('utf-8', errors='ignore')
+        else:
+            return ''
+    return text[:limit]
+
+
+def index_content(file):
+    """Extract and store the body text unless it is already current."""
+    version = content_version(file)
+    if SearchDocument.objects.filter(file_id=file.pk, content_version=version).exists():
+        return
+    try:
+        body = extract_text(file)
+    except Exception:
+        logger.warning("Could not extract text from file %s", file.pk, exc_info=True)
+        body = ''
+    fields = fields_for(file)
+    SearchDocument.objects.update_or_create(
+        file_id=file.pk, defaults={**fields, 'body': body, 'content_version': version}
+    )
+
+
+def queue_extraction(file_pk):
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.SEARCH_INDEX_WORKERS, thread_name_prefix='search-index')
+    _executor.submit(_extract, file_pk)
+
+
+def _extract(file_pk):
+    close_old_connections()
+    try:
+        index_content(File.objects.get(pk=file_pk))
+    except File.DoesNotExist:
+        pass
+    except Exception:
+        logger.exception("Indexing file %s failed", file_pk)
+    finally:
+        close_old_connections()
+
+
+def rebuild():
+    """(Re)index every file synchronously. Returns the number of files processed."""
+    count = 0
+    for file in File.objects.exclude(file='').iterator(chunk_size=200):
+        index_content(file)
+        count += 1
+    for file in File.objects.filter(file='').iterator(chunk_size=200):
+        file_saved(file, content_changed=False)
+        count += 1
+    return count
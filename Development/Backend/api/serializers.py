@@ -1,7 +1,9 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
-from .models import Folder, File, FolderShare, FileShare, Notification, OTPVerification
+from django.conf import settings
+from .models import AuditLog, Folder, File, FolderShare, FileShare, Notification, OTPVerification, UploadSession, ConversionJob, SharePermission
 from .validators import ComplexityValidator
+from . import access, hierarchy, locks, roles
 
 User = get_user_model()
 
@@ -63,6 +65,12 @@ class FolderShareSerializer(serializers.ModelSerializer):
         validated_data['shared_with'] = user
         return super().create(validated_data)
 
+    def update(self, instance, validated_data):
+        # A new expiry date earns a new reminder (see api.expiry)
+        if 'expires_at' in validated_data and validated_data['expires_at'] != instance.expires_at:
+            validated_data['reminder_sent_at'] = None
+        return super().update(instance, validated_data)
+
 class FileShareSerializer(serializers.ModelSerializer):
     shared_with_email = serializers.EmailField(write_only=True)
     shared_with_details = UserSerializer(source='shared_with', read_only=True)
@@ -96,6 +104,52 @@ class FileShareSerializer(serializers.ModelSerializer):
         validated_data['shared_with'] = user
         return super().create(validated_data)
 
+    def update(self, instance, validated_data):
+        # A new expiry date earns a new reminder (see api.expiry)
+        if 'expires_at' in validated_data and validated_data['expires_at'] != instance.expires_at:
+            validated_data['reminder_sent_at'] = None
+        return super().update(instance, validated_data)
+
+class BulkShareSerializer(serializers.Serializer):
+    files = serializers.ListField(child=serializers.UUIDField(), required=False, default=list)
+    folders = serializers.ListField(child=serializers.UUIDField(), required=False, default=list)
+    emails = serializers.ListField(child=serializers.EmailField(), allow_empty=False)
+    permission = serializers.ChoiceField(choices=SharePermission.choices, default=SharePermission.VIEW)
+    expires_at = serializers.DateTimeField(required=False, allow_null=True, default=None)
+    message = serializers.CharField(required=False, allow_blank=True, default='')
+
+    def validate(self, data):
+        items = len(set(data['files'])) + len(set(data['folders']))
+        if not items:
+            raise serializers.ValidationError("Provide at least one file or folder.")
+        if items * len(set(data['emails'])) > settings.BULK_SHARE_MAX:
+            raise serializers.ValidationError(f"At most {settings.BULK_SHARE_MAX} shares per request.")
+        return data
+
+class FileBatchSerializer(serializers.Serializer):
+    operation = serializers.ChoiceField(choices=['move', 'add_tags', 'remove_tags', 'archive', 'delete', 'restore'])
+    ids = serializers.ListField(child=serializers.UUIDField(), required=False, allow_empty=False)
+    folder = serializers.PrimaryKeyRelatedField(queryset=Folder.objects.all(), required=False)
+    target = serializers.PrimaryKeyRelatedField(queryset=Folder.objects.filter(status='ACTIVE'), required=False, allow_null=True)
+    tags = serializers.ListField(child=serializers.CharField(), required=False, allow_empty=False)
+
+    def get_fields(self):
+        # Folders the user cannot see are reported like ones that do not exist
+        fields = super().get_fields()
+        visible = Folder.objects.filter(pk__in=access.folder_ids(self.context['request'].user))
+        fields['folder'].queryset = visible
+        fields['target'].queryset = visible.filter(status='ACTIVE')
+        return fields
+
+    def validate(self, data):
+        if 'ids' not in data and 'folder' not in data:
+            raise serializers.ValidationError("Provide ids or a folder.")
+        if data['operation'] == 'move' and 'target' not in data:
+            raise serializers.ValidationError({"target": "Required for move (null moves to the top level)."})
+        if data['operation'] in ('add_tags', 'remove_tags') and 'tags' not in data:
+            raise serializers.ValidationError({"tags": "Required for tag operations."})
+        return data
+
 class FolderSerializer(serializers.ModelSerializer):
     owner_details = UserSerializer(source='owner', read_only=True)
     shares = FolderShareSerializer(many=True, read_only=True)
@@ -104,17 +158,22 @@ class FolderSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Folder
-        fields = ('id', 'name', 'color', 'tags', 'parent', 'owner', 'owner_details', 'created_at', 'updated_at', 'shares', 'role')
-        read_only_fields = ('id', 'owner', 'created_at', 'updated_at', 'role')
+        fields = ('id', 'name', 'color', 'tags', 'parent', 'owner', 'owner_details', 'created_at', 'updated_at', 'version', 'shares', 'role')
+        read_only_fields = ('id', 'owner', 'created_at', 'updated_at', 'version', 'role')
 
     def get_role(self, obj):
+        # Listing/detail querysets annotate the role in SQL (see access.with_role)
+        if hasattr(obj, 'access_role'):
+            return obj.access_role
         request = self.context.get('request')
         if not request or not request.user:
             return 'VIEW'
-        if obj.owner == request.user:
-            return 'OWNER'
-        share = obj.shares.filter(shared_with=request.user).first()
-        return share.permission if share else 'VIEW'
+        return roles.for_request(request).role(obj) or 'VIEW'
+
+    def validate_parent(self, value):
+        if value is not None and self.instance is not None and hierarchy.is_descendant(self.instance, value):
+            raise serializers.ValidationError("A folder cannot be moved into itself or one of its subfolders.")
+        return value
 
     def create(self, validated_data):
         tags = validated_data.pop('tags', [])
@@ -134,17 +193,24 @@ class FileSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = File
-        fields = ('id', 'name', 'file', 'size', 'type', 'folder', 'owner', 'owner_details', 'description', 'tags', 'metadata', 'created_at', 'updated_at', 'status', 'role', 'file_url', 'shares', 'locked_by', 'locked_at', 'locked_by_details')
-        read_only_fields = ('id', 'owner', 'created_at', 'updated_at', 'size', 'type', 'role', 'locked_by', 'locked_at')
+        fields = ('id', 'name', 'file', 'size', 'type', 'folder', 'owner', 'owner_details', 'description', 'tags', 'metadata', 'created_at', 'updated_at', 'version', 'status', 'role', 'file_url', 'shares', 'locked_by', 'locked_at', 'lock_expires_at', 'locked_by_details')
+        read_only_fields = ('id', 'owner', 'created_at', 'updated_at', 'version', 'size', 'type', 'role', 'locked_by', 'locked_at', 'lock_expires_at')
+
+    def to_representation(self, obj):
+        data = super().to_representation(obj)
+        if locks.holder(obj) is None:
+            # A lapsed lease blocks nobody, so do not show it (api.locks)
+            data.update(locked_by=None, locked_at=None, lock_expires_at=None, locked_by_details=None)
+        return data
 
     def get_role(self, obj):
+        # Listing/detail querysets annotate the role in SQL (see access.with_role)
+        if hasattr(obj, 'access_role'):
+            return obj.access_role
         request = self.context.get('request')
         if not request or not request.user:
             return 'VIEW'
-        if obj.owner == request.user:
-            return 'OWNER'
-        share = obj.shares.filter(shared_with=request.user).first()
-        return share.permission if share else 'VIEW'
+        return roles.for_request(request).role(obj) or 'VIEW'
 
     def get_file_url(self, obj):
         request = self.context.get('request')
@@ -156,3 +222,45 @@ class NotificationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Notification
         fields = '__all__'
+
+class AuditLogSerializer(serializers.ModelSerializer):
+    username = serializers.CharField(source='user.username', read_only=True, default=None)
+
+    class Meta:
+        model = AuditLog
+        fields = ('id', 'created_at', 'action', 'user', 'username', 'file', 'folder', 'details')
+
+class AuditLogQuerySerializer(serializers.Serializer):
+    file = serializers.UUIDField(required=False)
+    folder = serializers.UUIDField(required=False)
+    user = serializers.IntegerField(required=False)
+    action = serializers.ChoiceField(choices=AuditLog.Action.choices, required=False)
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
+
+class LargestQuerySerializer(serializers.Serializer):
+    folder = serializers.UUIDField(required=False)
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    part_count = serializers.IntegerField(read_only=True)
+    received_parts = serializers.SerializerMethodField()
+    part_size = serializers.IntegerField(required=False, min_value=1)
+
+    class Meta:
+        model = UploadSession
+        fields = ('id', 'name', 'content_type', 'total_size', 'part_size', 'part_count', 'folder', 'description', 'tags', 'metadata', 'status', 'file', 'received_parts', 'created_at', 'updated_at')
+        read_only_fields = ('id', 'status', 'file', 'created_at', 'updated_at')
+
+    def get_received_parts(self, obj):
+        return sorted(obj.parts.values_list('number', flat=True))
+
+    def validate_total_size(self, value):
+        if value < 0:
+            raise serializers.ValidationError("Size cannot be negative.")
+        return value
+
+class ConversionJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ConversionJob
+        fields = ('id', 'file', 'status', 'error', 'created_at', 'finished_at')
+        read_only_fields = fields
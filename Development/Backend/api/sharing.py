@@ -0,0 +1,105 @@
+"""
+Bulk sharing.
+
+Shares many files and folders with many recipients in a fixed number of
+queries: one lookup for all recipients, one set-wise EDIT check per object
+type, one query for existing shares, then bulk inserts of the shares, their
+effective-access rows, GRANT audit rows and one notification per recipient,
+all in a single transaction. bulk_create skips the share post_save signals,
+so the access rows are written here through api.access.
+"""
+from django.db import transaction
+from django.db.models import Q
+
+from . import access, notifications
+from .models import AccessLevel, AuditLog, File, FileShare, Folder, FolderShare, Notification, NotificationType, User
+
+KINDS = (
+    ('file', File, FileShare, access.file_ids, access.file_shares_created),
+    ('folder', Folder, FolderShare, access.folder_ids, access.folder_shares_created),
+)
+
+
+def _recipients(emails):
+    users = {}
+    for user in User.objects.filter(email__in=emails).only('id', 'email').order_by('pk'):
+        users.setdefault(user.email, user)
+    return users
+
+
+def share(user, items, emails, permission, expires_at=None, message=''):
+    """
+    Share ``items`` ({'file': [ids], 'folder': [ids]}) with every address in
+    ``emails``. Returns (created, rejected): lists of result dicts, where each
+    rejection names what was refused and why.
+    """
+    emails = list(dict.fromkeys(emails))
+    recipients = _recipients(emails)
+    rejected = [
+        {'email': email, 'error': "User with this email does not exist."}
+        for email in emails if email not in recipients
+    ]
+    created, counts, audit = [], {}, []
+
+    with transaction.atomic():
+        for kind, model, share_model, editable_ids, shares_created in KINDS:
+            pks = list(dict.fromkeys(items.get(kind) or []))
+            if not pks:
+                continue
+            editable = {
+                obj.pk: obj for obj in model.objects.filter(pk__in=pks).filter(
+                    Q(owner=user) | Q(pk__in=editable_ids(user, access.SATISFIES[AccessLevel.EDIT]))
+                ).only('id', 'name', 'owner_id')
+            }
+            rejected += [
+                {kind: pk, 'error': f"{kind.capitalize()} not found or you do not have permission to share it."}
+                for pk in pks if pk not in editable
+            ]
+            existing = set(share_model.objects.filter(
+                **{f'{kind}_id__in': editable}, shared_with_id__in=[u.pk for u in recipients.values()]
+            ).values_list(f'{kind}_id', 'shared_with_id'))
+
+            pending = []
+            for pk, obj in editable.items():
+                for email, recipient in recipients.items():
+                    if recipient.pk in (obj.owner_id, user.pk):
+                        rejected.append({kind: pk, 'email': email, 'error': "Cannot share with the owner or yourself."})
+                    elif (pk, recipient.pk) in existing:
+                        rejected.append({kind: pk, 'email': email, 'error': "Already shared with this user."})
+                    else:
+                        pending.append((obj, email, share_model(
+                            **{kind: obj}, shared_with=recipient, permission=permission,
+                            expires_at=expires_at, granted_by=user, message=message,
+                        )))
+            if not pending:
+                continue
+
+            shares = share_model.objects.bulk_create([new for _, _, new in pending])
+            shares_created(shares)
+            for (obj, email, _), new in zip(pending, shares):
+                created.append({kind: obj.pk, 'email': email, 'share': new.pk})
+                audit.append(AuditLog(
+                    user=user, action=AuditLog.Action.GRANT, **{kind: obj},
+                    details={'share': new.pk, 'shared_with': new.shared_with_id, 'permission': permission, 'bulk': True},
+                ))
+                names, count = counts.setdefault(new.shared_with_id, ({}, {}))
+                names.setdefault(kind, obj.name)
+                count[kind] = count.get(kind, 0) + 1
+
+        AuditLog.objects.bulk_create(audit)
+        notifications.created(Notification.objects.bulk_create([
+            Notification(
+                user_id=recipient_id, title="Shared With You", type=NotificationType.SHARE,
+                message=_summary(user, names, count),
+            )
+            for recipient_id, (names, count) in counts.items()
+        ]))
+    return created, rejected
+
+
+def _summary(user, names, count):
+    if sum(count.values()) == 1:
+        kind = next(iter(count))
+        return f"{user.username} shared {kind} '{names[kind]}' with you."
+    parts = [f"{n} {kind}{'s' if n != 1 else ''}" for kind, n in count.items()]
+    return f"{user.username} shared {' and '.join(parts)} with you."
@@ -0,0 +1,214 @@
+import copy
+
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import access, authentication, blobs, hierarchy, notifications, search, tags, usage
+from .models import File, FileShare, Folder, FolderShare, Notification, User
+
+
+# Remember the values the access table depends on so post_save can tell what
+# changed. Read from __dict__ so deferred fields never trigger a query.
+def _file_name(instance):
+    value = instance.__dict__.get('file')
+    return getattr(value, 'name', value) or None
+
+
+def _json_state(instance, field):
+    # Copied so in-place edits (file.tags.append(...)) still count as changes
+    return copy.deepcopy(instance.__dict__.get(field))
+
+
+USAGE_FIELDS = ('owner_id', 'folder_id', 'size', 'status')
+SEARCH_FIELDS = ('name', 'description', 'tags', 'metadata')
+
+
+def _usage_state(instance):
+    # None when a field was deferred: pre_save then reads the stored values
+    if all(field in instance.__dict__ for field in USAGE_FIELDS):
+        return tuple(instance.__dict__[field] for field in USAGE_FIELDS)
+    return None
+
+
+@receiver(post_init, sender=File)
+def remember_file_state(sender, instance, **kwargs):
+    instance._access_state = instance.__dict__.get('owner_id')
+    instance._blob_name = _file_name(instance)
+    instance._usage_state = _usage_state(instance)
+    instance._search_state = tuple(_json_state(instance, field) for field in SEARCH_FIELDS)
+    instance._search_blob = _file_name(instance)
+    instance._tags_state = _json_state(instance, 'tags')
+
+
+@receiver(post_init, sender=Folder)
+def remember_folder_state(sender, instance, **kwargs):
+    instance._access_state = instance.__dict__.get('owner_id')
+    instance._tree_parent = instance.__dict__.get('parent_id')
+    instance._tags_state = _json_state(instance, 'tags')
+
+
+@receiver(post_save, sender=File)
+def sync_file_access(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        access.file_created(instance)
+    elif instance._access_state is not None and instance._access_state != instance.owner_id:
+        access.file_owner_changed(instance)
+    instance._access_state = instance.owner_id
+
+
+@receiver(post_save, sender=Folder)
+def sync_folder_access(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        access.folder_created(instance)
+    elif instance._access_state is not None and instance._access_state != instance.owner_id:
+        access.folder_owner_changed(instance)
+    instance._access_state = instance.owner_id
+
+
+@receiver(post_save, sender=Folder)
+def sync_folder_tree(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        hierarchy.folder_created(instance)
+        usage.folder_created(instance)
+    elif 'parent_id' in instance.__dict__ and instance._tree_parent != instance.parent_id:
+        usage.folder_detaching(instance)
+        hierarchy.folder_moved(instance)
+        usage.folder_attached(instance)
+    instance._tree_parent = instance.parent_id
+
+
+@receiver(pre_delete, sender=Folder)
+def detach_folder_tree(sender, instance, **kwargs):
+    # Take the subtree out of its ancestors' totals and links up front, so the
+    # cascaded file deletes only touch folders that are going away too
+    usage.folder_detaching(instance)
+    hierarchy.detach(instance)
+
+
+@receiver(post_save, sender=FileShare)
+def sync_file_share_access(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        access.file_share_saved(instance, created)
+
+
+@receiver(post_save, sender=FolderShare)
+def sync_folder_share_access(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        access.folder_share_saved(instance, created)
+
+
+@receiver(post_delete, sender=FileShare)
+def revoke_file_share_access(sender, instance, **kwargs):
+    access.file_share_deleted(instance)
+
+
+@receiver(post_delete, sender=FolderShare)
+def revoke_folder_share_access(sender, instance, **kwargs):
+    access.folder_share_deleted(instance)
+
+
+# Blob reference counts follow the name stored in File.file
+@receiver(post_save, sender=File)
+def sync_blob_refs(sender, instance, created, raw=False, **kwargs):
+    if raw or 'file' not in instance.__dict__:
+        return
+    name = _file_name(instance)
+    previous = None if created else instance._blob_name
+    if name != previous:
+        blobs.acquire(name)
+        blobs.release(previous)
+    instance._blob_name = name
+
+
+@receiver(post_delete, sender=File)
+def release_blob(sender, instance, **kwargs):
+    blobs.release(_file_name(instance))
+
+
+# Storage counters follow owner, folder, size and status (see api.usage)
+@receiver(pre_save, sender=File)
+@receiver(pre_delete, sender=File)
+def load_usage_state(sender, instance, raw=False, **kwargs):
+    if raw or instance._state.adding or instance._usage_state is not None:
+        return
+    instance._usage_state = File.objects.filter(pk=instance.pk).values_list(*USAGE_FIELDS).first()
+
+
+@receiver(post_save, sender=File)
+def sync_usage(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    new = tuple(getattr(instance, field) for field in USAGE_FIELDS)
+    usage.file_changed(None if created else instance._usage_state, new)
+    instance._usage_state = new
+
+
+@receiver(post_delete, sender=File)
+def release_usage(sender, instance, **kwargs):
+    usage.file_changed(instance._usage_state, None)
+
+
+# Search index rows follow the indexed fields and the content (see api.search)
+@receiver(post_save, sender=File)
+def sync_search_document(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    state = tuple(_json_state(instance, field) for field in SEARCH_FIELDS)
+    content_changed = created or ('file' in instance.__dict__ and _file_name(instance) != instance._search_blob)
+    if created or content_changed or state != instance._search_state:
+        search.file_saved(instance, content_changed)
+    instance._search_state = state
+    instance._search_blob = _file_name(instance)
+
+
+# Tag link rows mirror the JSON tags lists (see api.tags)
+@receiver(post_save, sender=File)
+@receiver(post_save, sender=Folder)
+def sync_tags(sender, instance, created, raw=False, **kwargs):
+    if raw or 'tags' not in instance.__dict__:
+        return
+    if created and not instance.tags:
+        return
+    if created or instance.tags != instance._tags_state:
+        if sender is File:
+            tags.file_tags_changed(instance)
+        else:
+            tags.folder_tags_changed(instance)
+    instance._tags_state = _json_state(instance, 'tags')
+
+
+# New notifications are counted and pushed to open event streams (see api.notifications)
+@receiver(post_save, sender=Notification)
+def track_notification(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        notifications.created([instance])
+
+
+# Tokens issued before a password change or deactivation stop working;
+# privilege changes only drop the cached identity
+def _credentials(instance):
+    return tuple(instance.__dict__.get(name) for name in ('password', 'is_active', 'is_staff', 'is_superuser'))
+
+
+@receiver(post_init, sender=User)
+def remember_user_credentials(sender, instance, **kwargs):
+    instance._credentials_state = _credentials(instance)
+
+
+@receiver(post_save, sender=User)
+def revoke_user_tokens(sender, instance, created, raw=False, **kwargs):
+    password, active, staff, superuser = instance._credentials_state
+    if not (created or raw):
+        # set_password() leaves _password set until after this signal
+        changed = instance._password is not None or (password is not None and instance.__dict__.get('password') != password)
+        if changed or (active and instance.__dict__.get('is_active') is False):
+            authentication.revoke(instance)
+        elif (staff, superuser) != (instance.__dict__.get('is_staff', staff), instance.__dict__.get('is_superuser', superuser)):
+            authentication.forget(instance)
+    instance._credentials_state = _credentials(instance)
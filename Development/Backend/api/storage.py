@@ -0,0 +1,81 @@
+"""
+Content-addressed storage for File.file.
+
+Uploads are hashed with SHA-256 while they are streamed to a temporary file
+and then moved to ``blobs/<aa>/<bb>/<sha256>``. Identical content therefore
+lands on the same name and is stored once; reference counting of shared
+blobs lives in api.blobs. Names written before this storage existed (e.g.
+``uploads/report.pdf``) keep working because the storage root is unchanged.
+
+Save a File row with new content in the same transaction as the content:
+the blob stays locked against deletion until that transaction commits.
+"""
+import hashlib
+import os
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.functional import LazyObject
+
+BLOB_PREFIX = 'blobs'
+
+
+def blob_name(digest):
+    return f'{BLOB_PREFIX}/{digest[:2]}/{digest[2:4]}/{digest}'
+
+
+def digest_from_name(name):
+    """The SHA-256 of a content-addressed name, or None for legacy names."""
+    if name and name.startswith(BLOB_PREFIX + '/'):
+        return name.rsplit('/', 1)[-1]
+    return None
+
+
+class ContentAddressedStorage(FileSystemStorage):
+
+    def get_available_name(self, name, max_length=None):
+        # The final name is derived from the content in _save, never suffixed
+        return name
+
+    def _save(self, name, content):
+        tmp_dir = self.path(f'{BLOB_PREFIX}/tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        sha = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in content.chunks():
+                    sha.update(chunk)
+                    out.write(chunk)
+            from . import blobs  # imports the models, which import this module
+
+            digest = sha.hexdigest()
+            final = blob_name(digest)
+            final_path = self.path(final)
+            # Under the Blob row lock, so the last release of this content cannot
+            # delete the bytes between the check and their reuse (api.blobs)
+            with blobs.claim(digest, os.path.getsize(tmp_path)):
+                if os.path.exists(final_path):
+                    os.unlink(tmp_path)
+                else:
+                    os.makedirs(os.path.dirname(final_path), exist_ok=True)
+                    if self.file_permissions_mode is not None:
+                        os.chmod(tmp_path, self.file_permissions_mode)
+                    os.replace(tmp_path, final_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return final
+
+
+class DefaultBlobStorage(LazyObject):
+    def _setup(self):
+        self._wrapped = ContentAddressedStorage()
+
+
+blob_storage = DefaultBlobStorage()
+
+
+def get_blob_storage():
+    return blob_storage
@@ -0,0 +1,149 @@
+"""
+Normalized tag index.
+
+File.tags and Folder.tags stay the source of truth; api.signals mirrors them
+into Tag plus FileTag/FolderTag link rows whenever they change. Tag filters,
+autocomplete and facet counts then run as indexed joins instead of decoding
+JSON in Python. Rebuild with `manage.py rebuild_tags`.
+"""
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef
+
+from . import access
+from .models import File, FileTag, Folder, FolderTag, Tag
+
+MAX_LENGTH = 100
+
+
+def normalize(values):
+    """{slug: name} for a JSON tags value; blanks and non-lists are ignored."""
+    if not isinstance(values, (list, tuple)):
+        return {}
+    names = {}
+    for value in values:
+        name = str(value).strip()[:MAX_LENGTH] if value is not None else ''
+        if name:
+            # Cut again after casefolding, which can lengthen it ('ß' -> 'ss')
+            names.setdefault(name.casefold()[:MAX_LENGTH], name)
+    return names
+
+
+def parse_param(value):
+    """Slugs from a comma-separated ``tags`` query parameter."""
+    return list(normalize((value or '').split(',')))
+
+
+def tag_ids(names):
+    """Ids for {slug: name}, creating missing tags."""
+    if not names:
+        return {}
+    existing = dict(Tag.objects.filter(slug__in=names).values_list('slug', 'id'))
+    missing = [Tag(slug=slug, name=name) for slug, name in names.items() if slug not in existing]
+    if missing:
+        Tag.objects.bulk_create(missing, ignore_conflicts=True)
+        existing = dict(Tag.objects.filter(slug__in=names).values_list('slug', 'id'))
+    return existing
+
+
+def _sync(link_model, owner_field, pk, values):
+    wanted = set(tag_ids(normalize(values)).values())
+    links = link_model.objects.filter(**{owner_field: pk})
+    current = set(links.values_list('tag_id', flat=True))
+    if current - wanted:
+        links.filter(tag_id__in=current - wanted).delete()
+    if wanted - current:
+        link_model.objects.bulk_create(
+            [link_model(**{owner_field: pk, 'tag_id': tag_id}) for tag_id in wanted - current],
+            ignore_conflicts=True,
+        )
+
+
+def file_tags_changed(file):
+    _sync(FileTag, 'file_id', file.pk, file.tags)
+
+
+def folder_tags_changed(folder):
+    _sync(FolderTag, 'folder_id', folder.pk, folder.tags)
+
+
+def files_tagged(file_pks, names):
+    """Link many files to the tags in {slug: name} (their JSON tags updated in bulk)."""
+    ids = tag_ids(names).values()
+    FileTag.objects.bulk_create(
+        [FileTag(file_id=pk, tag_id=tag_id) for pk in file_pks for tag_id in ids],
+        batch_size=1000, ignore_conflicts=True,
+    )
+
+
+def files_untagged(file_pks, slugs):
+    FileTag.objects.filter(file_id__in=file_pks, tag__slug__in=slugs).delete()
+
+
+def filter_queryset(queryset, slugs, match_all=True):
+    """Restrict a File or Folder queryset to rows tagged with all (or any) of ``slugs``."""
+    if not slugs:
+        return queryset
+    if queryset.model is File:
+        links, column = FileTag.objects, 'file_id'
+    else:
+        links, column = FolderTag.objects, 'folder_id'
+    if not match_all:
+        return queryset.filter(pk__in=links.filter(tag__slug__in=slugs).values(column))
+    for slug in slugs:
+        queryset = queryset.filter(pk__in=links.filter(tag__slug=slug).values(column))
+    return queryset
+
+
+def autocomplete(user, prefix, limit):
+    """Tags starting with ``prefix`` that appear on something ``user`` can access."""
+    slug = prefix.strip().casefold()
+    visible = Exists(FileTag.objects.filter(tag=OuterRef('pk'), file_id__in=access.file_ids(user))) | Exists(
+        FolderTag.objects.filter(tag=OuterRef('pk'), folder_id__in=access.folder_ids(user))
+    )
+    return Tag.objects.filter(visible, slug__startswith=slug).order_by('slug')[:limit]
+
+
+def facets(user, scope='files', slugs=(), match_all=True, limit=50):
+    """
+    [{name, count}] over the ACTIVE files (or folders) ``user`` can access,
+    optionally narrowed to those already carrying ``slugs`` (drill-down).
+    """
+    if scope == 'folders':
+        items = Folder.objects.filter(status='ACTIVE', pk__in=access.folder_ids(user))
+        links, column = FolderTag.objects, 'folder_id'
+    else:
+        items = File.objects.filter(status='ACTIVE', pk__in=access.file_ids(user))
+        links, column = FileTag.objects, 'file_id'
+    items = filter_queryset(items, slugs, match_all)
+    return list(
+        links.filter(**{f'{column}__in': items.values('pk')})
+        .values('tag__name', 'tag__slug').annotate(count=Count(column))
+        .order_by('-count', 'tag__slug')[:limit]
+    )
+
+
+def rebuild():
+    """Recreate every link from the JSON fields. Returns (file_links, folder_links)."""
+    with transaction.atomic():
+        FileTag.objects.all().delete()
+        FolderTag.objects.all().delete()
+        for model, link_model, owner_field in ((File, FileTag, 'file_id'), (Folder, FolderTag, 'folder_id')):
+            batch = []
+            for pk, values in model.objects.exclude(tags=[]).values_list('pk', 'tags').iterator(chunk_size=1000):
+                batch.append((pk, normalize(values)))
+                if len(batch) >= 1000:
+                    _bulk_link(link_model, owner_field, batch)
+                    batch = []
+            _bulk_link(link_model, owner_field, batch)
+    return FileTag.objects.count(), FolderTag.objects.count()
+
+
+def _bulk_link(link_model, owner_field, batch):
+    names = {}
+    for _, tags in batch:
+        for slug, name in tags.items():
+            names.setdefault(slug, name)
+    ids = tag_ids(names)
+    link_model.objects.bulk_create([
+        link_model(**{owner_field: pk, 'tag_id': ids[slug]}) for pk, tags in batch for slug in tags
+    ], batch_size=1000, ignore_conflicts=True)
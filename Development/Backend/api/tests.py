@@ -1,3 +1,1613 @@
-from django.test import TestCase
+import asyncio
+import importlib
+import io
+import json
+import os
+import socket
+import tempfile
+import uuid
+from datetime import timedelta
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import AsyncClient, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from docx import Document
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import (
+    access, audit, authentication, concurrency, conversion, downloads, events, expiry, hierarchy,
+    jobs, notifications, render, roles, search, sharing, tags, usage,
+)
+from .models import (
+    AuditLog, Blob, ConversionJob, User, Folder, File, FileAccess, FileShare, FileTag, FolderAccess, FolderClosure, FolderShare,
+    FolderTag, FolderUsage, Notification, NotificationCounter, StorageUsage, Tag, UploadPart, UploadSession,
+)
+from .storage import blob_storage
+from .views import clean_block_changes
+
+
+class ListingQueryBudgetTests(TestCase):
+    """Serializing a listing must not issue queries per row."""
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', 'owner@example.com', 'pw')
+        self.viewer = User.objects.create_user('viewer', 'viewer@example.com', 'pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def add_rows(self, count):
+        for i in range(count):
+            folder = Folder.objects.create(name=f'folder {i}', owner=self.owner)
+            FolderShare.objects.create(folder=folder, shared_with=self.viewer, permission='EDIT')
+            file = File.objects.create(
+                name=f'file {i}', file=ContentFile(b'x', name=f'f{i}.txt'),
+                size=1, type='text/plain', owner=self.owner, folder=folder, locked_by=self.owner,
+                lock_expires_at=timezone.now() + timedelta(hours=1),
+            )
+            FileShare.objects.create(file=file, shared_with=self.viewer, permission='EDIT')
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response
+
+    def test_file_list_query_count_is_constant(self):
+        self.add_rows(2)
+        small, _ = self.count_queries('/api/files/')
+        self.add_rows(10)
+        large, response = self.count_queries('/api/files/')
+        self.assertEqual(small, large)
+        self.assertEqual({row['role'] for row in response.data['results']}, {'EDIT'})
+
+    def test_folder_list_query_count_is_constant(self):
+        self.add_rows(2)
+        small, _ = self.count_queries('/api/folders/')
+        self.add_rows(10)
+        large, response = self.count_queries('/api/folders/')
+        self.assertEqual(small, large)
+        self.assertEqual({row['role'] for row in response.data['results']}, {'EDIT'})
+
+    def test_file_detail_query_count(self):
+        self.add_rows(1)
+        file = File.objects.get()
+        queries, response = self.count_queries(f'/api/files/{file.pk}/')
+        self.assertEqual(response.data['role'], 'EDIT')
+        self.assertEqual(response.data['locked_by_details']['username'], 'owner')
+        self.assertLessEqual(queries, 2)
+
+
+class AccessTableTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', 'owner@example.com', 'pw')
+        self.viewer = User.objects.create_user('viewer', 'viewer@example.com', 'pw')
+        self.folder = Folder.objects.create(name='Docs', owner=self.owner)
+        self.file = File.objects.create(name='a.txt', file=ContentFile(b'a', name='a.txt'), size=1, type='text/plain', owner=self.owner, folder=self.folder)
+
+    def rows(self):
+        return (
+            set(FolderAccess.objects.values_list('user_id', 'folder_id', 'permission', 'expires_at', 'folder_share_id')),
+            set(FileAccess.objects.values_list('user_id', 'file_id', 'permission', 'expires_at', 'file_share_id')),
+        )
+
+    def test_signals_keep_rows_in_step(self):
+        self.assertEqual(self.rows(), (
+            {(self.owner.pk, self.folder.pk, 'OWNER', None, None)},
+            {(self.owner.pk, self.file.pk, 'OWNER', None, None)},
+        ))
+        # A folder share grants the folder only, as the share tables always did
+        folder_share = FolderShare.objects.create(folder=self.folder, shared_with=self.viewer, permission='EDIT')
+        self.assertEqual(set(Folder.objects.filter(pk__in=access.folder_ids(self.viewer))), {self.folder})
+        self.assertFalse(File.objects.filter(pk__in=access.file_ids(self.viewer)).exists())
+
+        share = FileShare.objects.create(file=self.file, shared_with=self.viewer, permission='VIEW')
+        self.assertEqual(list(access.file_ids(self.viewer).values_list('file_id', flat=True)), [self.file.pk])
+        share.permission = 'EDIT'
+        share.save()
+        self.assertTrue(access.file_ids(self.viewer, access.SATISFIES['EDIT']).exists())
+        share.delete()
+        folder_share.delete()
+        self.assertFalse(access.file_ids(self.viewer).exists() or access.folder_ids(self.viewer).exists())
+
+        self.file.owner = self.viewer
+        self.file.save()
+        self.assertEqual(FileAccess.objects.get().user, self.viewer)
+
+    def test_expired_grants_are_filtered(self):
+        FileShare.objects.create(file=self.file, shared_with=self.viewer, permission='VIEW', expires_at=timezone.now() - timedelta(seconds=1))
+        FolderShare.objects.create(folder=self.folder, shared_with=self.viewer, permission='VIEW', expires_at=timezone.now() + timedelta(days=1))
+        self.assertEqual(FileAccess.objects.filter(user=self.viewer).count(), 1)
+        self.assertFalse(access.file_ids(self.viewer).exists())
+        self.assertTrue(access.folder_ids(self.viewer).exists())
+
+    def test_rebuild_matches_incremental_upkeep(self):
+        other = User.objects.create_user('other', 'other@example.com', 'pw')
+        sub = Folder.objects.create(name='Sub', owner=other, parent=self.folder)
+        moved = File.objects.create(name='b.txt', file=ContentFile(b'b', name='b.txt'), size=1, type='text/plain', owner=other)
+        FolderShare.objects.create(folder=self.folder, shared_with=self.viewer, permission='EDIT')
+        FolderShare.objects.create(folder=sub, shared_with=self.owner, permission='VIEW', expires_at=timezone.now() + timedelta(days=1))
+        FileShare.objects.create(file=self.file, shared_with=other, permission='EDIT')
+        sharing.share(self.owner, {'file': [self.file.pk]}, [self.viewer.email], 'VIEW')  # bulk_create path
+        moved.folder = sub
+        moved.owner = self.owner
+        moved.save()
+        incremental = self.rows()
+
+        self.assertEqual(access.rebuild_all(), (len(incremental[0]), len(incremental[1])))
+        self.assertEqual(self.rows(), incremental)
+        call_command('rebuild_access', stdout=io.StringIO())
+        self.assertEqual(self.rows(), incremental)
+
+class FolderTreeTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', 'owner@example.com', 'pw')
+        self.viewer = User.objects.create_user('viewer', 'viewer@example.com', 'pw')
+        self.root = Folder.objects.create(name='Root', owner=self.owner)
+        self.mid = Folder.objects.create(name='Mid', owner=self.owner, parent=self.root)
+        self.leaf = Folder.objects.create(name='Leaf', owner=self.owner, parent=self.mid)
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def links(self):
+        return set(FolderClosure.objects.values_list('ancestor_id', 'descendant_id', 'depth'))
+
+    def assertConsistent(self):
+        self.assertEqual(hierarchy.check(), (set(), set(), []))
+
+    def test_create_move_and_delete_keep_the_closure(self):
+        root, mid, leaf = self.root.pk, self.mid.pk, self.leaf.pk
+        self.assertEqual(self.links(), {
+            (root, root, 0), (mid, mid, 0), (leaf, leaf, 0),
+            (root, mid, 1), (mid, leaf, 1), (root, leaf, 2),
+        })
+
+        other = Folder.objects.create(name='Other', owner=self.owner)
+        self.mid.parent = other
+        self.mid.save()
+        self.assertConsistent()
+        self.assertFalse(FolderClosure.objects.filter(ancestor_id=root, depth__gt=0).exists())
+        self.assertEqual(FolderClosure.objects.get(ancestor=other, descendant=self.leaf).depth, 2)
+
+        self.mid.delete()
+        self.assertConsistent()
+        self.assertFalse(FolderClosure.objects.filter(descendant_id__in=[mid, leaf]).exists())
+
+    def test_move_into_own_subtree_is_rejected(self):
+        for target in (self.root, self.leaf):
+            response = self.client.patch(f'/api/folders/{self.root.pk}/', {'parent': str(target.pk)}, format='json')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('parent', response.data)
+        self.root.refresh_from_db()
+        self.assertIsNone(self.root.parent_id)
+        self.assertConsistent()
+
+    def test_breadcrumbs_skip_folders_the_user_cannot_see(self):
+        response = self.client.get(f'/api/folders/{self.leaf.pk}/breadcrumbs/')
+        self.assertEqual([row['name'] for row in response.data], ['Root', 'Mid', 'Leaf'])
+
+        FolderShare.objects.create(folder=self.leaf, shared_with=self.viewer, permission='VIEW')
+        self.client.force_authenticate(self.viewer)
+        response = self.client.get(f'/api/folders/{self.leaf.pk}/breadcrumbs/')
+        self.assertEqual([row['name'] for row in response.data], ['Leaf'])
+
+    def test_descendant_counts_only_count_accessible_items(self):
+        def add_file(name, folder, owner):
+            return File.objects.create(name=name, file=ContentFile(b'x', name=name), size=1, type='text/plain', owner=owner, folder=folder)
+
+        visible = add_file('visible.txt', self.leaf, self.owner)
+        add_file('hidden.txt', self.mid, self.owner)
+        Folder.objects.create(name='Hidden', owner=self.owner, parent=self.mid)
+        FolderShare.objects.create(folder=self.root, shared_with=self.viewer, permission='VIEW')
+        FolderShare.objects.create(folder=self.leaf, shared_with=self.viewer, permission='VIEW')
+        FileShare.objects.create(file=visible, shared_with=self.viewer, permission='VIEW')
+
+        response = self.client.get(f'/api/folders/{self.root.pk}/descendant_counts/')
+        self.assertEqual(response.data, {'folders': 3, 'files': 2})
+
+        self.client.force_authenticate(self.viewer)
+        response = self.client.get(f'/api/folders/{self.root.pk}/descendant_counts/')
+        self.assertEqual(response.data, {'folders': 1, 'files': 1})
+
+    def test_rebuild_command_check_reports_and_repairs(self):
+        out = io.StringIO()
+        call_command('rebuild_folder_tree', '--check', stdout=out)
+        self.assertIn('consistent', out.getvalue())
+
+        FolderClosure.objects.filter(ancestor=self.root, descendant=self.leaf).delete()
+        FolderClosure.objects.create(ancestor=self.leaf, descendant=self.root, depth=5)
+        out = io.StringIO()
+        with self.assertRaisesMessage(CommandError, '1 missing, 1 stale, 0 cycles'):
+            call_command('rebuild_folder_tree', '--check', stdout=out)
+        self.assertIn(f'missing or wrong depth: {self.root.pk} -> {self.leaf.pk}', out.getvalue())
+        self.assertIn(f'stale: {self.leaf.pk} -> {self.root.pk}', out.getvalue())
+
+        call_command('rebuild_folder_tree', stdout=io.StringIO())
+        self.assertConsistent()
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('pager', 'pager@example.com', 'pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for i in range(7):
+            Notification.objects.create(user=self.user, title=f'n{i}', message='m')
+
+    def test_walks_forward_and_back_without_gaps(self):
+        seen = []
+        url = '/api/notifications/?page_size=3'
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.data)
+            seen += [row['id'] for row in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(seen, sorted(seen, reverse=True))
+        self.assertEqual(len(set(seen)), 7)
+        self.assertEqual([len(p['results']) for p in pages], [3, 3, 1])
+
+        back = self.client.get(pages[2]['previous']).data
+        self.assertEqual(back['results'], pages[1]['results'])
+
+    def test_rejects_tampered_cursor(self):
+        response = self.client.get('/api/notifications/?cursor=bm9wZQ')
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class BlobStoreTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', 'owner@example.com', 'pw')
+
+    def create(self, content, name='a.txt'):
+        return File.objects.create(name=name, file=ContentFile(content, name=name), size=len(content), type='text/plain', owner=self.owner)
+
+    def test_identical_content_is_stored_once_and_released_with_its_last_row(self):
+        first, second = self.create(b'same'), self.create(b'same', 'b.txt')
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertEqual(Blob.objects.get().ref_count, 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(blob_storage.exists(second.file.name))
+
+        # Replacing the content releases the old blob
+        name = second.file.name
+        with self.captureOnCommitCallbacks(execute=True):
+            second.file.save('b.txt', ContentFile(b'other'), save=False)
+            second.save()
+        self.assertFalse(blob_storage.exists(name))
+        self.assertEqual(list(Blob.objects.values_list('ref_count', flat=True)), [1])
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(Blob.objects.exists())
+
+    def test_content_saved_without_a_row_is_removed_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            name = blob_storage.save('stray.txt', ContentFile(b'stray'))
+        self.assertFalse(blob_storage.exists(name))
+        self.assertFalse(Blob.objects.exists())
+
+    def test_reupload_before_the_delete_runs_keeps_the_bytes(self):
+        first = self.create(b'same')
+        with self.captureOnCommitCallbacks() as pending:
+            first.delete()
+        # The same content arrives before the release's delete runs
+        second = self.create(b'same')
+        for callback in pending:
+            callback()
+        self.assertTrue(blob_storage.exists(second.file.name))
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+
+    def test_dedupe_uploads(self):
+        for name in ('uploads/a.txt', 'uploads/b.txt', 'uploads/orphan.txt'):
+            path = blob_storage.path(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as fh:
+                fh.write(b'legacy')
+        rows = [
+            File.objects.create(name=name, file=f'uploads/{name}', size=6, type='text/plain', owner=self.owner)
+            for name in ('a.txt', 'b.txt')
+        ]
+        call_command('dedupe_uploads', '--delete-orphans', stdout=io.StringIO(), stderr=io.StringIO())
+        names = {File.objects.get(pk=row.pk).file.name for row in rows}
+        self.assertEqual(len(names), 1)
+        self.assertTrue(blob_storage.exists(names.pop()))
+        self.assertEqual(Blob.objects.get().ref_count, 2)
+        self.assertFalse(any(blob_storage.exists(f'uploads/{name}') for name in ('a.txt', 'b.txt', 'orphan.txt')))
+
+
+class StorageUsageTests(TestCase):
+    """Counters must match a recount after every kind of change."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('saver', 'saver@example.com', 'pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.root = Folder.objects.create(name='root', owner=self.user)
+        self.child = Folder.objects.create(name='child', owner=self.user, parent=self.root)
+
+    def add_file(self, size, folder):
+        return File.objects.create(
+            name=f'{size}.bin', file=ContentFile(b'x' * size, name=f'{size}.bin'),
+            size=size, type='application/octet-stream', owner=self.user, folder=folder,
+        )
+
+    def assertConsistent(self):
+        self.assertEqual(usage.check(), ([], []))
+
+    def test_counters_follow_every_change(self):
+        small = self.add_file(3, self.child)
+        big = self.add_file(10, self.root)
+        self.assertEqual(FolderUsage.objects.get(folder=self.root).total_bytes, 13)
+        self.assertConsistent()
+
+        self.client.delete(f'/api/files/{big.pk}/')
+        self.assertEqual(FolderUsage.objects.get(folder=self.root).total_bytes, 3)
+        self.assertEqual(StorageUsage.objects.get(user=self.user).used_bytes, 13)
+        self.client.post(f'/api/files/{big.pk}/restore/')
+        self.assertConsistent()
+
+        self.child.parent = None
+        self.child.save()
+        self.assertEqual(FolderUsage.objects.get(folder=self.root).total_bytes, 10)
+        self.assertConsistent()
+
+        self.client.delete(f'/api/files/{small.pk}/')
+        self.client.post(f'/api/files/{small.pk}/purge/')
+        self.assertEqual(StorageUsage.objects.get(user=self.user).used_bytes, 10)
+        self.root.delete()
+        self.assertEqual(StorageUsage.objects.get(user=self.user).file_count, 0)
+        self.assertConsistent()
+
+    def test_upload_is_refused_over_quota(self):
+        self.add_file(10, None)
+        StorageUsage.objects.filter(user=self.user).update(quota_bytes=12)
+        upload = ContentFile(b'x' * 5, name='more.bin')
+        response = self.client.post('/api/files/', {'name': 'more.bin', 'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 507)
+
+    def test_largest_files_first(self):
+        for size in (5, 50, 20):
+            self.add_file(size, self.root)
+        self.add_file(30, self.child)
+        response = self.client.get('/api/files/largest/')
+        self.assertEqual([row['size'] for row in response.data['results']], [50, 30, 20, 5])
+        response = self.client.get(f'/api/files/largest/?folder={self.child.pk}')
+        self.assertEqual([row['size'] for row in response.data['results']], [30])
+        self.assertEqual(len(self.client.get('/api/files/largest/?folder=').data['results']), 4)
+        response = self.client.get('/api/files/largest/?folder=nope')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('folder', response.data)
+
+    @override_settings(STORAGE_QUOTA=10)
+    def test_quota_check_creates_the_row_it_locks(self):
+        # Concurrent first uploads must have a StorageUsage row to wait on
+        self.assertFalse(StorageUsage.objects.filter(user=self.user).exists())
+        usage.check_quota(self.user, 10)
+        self.assertEqual(StorageUsage.objects.get(user=self.user).used_bytes, 0)
+        with self.assertRaises(usage.QuotaExceeded):
+            usage.check_quota(self.user, 11)
+        self.assertConsistent()
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ChunkedUploadTests(TestCase):
+    DATA = bytes(range(256)) * 40  # 10240 bytes: parts of 4096, 4096 and 2048
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', 'owner@example.com', 'pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        response = self.client.post('/api/uploads/', {
+            'name': 'big.bin', 'total_size': len(self.DATA), 'part_size': 4096, 'content_type': 'application/x-test',
+        }, format='json')
+        self.assertEqual((response.status_code, response.data['part_count']), (201, 3))
+        self.url = f"/api/uploads/{response.data['id']}/"
+
+    def put(self, number, body):
+        return self.client.put(f'{self.url}parts/{number}/', body, content_type='application/octet-stream')
+
+    def upload(self, *numbers):
+        for number in numbers:
+            start = (number - 1) * 4096
+            self.assertEqual(self.put(number, self.DATA[start:start + 4096]).status_code, 200)
+
+    def test_parts_resume_and_complete(self):
+        self.upload(3)
+        response = self.client.post(self.url + 'complete/')
+        self.assertEqual((response.status_code, response.data['missing_parts']), (400, [1, 2]))
+        self.upload(1)
+        self.assertEqual(self.client.get(self.url).data['received_parts'], [1, 3])
+
+        # A retried part replaces the stored copy instead of adding one
+        self.upload(2)
+        first = UploadPart.objects.get(number=2).storage_name
+        self.upload(2)
+        self.assertNotEqual(UploadPart.objects.get(number=2).storage_name, first)
+        self.assertFalse(default_storage.exists(first))
+
+        response = self.client.post(self.url + 'complete/')
+        self.assertEqual(response.status_code, 201)
+        file = File.objects.get(pk=response.data['id'])
+        with file.file.open('rb') as fh:
+            self.assertEqual(fh.read(), self.DATA)
+        self.assertFalse(UploadPart.objects.exists())
+        # Completing again is idempotent, until the file is gone
+        self.assertEqual(self.client.post(self.url + 'complete/').data['id'], str(file.pk))
+        file.delete()
+        self.assertEqual(self.client.post(self.url + 'complete/').status_code, 400)
+
+    def test_rejected_parts(self):
+        self.assertEqual(self.put(1, self.DATA[:4000]).status_code, 400)
+        self.assertEqual(self.put(1, self.DATA[:4097]).status_code, 400)
+        self.assertEqual(self.put(4, self.DATA[:2048]).status_code, 400)
+        response = self.client.put(f'{self.url}parts/1/')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], 'Part 1 has no body.')
+        self.assertFalse(UploadPart.objects.exists())
+
+    def test_empty_file_uploads_in_one_empty_part(self):
+        response = self.client.post('/api/uploads/', {'name': 'empty.txt', 'total_size': 0}, format='json')
+        self.assertEqual((response.status_code, response.data['part_count']), (201, 1))
+        url = f"/api/uploads/{response.data['id']}/"
+        response = self.client.put(f'{url}parts/1/')
+        self.assertEqual((response.status_code, response.data['size']), (200, 0))
+        response = self.client.post(url + 'complete/')
+        self.assertEqual(response.status_code, 201)
+        file = File.objects.get(pk=response.data['id'])
+        self.assertEqual((file.size, file.file.read()), (0, b''))
+
+    def test_quota_is_checked_again_at_complete(self):
+        self.upload(1, 2, 3)
+        File.objects.create(name='big', file=ContentFile(b'x' * 100, name='big'), size=100, type='text/plain', owner=self.owner)
+        with override_settings(STORAGE_QUOTA=len(self.DATA) + 50):
+            response = self.client.post(self.url + 'complete/')
+        self.assertEqual(response.status_code, 507)
+        self.assertEqual(UploadPart.objects.count(), 3)
+
+    def test_abort_discards_parts(self):
+        self.upload(1)
+        name = UploadPart.objects.get().storage_name
+        self.assertEqual(self.client.delete(self.url).status_code, 204)
+        self.assertFalse(default_storage.exists(name))
+        self.assertEqual(UploadSession.objects.get().status, 'ABORTED')
+        self.assertEqual(self.put(2, self.DATA[4096:8192]).status_code, 400)
+
+
+class DownloadTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', 'owner@example.com', 'pw')
+        self.file = File.objects.create(name='digits.txt', file=ContentFile(b'0123456789', name='digits.txt'), size=10, type='text/plain', owner=self.owner)
+        # Sub-second part on purpose: Last-Modified and If-Modified-Since are whole seconds
+        File.objects.filter(pk=self.file.pk).update(updated_at=timezone.now().replace(microsecond=500000))
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        self.url = f'/api/files/{self.file.pk}/download/'
+
+    def get(self, **headers):
+        response = self.client.get(self.url, **headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_validators_answer_304(self):
+        response, body = self.get()
+        self.assertEqual((response.status_code, body), (200, b'0123456789'))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=response['ETag'])[0].status_code, 304)
+        self.assertEqual(self.get(HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])[0].status_code, 304)
+
+    def test_ranges(self):
+        response, body = self.get(HTTP_RANGE='bytes=2-4')
+        self.assertEqual((response.status_code, body, response['Content-Range']), (206, b'234', 'bytes 2-4/10'))
+        self.assertEqual(self.get(HTTP_RANGE='bytes=-3')[1], b'789')
+        self.assertEqual(self.get(HTTP_RANGE='bytes=7-')[1], b'789')
+
+        # Multi-range is not supported and may be ignored: the whole file
+        response, body = self.get(HTTP_RANGE='bytes=0-1,3-4')
+        self.assertEqual((response.status_code, body), (200, b'0123456789'))
+
+        response, _ = self.get(HTTP_RANGE='bytes=20-')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */10'))
+
+        etag = response['ETag']
+        self.assertEqual(self.get(HTTP_RANGE='bytes=0-0', HTTP_IF_RANGE=etag)[0].status_code, 206)
+        response, body = self.get(HTTP_RANGE='bytes=0-0', HTTP_IF_RANGE='"stale"')
+        self.assertEqual((response.status_code, body), (200, b'0123456789'))
+
+    def test_offload_headers(self):
+        with override_settings(DOWNLOAD_OFFLOAD='x-accel-redirect', DOWNLOAD_OFFLOAD_PREFIX='/protected/'):
+            response, body = self.get(HTTP_RANGE='bytes=2-4')
+        self.assertEqual((response.status_code, body), (200, b''))
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/' + self.file.file.name)
+        self.assertEqual(response['Content-Type'], 'text/plain')
+        with override_settings(DOWNLOAD_OFFLOAD='x-sendfile'):
+            response, _ = self.get()
+        self.assertEqual(response['X-Sendfile'], self.file.file.path)
+        self.assertIn('attachment', response['Content-Disposition'])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ConversionJobTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', 'owner@example.com', 'pw')
+        self.other = User.objects.create_user('other', 'other@example.com', 'pw')
+        self.file = File.objects.create(name='a.docx', file=ContentFile(b'old', name='a.docx'), size=3, type='text/plain', owner=self.owner)
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def output(self, content=b'new'):
+        fd, path = tempfile.mkstemp(suffix='.docx')
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(content)
+        self.addCleanup(os.unlink, path)
+        return path
+
+    def pool(self, timeout=30):
+        return jobs.ConversionPool(workers=1, queue_size=0, timeout=timeout, memory_limit=None, start_method='spawn')
+
+    def test_saturated_pool_answers_503(self):
+        pool = jobs.get_pool()
+        held = 0
+        while pool.slots.acquire(blocking=False):
+            held += 1
+        try:
+            response = self.client.post(f'/api/files/{self.file.pk}/save_content/', {'content': '<p>x</p>'}, format='json')
+        finally:
+            for _ in range(held):
+                pool.slots.release()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], str(settings.CONVERSION_RETRY_AFTER))
+        self.assertFalse(ConversionJob.objects.exists())
+
+    def test_conversion_errors_are_reported(self):
+        error_path = self.output(b'')
+        with self.assertRaisesMessage(jobs.ConversionFailed, 'timed out after 0 seconds'):
+            self.pool(timeout=0)._convert('html_to_docx', ('<p>x</p>', self.output(), None), error_path)
+        with self.assertRaisesMessage(jobs.ConversionFailed, "Package not found at '/nonexistent.docx'"):
+            self.pool()._convert('patch_docx', ('/nonexistent.docx', [], 'base', self.output(), None), error_path)
+
+    def test_finish_refuses_a_stale_save(self):
+        base, version = downloads.content_version(self.file), self.file.version
+        refusals = [
+            ({'base': 'stale'}, 'The document changed'),
+            ({'version': version - 1}, 'If-Match'),
+        ]
+        for kwargs, message in refusals:
+            job = ConversionJob.objects.create(file=self.file, user=self.owner)
+            with self.assertRaisesMessage(jobs.ConversionFailed, message):
+                jobs.finish(job.pk, self.output(), **kwargs)
+        File.objects.filter(pk=self.file.pk).update(locked_by=self.other, lock_expires_at=timezone.now() + timedelta(minutes=1))
+        with self.assertRaisesMessage(jobs.ConversionFailed, 'Another user locked the file'):
+            jobs.finish(job.pk, self.output())
+        self.file.refresh_from_db()
+        self.assertEqual(self.file.file.read(), b'old')
+
+        File.objects.filter(pk=self.file.pk).update(locked_by=None, lock_expires_at=None)
+        jobs.finish(job.pk, self.output(), base, version)
+        job.refresh_from_db()
+        self.file.refresh_from_db()
+        self.assertEqual((job.status, self.file.file.read()), ('SUCCEEDED', b'new'))
+
+    def test_orphaned_jobs_fail_and_finished_jobs_are_purged(self):
+        now = timezone.now()
+        orphaned = ConversionJob.objects.create(file=self.file, user=self.owner, status='RUNNING')
+        live = ConversionJob.objects.create(file=self.file, user=self.owner)
+        old = ConversionJob.objects.create(file=self.file, user=self.owner, status='SUCCEEDED', finished_at=now - timedelta(days=8))
+        recent = ConversionJob.objects.create(file=self.file, user=self.owner, status='FAILED', finished_at=now - timedelta(days=6))
+        ConversionJob.objects.filter(pk=orphaned.pk).update(created_at=now - jobs.max_job_age() - timedelta(seconds=1))
+
+        out = io.StringIO()
+        with self.settings(CONVERSION_JOB_RETENTION_DAYS=7):
+            call_command('purge_conversion_jobs', stdout=out)
+        self.assertIn('Marked 1 orphaned jobs as failed and deleted 1 finished jobs', out.getvalue())
+        self.assertEqual(set(ConversionJob.objects.values_list('pk', flat=True)), {orphaned.pk, live.pk, recent.pk})
+        response = self.client.get(f'/api/jobs/{orphaned.pk}/')
+        self.assertEqual(response.data['status'], 'FAILED')
+        self.assertIn('restarted', response.data['error'])
+        self.assertEqual(self.client.get(f'/api/jobs/{live.pk}/').data['status'], 'PENDING')
+        self.assertFalse(ConversionJob.objects.filter(pk=old.pk).exists())
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class BlockPatchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('writer', 'writer@example.com', 'pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def document(self, *texts):
+        document = Document()
+        for text in texts:
+            document.add_paragraph(text)
+        return document
+
+    def blocks(self, document, seed='base'):
+        return [(block['id'], block['text']) for block in conversion.describe_blocks(document, seed)]
+
+    def test_apply_changes(self):
+        document = self.document('one', 'two', 'three')
+        (one, _), (two, _), (three, _) = self.blocks(document)
+        conversion.apply_changes(document, [
+            {'op': 'replace', 'id': two, 'html': '<p>TWO</p><p>two and a bit</p>'},
+            {'op': 'insert', 'after': one, 'id': '0000000A', 'html': '<p>one and a half</p>'},
+            {'op': 'insert', 'after': None, 'id': '0000000B', 'html': '<p>zero</p>'},
+            {'op': 'delete', 'id': three},
+        ], 'base')
+        blocks = self.blocks(document)
+        self.assertEqual([text for _, text in blocks], ['zero', 'one', 'one and a half', 'TWO', 'two and a bit'])
+        self.assertEqual([block for block, _ in blocks[:4]], ['0000000B', one, '0000000A', two])
+        self.assertEqual(len({block for block, _ in blocks}), 5)
+
+        with self.assertRaisesMessage(conversion.PatchError, 'Unknown block id'):
+            conversion.apply_changes(document, [{'op': 'delete', 'id': three}], 'base')
+
+    def test_block_ids_never_collide(self):
+        document = self.document('one', 'two')
+        one, two = conversion.ensure_block_ids(document, 'base')
+        with self.assertRaisesMessage(conversion.PatchError, f"Block id '{conversion.block_id(one)}' is already in use"):
+            conversion.apply_changes(document, [{'op': 'insert', 'after': None, 'id': conversion.block_id(one), 'html': '<p>x</p>'}], 'base')
+
+        # A stored id equal to the one a later block would be given, and a repeated id
+        document = self.document('one', 'two', 'three')
+        first, second, third = (paragraph._p for paragraph in document.paragraphs)
+        conversion.set_block_id(first, conversion.derived_id('base', 1))
+        conversion.set_block_id(third, conversion.derived_id('base', 1))
+        ids = [block for block, _ in self.blocks(document)]
+        self.assertEqual(len(set(ids)), 3)
+        self.assertEqual(ids, [block for block, _ in self.blocks(document)])
+
+    def test_save_checks_base_and_ids_before_queueing(self):
+        buffer = io.BytesIO()
+        self.document('one').save(buffer)
+        file = File.objects.create(name='a.docx', file=ContentFile(buffer.getvalue(), name='a.docx'), size=1, type='text/plain', owner=self.user)
+        url = f'/api/files/{file.pk}/save_content/'
+        base = self.client.get(f'/api/files/{file.pk}/blocks/').data['base']
+
+        response = self.client.post(url, {'mode': 'patch', 'base': 'stale', 'changes': [{'op': 'delete', 'id': '00000001'}]}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['base'], base)
+        response = self.client.post(url, {'mode': 'patch', 'base': base, 'changes': [
+            {'op': 'insert', 'after': None, 'id': '0000000a', 'html': '<p>x</p>'},
+            {'op': 'insert', 'after': None, 'id': '0000000A', 'html': '<p>y</p>'},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], 'changes[1]: id 0000000A is inserted twice')
+        self.assertFalse(ConversionJob.objects.exists())
+
+    def test_inserts_without_an_id_are_assigned_one(self):
+        changes, assigned = clean_block_changes([
+            {'op': 'insert', 'after': None, 'html': '<p>a</p>'},
+            {'op': 'replace', 'id': '0000abcd', 'html': '<p>b</p>'},
+            {'op': 'insert', 'after': '0000ABCD', 'html': '<p>c</p>'},
+        ])
+        self.assertEqual(set(assigned), {0, 2})
+        self.assertNotEqual(assigned[0], assigned[2])
+        self.assertEqual([change['id'] for change in changes], [assigned[0], '0000ABCD', assigned[2]])
+        self.assertTrue(all(int(block, 16) < 0x80000000 for block in assigned.values()))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), RENDER_CACHE_ROOT=tempfile.mkdtemp())
+class RenderCacheTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', 'owner@example.com', 'pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        self.file = File.objects.create(name='a.docx', file=ContentFile(self.docx('Hello render'), name='a.docx'), size=1, type='text/plain', owner=self.owner)
+        self.url = f'/api/files/{self.file.pk}/render/'
+
+    def docx(self, text):
+        document = Document()
+        document.add_paragraph(text)
+        buffer = io.BytesIO()
+        document.save(buffer)
+        return buffer.getvalue()
+
+    def test_each_version_is_rendered_once(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Hello render', response.data['html'])
+        index = os.path.join(render.cache_dir(response.data['base']), 'index.html')
+        with open(index, 'w', encoding='utf-8') as fh:
+            fh.write('<p>from the cache</p>')
+
+        self.assertEqual(self.client.get(self.url).data['html'], '<p>from the cache</p>')
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_new_content_is_rendered_and_the_old_version_dropped(self):
+        old = self.client.get(self.url).data['base']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.file.file.save('a.docx', ContentFile(self.docx('Second draft')), save=False)
+            self.file.save()
+
+        response = self.client.get(self.url)
+        self.assertNotEqual(response.data['base'], old)
+        self.assertIn('Second draft', response.data['html'])
+        self.assertFalse(os.path.exists(render.cache_dir(old)))
+
+    def test_only_parse_errors_are_client_errors(self):
+        broken = File.objects.create(name='b.docx', file=ContentFile(b'not a zip', name='b.docx'), size=9, type='text/plain', owner=self.owner)
+        response = self.client.get(f'/api/files/{broken.pk}/render/')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], 'File is not a readable DOCX document')
+
+        blob_storage.delete(self.file.file.name)
+        with self.assertRaises(FileNotFoundError):
+            self.client.get(self.url)
+
+    def test_asset_links_are_signed_per_version(self):
+        base = self.client.get(self.url).data['base']
+        with open(os.path.join(render.cache_dir(base), 'image1.png'), 'wb') as fh:
+            fh.write(b'png')
+        token = render.asset_token(base)
+        anonymous = APIClient()
+
+        response = anonymous.get(f'/api/render-assets/{token}/image1.png')
+        self.assertEqual((response.status_code, b''.join(response.streaming_content)), (200, b'png'))
+        self.assertIn('immutable', response['Cache-Control'])
+        for path in (f'{token}x/image1.png', f'{token}/..%2Findex.html', f'{token}/index.html',
+                     f'{render.asset_token("0" * 64)}/image1.png', f'{base}/image1.png'):
+            self.assertEqual(anonymous.get(f'/api/render-assets/{path}').status_code, 404, path)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('finder', 'finder@example.com', 'pw')
+        self.other = User.objects.create_user('other', 'other@example.com', 'pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def add_file(self, name, text, owner=None, **fields):
+        file = File.objects.create(
+            name=name, file=ContentFile(text.encode(), name=name), size=len(text),
+            type='text/plain', owner=owner or self.owner, **fields,
+        )
+        search.index_content(file)
+        return file
+
+    def query(self, q):
+        response = self.client.get('/api/search/', {'q': q})
+        self.assertEqual(response.status_code, 200)
+        return [row['name'] for row in response.data['results']]
+
+    def test_ranked_prefix_matches_within_access(self):
+        self.add_file('notes.txt', 'the quarterly budget is attached')
+        self.add_file('budget.txt', 'numbers')
+        self.add_file('tagged.txt', 'nothing', tags=['budgeting'])
+        self.add_file('private.txt', 'budget of someone else', owner=self.other)
+
+        self.assertEqual(self.query('budg')[0], 'budget.txt')
+        self.assertEqual(set(self.query('budg')), {'notes.txt', 'budget.txt', 'tagged.txt'})
+        self.assertEqual(self.query('quarter budget'), ['notes.txt'])
+        self.assertEqual(self.query(''), [])
+
+    def test_index_follows_renames(self):
+        file = self.add_file('draft.txt', 'body')
+        file.name = 'contract.txt'
+        file.save()
+        self.assertEqual(self.query('contract'), ['contract.txt'])
+        self.assertEqual(self.query('draft'), [])
+
+
+class TagIndexTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('tagger', 'tagger@example.com', 'pw')
+        self.viewer = User.objects.create_user('peer', 'peer@example.com', 'pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def add_file(self, name, tags):
+        return File.objects.create(
+            name=name, file=ContentFile(b'x', name=name), size=1, type='text/plain', owner=self.owner, tags=tags,
+        )
+
+    def names(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return sorted(row['name'] for row in response.data['results'])
+
+    def test_filters_autocomplete_and_facets(self):
+        both = self.add_file('both', ['Finance', 'Q1'])
+        self.add_file('finance', ['finance'])
+        hidden = self.add_file('hidden', ['Finance', 'secret'])
+        for file in (both, File.objects.get(name='finance')):
+            FileShare.objects.create(file=file, shared_with=self.viewer, permission='VIEW')
+
+        self.assertEqual(self.names('/api/files/?tags=finance,q1'), ['both'])
+        self.assertEqual(self.names('/api/files/?tags=FINANCE,q1&tags_mode=any'), ['both', 'finance'])
+        self.assertEqual([t['slug'] for t in self.client.get('/api/tags/?q=s').data], [])
+
+        facets = {row['slug']: row['count'] for row in self.client.get('/api/tags/facets/').data}
+        self.assertEqual(facets, {'finance': 2, 'q1': 1})
+
+        hidden.tags.remove('secret')
+        hidden.save()
+        self.assertFalse(FileTag.objects.filter(file=hidden, tag__slug='secret').exists())
+
+    def test_slugs_fit_after_casefolding(self):
+        long = 'ß' * 150
+        self.assertEqual(tags.normalize([long, ' Q1 ', '', None, 'q1']), {'ss' * 50: 'ß' * 100, 'q1': 'Q1'})
+        self.add_file('long', [long])
+        self.assertEqual(FileTag.objects.get().tag.slug, 'ss' * 50)
+
+    def test_data_migration_links_existing_rows(self):
+        populate_tags = importlib.import_module('api.migrations.0021_tag_index').populate_tags
+        self.add_file('a', ['Finance', 'Q1', 'ß' * 100])
+        self.add_file('b', ['finance', None, ' '])
+        Folder.objects.create(name='f', owner=self.owner, tags=['Q1', 'Archive'])
+
+        def links():
+            return (
+                set(FileTag.objects.values_list('file__name', 'tag__slug')),
+                set(FolderTag.objects.values_list('folder__name', 'tag__slug')),
+            )
+
+        expected = links()
+        self.assertEqual(len(expected[0]), 4)
+        Tag.objects.all().delete()
+        populate_tags(django_apps, None)
+        self.assertEqual(links(), expected)
+        self.assertEqual(Tag.objects.count(), 4)
+
+
+class QueryPlanTests(TestCase):
+    """
+    The hot endpoints must be answered from indexes. Seeds a few thousand
+    rows, refreshes planner statistics and fails if EXPLAIN shows a full
+    table scan on any of the large tables.
+    """
+    LARGE_TABLES = (
+        'api_file', 'api_folder', 'api_fileshare', 'api_foldershare', 'api_fileaccess', 'api_folderaccess',
+        'api_auditlog',
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        users = User.objects.bulk_create([
+            User(username=f'user{i}', email=f'user{i}@example.com') for i in range(40)
+        ])
+        folders = Folder.objects.bulk_create([
+            Folder(name=f'folder {i}', owner=users[i % 40], status='DELETED' if i % 5 == 0 else 'ACTIVE')
+            for i in range(400)
+        ])
+        files = File.objects.bulk_create([
+            File(
+                name=f'file {i}', file=f'uploads/{i}.txt', size=i, type='text/plain', owner=users[i % 40],
+                folder=folders[i % 400], status='DELETED' if i % 5 == 0 else 'ACTIVE',
+            )
+            for i in range(4000)
+        ])
+        FileShare.objects.bulk_create([
+            FileShare(file=files[i], shared_with=users[(i + 1) % 40], permission='EDIT' if i % 2 else 'VIEW')
+            for i in range(0, 4000, 2)
+        ])
+        FolderShare.objects.bulk_create([
+            FolderShare(folder=folders[i], shared_with=users[(i + 3) % 40], permission='VIEW')
+            for i in range(0, 400, 4)
+        ])
+        AuditLog.objects.bulk_create([
+            AuditLog(user=users[i % 40], file=files[i], action='EDIT' if i % 3 else 'RENAME') for i in range(4000)
+        ])
+        # Something shared with the test user for editing, for the IsOwnerOrEditor checks
+        FileShare.objects.bulk_create([FileShare(file=files[2], shared_with=users[1], permission='EDIT')])
+        FolderShare.objects.bulk_create([FolderShare(folder=folders[2], shared_with=users[1], permission='EDIT')])
+        access.rebuild_all()
+        hierarchy.rebuild()
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        cls.user = users[1]
+        cls.file = files[1]
+        cls.folder = folders[1]
+        cls.shared_file = files[2]
+        cls.shared_folder = folders[2]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def full_scans(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('EXPLAIN ' + sql)
+                plan = [row[0] for row in cursor.fetchall()]
+                return [line for line in plan if 'Seq Scan on' in line and line.split('Seq Scan on ')[1].split()[0] in self.LARGE_TABLES]
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            plan = [row[-1] for row in cursor.fetchall()]
+        return [line for line in plan if line.split()[:1] == ['SCAN'] and line.split()[1] in self.LARGE_TABLES and 'INDEX' not in line]
+
+    def assertIndexed(self, method, url, data=None, status=None):
+        with CaptureQueriesContext(connection) as ctx:
+            response = getattr(self.client, method)(url, data, format='json')
+        if status is None:
+            self.assertLess(response.status_code, 500)
+        else:
+            self.assertEqual(response.status_code, status, f'{method.upper()} {url}')
+        for query in ctx.captured_queries:
+            sql = query['sql']
+            if sql.startswith('SELECT'):
+                self.assertEqual(self.full_scans(sql), [], f'{method.upper()} {url}: {sql}')
+
+    def test_hot_endpoints_use_indexes(self):
+        self.assertIndexed('get', '/api/files/')
+        self.assertIndexed('get', '/api/files/?category=mine')
+        self.assertIndexed('get', '/api/files/?category=shared')
+        self.assertIndexed('get', f'/api/files/{self.file.pk}/')
+        self.assertIndexed('get', '/api/folders/')
+        self.assertIndexed('get', f'/api/folders/{self.folder.pk}/')
+        self.assertIndexed('get', '/api/shares/file/')
+        self.assertIndexed('get', '/api/shares/folder/')
+        self.assertIndexed('post', f'/api/files/{self.file.pk}/lock/')
+        self.assertIndexed('post', '/api/shares/file/', {'file': str(self.file.pk), 'shared_with_email': 'user7@example.com'})
+        self.assertIndexed('post', '/api/shares/folder/', {'folder': str(self.folder.pk), 'shared_with_email': 'user7@example.com'}, 201)
+        self.assertIndexed('patch', f'/api/files/{self.shared_file.pk}/', {'name': 'renamed'}, 200)
+        self.assertIndexed('patch', f'/api/folders/{self.shared_folder.pk}/', {'name': 'renamed'}, 200)
+        self.assertIndexed('get', f'/api/audit/?file={self.file.pk}')
+        self.assertIndexed('get', f'/api/audit/?user={self.user.pk}')
+        self.assertIndexed('get', '/api/audit/?action=RENAME')
+
+    def test_save_content_uses_indexes(self):
+        # A saturated pool answers 503 after every read and the job insert, without running a conversion
+        pool = jobs.get_pool()
+        held = 0
+        while pool.slots.acquire(blocking=False):
+            held += 1
+        try:
+            self.assertIndexed('post', f'/api/files/{self.shared_file.pk}/save_content/', {'content': '<p>x</p>'}, 503)
+        finally:
+            for _ in range(held):
+                pool.slots.release()
+
+
+class ShareExpiryTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('lender', 'lender@example.com', 'pw')
+        self.viewer = User.objects.create_user('borrower', 'borrower@example.com', 'pw')
+        self.folder = Folder.objects.create(name='loaned', owner=self.owner)
+        self.file = File.objects.create(
+            name='a.txt', file=ContentFile(b'x', name='a.txt'), size=1, type='text/plain',
+            owner=self.owner, folder=self.folder,
+        )
+        self.now = timezone.now()
+
+    def share(self, model, hours, **kwargs):
+        target = {'file': self.file} if model is FileShare else {'folder': self.folder}
+        return model.objects.create(
+            shared_with=self.viewer, expires_at=self.now + timedelta(hours=hours), **target, **kwargs
+        )
+
+    def test_sweep_reminds_once_and_expires_in_batches(self):
+        soon = self.share(FileShare, 2)
+        self.share(FileShare, 100)
+        for _ in range(3):
+            self.share(FileShare, -1)
+        self.share(FolderShare, -1)
+
+        self.assertEqual(expiry.sweep(self.now, hours=24, batch_size=2), (1, 4))
+        self.assertEqual(expiry.sweep(self.now, hours=24, batch_size=2), (0, 0))
+
+        self.assertEqual(FileShare.objects.count(), 2)
+        self.assertFalse(FolderShare.objects.exists())
+        self.assertFalse(FolderAccess.objects.exclude(user=self.owner).exists())
+        self.assertEqual(FileAccess.objects.filter(user=self.viewer).count(), 2)
+        self.assertEqual(AuditLog.objects.filter(action=AuditLog.Action.EXPIRY).count(), 4)
+        self.assertEqual(Notification.objects.filter(user=self.viewer, type='EXPIRY').count(), 5)
+
+        soon.refresh_from_db()
+        self.assertIsNotNone(soon.reminder_sent_at)
+        client = APIClient()
+        client.force_authenticate(self.owner)
+        response = client.patch(
+            f'/api/shares/file/{soon.pk}/', {'expires_at': (self.now + timedelta(hours=3)).isoformat()}, format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+        soon.refresh_from_db()
+        self.assertIsNone(soon.reminder_sent_at)
+
+
+class BulkShareTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('sharer', 'sharer@example.com', 'pw')
+        self.folder = Folder.objects.create(name='team', owner=self.owner)
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def add_files(self, count):
+        return [
+            str(File.objects.create(
+                name=f'f{i}.txt', file=ContentFile(b'x', name=f'f{i}.txt'), size=1, type='text/plain',
+                owner=self.owner, folder=self.folder,
+            ).pk)
+            for i in range(count)
+        ]
+
+    def add_users(self, prefix, count):
+        return [User.objects.create_user(f'{prefix}{i}', f'{prefix}{i}@example.com', 'pw').email for i in range(count)]
+
+    def post(self, files, emails, folders=()):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(
+                '/api/shares/bulk/', {'files': files, 'folders': list(folders), 'emails': emails, 'permission': 'EDIT'},
+                format='json',
+            )
+        return response, len(ctx.captured_queries)
+
+    def test_query_count_does_not_grow_with_the_batch(self):
+        _, small = self.post(self.add_files(1), self.add_users('a', 2), [self.folder.pk])
+        response, large = self.post(self.add_files(10), self.add_users('b', 5), [self.folder.pk])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['created']), 55)
+        self.assertEqual(small, large)
+
+        recipient = User.objects.get(username='b0')
+        self.assertEqual(Notification.objects.filter(user=recipient).count(), 1)
+        self.assertEqual(FileAccess.objects.filter(user=recipient).count(), 10)  # the folder share does not add file rows
+        self.assertTrue(access.has_access(recipient, self.folder, 'EDIT'))
+
+    def test_reports_rejected_items(self):
+        files = self.add_files(1)
+        stranger = User.objects.create_user('stranger', 'stranger@example.com', 'pw')
+        foreign = File.objects.create(name='x', file=ContentFile(b'x', name='x'), size=1, type='text/plain', owner=stranger)
+        FileShare.objects.create(file_id=files[0], shared_with=stranger)
+
+        response, _ = self.post(files + [str(foreign.pk)], ['stranger@example.com', 'nobody@example.com', 'sharer@example.com'])
+        self.assertEqual(response.status_code, 400)
+        errors = sorted(row['error'] for row in response.data['rejected'])
+        self.assertEqual(errors, [
+            "Already shared with this user.",
+            "Cannot share with the owner or yourself.",
+            "File not found or you do not have permission to share it.",
+            "User with this email does not exist.",
+        ])
+
+
+class FileBatchTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('batcher', 'batcher@example.com', 'pw')
+        self.editor = User.objects.create_user('helper', 'helper@example.com', 'pw')
+        self.root = Folder.objects.create(name='root', owner=self.owner)
+        self.child = Folder.objects.create(name='child', owner=self.owner, parent=self.root)
+        self.target = Folder.objects.create(name='target', owner=self.owner)
+        self.files = [
+            File.objects.create(
+                name=f'f{i}.txt', file=ContentFile(b'xx', name=f'f{i}.txt'), size=2, type='text/plain',
+                owner=self.owner, folder=self.child if i % 2 else self.root, tags=['Old'],
+            )
+            for i in range(6)
+        ]
+        FolderShare.objects.create(folder=self.target, shared_with=self.editor, permission='EDIT')
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def batch(self, **data):
+        response = self.client.post('/api/files/batch/', data, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_subtree_operations_keep_derived_data_in_step(self):
+        data = self.batch(operation='move', folder=str(self.root.pk), target=str(self.target.pk))
+        self.assertEqual(len(data['updated']), 6)
+        # Sharing the target folder does not share the files moved into it
+        self.assertFalse(FileAccess.objects.filter(user=self.editor).exists())
+        self.assertEqual(FolderUsage.objects.get(folder=self.target).total_files, 6)
+        self.assertEqual(FolderUsage.objects.get(folder=self.root).total_files, 0)
+
+        self.batch(operation='add_tags', folder=str(self.target.pk), tags=['Urgent', 'old'])
+        self.batch(operation='remove_tags', ids=[str(self.files[0].pk)], tags=['OLD'])
+        self.files[0].refresh_from_db()
+        self.assertEqual(self.files[0].tags, ['Urgent'])
+        self.assertEqual(FileTag.objects.filter(tag__slug='urgent').count(), 6)
+        self.assertEqual(FileTag.objects.filter(tag__slug='old').count(), 5)
+        self.assertEqual(search.search(self.owner, 'urgent').count(), 6)
+
+        ids = [str(f.pk) for f in self.files[:3]]
+        self.assertEqual(len(self.batch(operation='delete', ids=ids)['updated']), 3)
+        self.assertEqual(FolderUsage.objects.get(folder=self.target).file_count, 3)
+        self.assertEqual(StorageUsage.objects.get(user=self.owner).file_count, 6)
+        data = self.batch(operation='restore', ids=ids + [str(self.files[4].pk)])
+        self.assertEqual(data['skipped'], [self.files[4].pk])
+        self.assertEqual(FolderUsage.objects.get(folder=self.target).file_count, 6)
+        self.assertEqual(usage.check(), ([], []))
+
+    def test_permissions_are_enforced(self):
+        FileShare.objects.create(file=self.files[0], shared_with=self.editor, permission='VIEW')
+        self.client.force_authenticate(self.editor)
+        data = self.batch(operation='archive', ids=[str(self.files[0].pk)])
+        self.assertEqual((data['updated'], data['skipped']), ([], [self.files[0].pk]))
+        # A folder the user cannot see is refused exactly like one that does not exist
+        def refusal(field, pk):
+            data = {'operation': 'move', 'ids': [str(self.files[0].pk)]} if field == 'target' else {'operation': 'archive'}
+            response = self.client.post('/api/files/batch/', {**data, field: str(pk)}, format='json')
+            return response.status_code, str(response.data[field][0]).replace(str(pk), '<id>')
+
+        for field in ('folder', 'target'):
+            self.assertEqual(refusal(field, self.root.pk), refusal(field, uuid.uuid4()))
+            self.assertEqual(refusal(field, self.root.pk)[0], 400)
+
+        FolderShare.objects.create(folder=self.child, shared_with=self.editor, permission='VIEW')
+        response = self.client.post(
+            '/api/files/batch/', {'operation': 'move', 'ids': [str(self.files[0].pk)], 'target': str(self.child.pk)},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 403)
+
+
+class EventStreamTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('listener', 'listener@example.com', 'pw')
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+
+    def notify(self, title):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Notification.objects.create(user=self.user, title=title, message='m')
+
+    def test_requires_a_token(self):
+        self.assertEqual(self.client.get('/api/events/').status_code, 401)
+        self.assertEqual(self.client.get('/api/events/?token=junk').status_code, 401)
+
+    def test_resumes_after_last_event_id_then_pushes_live(self):
+        seen = self.notify('seen')
+        missed = self.notify('missed')
+
+        async def read():
+            response = await AsyncClient().get(
+                '/api/events/', headers={'Authorization': f'Bearer {self.token}', 'Last-Event-ID': str(seen.pk)},
+            )
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            stream = aiter(response.streaming_content)
+            chunks = [await anext(stream), await anext(stream)]
+            live = await sync_to_async(self.notify)('live')
+            chunks.append(await asyncio.wait_for(anext(stream), 5))
+            await stream.aclose()
+            return chunks, live
+
+        chunks, live = async_to_sync(read)()
+        self.assertTrue(chunks[0].startswith(b'retry:'))
+        self.assertIn(f'id: {missed.pk}\n'.encode(), chunks[1])
+        self.assertIn(f'id: {live.pk}\n'.encode(), chunks[2])
+        self.assertIn(b'"title": "live"', chunks[2])
+
+    def test_broker_connection_does_not_block_the_event_loop(self):
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]  # Nothing listens here once closed
+        self.addCleanup(setattr, events, '_broker', None)
+
+        async def read():
+            ticks = 0
+
+            async def tick():
+                nonlocal ticks
+                while True:
+                    await asyncio.sleep(0.05)
+                    ticks += 1
+
+            ticker = asyncio.ensure_future(tick())
+            response = await AsyncClient().get('/api/events/', headers={'Authorization': f'Bearer {self.token}'})
+            stream = aiter(response.streaming_content)
+            await anext(stream)  # Waits for the broker connection attempt
+            await stream.aclose()
+            ticker.cancel()
+            return ticks
+
+        with self.settings(EVENTS_BROKER=f'127.0.0.1:{port}'), self.assertLogs('api.events', 'WARNING'):
+            self.assertGreaterEqual(async_to_sync(read)(), 10)
+        self.assertIsNotNone(events._broker)
+
+
+class NotificationCounterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reader', 'reader@example.com', 'pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def unread(self):
+        response = self.client.get('/api/notifications/unread_count/')
+        self.assertEqual(response.status_code, 200)
+        return response.data['unread']
+
+    def test_counter_follows_inserts_and_mark_read(self):
+        first = Notification.objects.create(user=self.user, title='a', message='m')
+        notifications.created(Notification.objects.bulk_create(
+            [Notification(user=self.user, title=f'b{i}', message='m') for i in range(3)]
+        ))
+        self.assertEqual(self.unread(), 4)
+
+        response = self.client.post('/api/notifications/mark_read/', {'ids': [first.pk, first.pk + 999]}, format='json')
+        self.assertEqual((response.data['marked'], response.data['unread']), (1, 3))
+        self.client.post('/api/notifications/mark_read/', {'ids': [first.pk]}, format='json')
+        self.assertEqual(self.unread(), 3)
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.post('/api/notifications/mark_all_read/')
+        update = next(q['sql'] for q in ctx.captured_queries if q['sql'].startswith('UPDATE "api_notification"'))
+        self.assertIn('"is_read"', update.split('WHERE', 1)[1])
+        self.assertEqual(self.unread(), 0)
+        self.assertEqual(NotificationCounter.objects.get(user=self.user).unread, 0)
+
+    def test_purge_keeps_unread_and_bounds_read(self):
+        rows = Notification.objects.bulk_create(
+            [Notification(user=self.user, title=f'n{i}', message='m', is_read=i < 8) for i in range(10)]
+        )
+        Notification.objects.filter(pk=rows[0].pk).update(created_at=timezone.now() - timedelta(days=400))
+        self.assertEqual(notifications.purge(days=90, keep=5, batch_size=2), (1, 2))
+        remaining = Notification.objects.filter(user=self.user)
+        self.assertEqual(remaining.filter(is_read=False).count(), 2)
+        self.assertEqual(list(remaining.filter(is_read=True).values_list('title', flat=True).order_by('id')),
+                         ['n3', 'n4', 'n5', 'n6', 'n7'])
+
+
+class AuditWriterTests(TestCase):
+    def setUp(self):
+        spool = tempfile.TemporaryDirectory()
+        self.addCleanup(spool.cleanup)
+        settings = override_settings(AUDIT_BUFFER_SIZE=3, AUDIT_FLUSH_INTERVAL=0, AUDIT_SPOOL_DIR=spool.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = User.objects.create_user('auditor', 'auditor@example.com', 'pw')
+
+    def record(self, count, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(count):
+                audit.record(AuditLog.Action.EDIT, user=self.user, details={'n': i}, **kwargs)
+
+    def test_buffers_spools_and_replays_after_a_crash(self):
+        self.record(2)
+        self.assertEqual(AuditLog.objects.count(), 0)
+        # Simulate the worker dying: the buffer is lost, its spool file is not
+        audit._segment[1].close()
+        audit._buffer.clear()
+        audit._segment = None
+        self.assertEqual(audit.replay(min_age=0), 2)
+
+        gone = File.objects.create(name='gone', file=ContentFile(b'x', name='gone'), size=1, type='text/plain', owner=self.user)
+        gone_pk = str(gone.pk)
+        self.record(1, file=gone)
+        gone.delete()
+        with self.assertNumQueries(5):  # file and user existence checks, savepoint, one INSERT, release
+            self.record(2)
+        self.assertEqual(AuditLog.objects.count(), 5)
+        self.assertEqual(AuditLog.objects.filter(details__file=gone_pk).count(), 1)
+
+    def test_archives_old_months(self):
+        old = timezone.now() - timedelta(days=800)
+        AuditLog.objects.bulk_create([AuditLog(action='EDIT', created_at=old) for _ in range(3)] + [AuditLog(action='EDIT')])
+        moved = audit.archive(months=1, batch_size=2)
+        table = audit.archive_table(old.year, old.month)
+        self.assertEqual(moved, {table: 3})
+        self.assertEqual(AuditLog.objects.count(), 1)
+        self.assertIn(table, audit.archive_tables())
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {table}')
+            self.assertEqual(cursor.fetchone()[0], 3)
+
+
+class AuditQueryTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', 'owner@example.com', 'pw')
+        self.other = User.objects.create_user('other', 'other@example.com', 'pw')
+        self.folder = Folder.objects.create(name='Docs', owner=self.owner)
+        self.file = File.objects.create(name='a.txt', file=ContentFile(b'a', name='a.txt'), size=1, type='text/plain', owner=self.owner)
+        start = timezone.now() - timedelta(days=10)
+        AuditLog.objects.bulk_create(
+            [AuditLog(user=self.owner, file=self.file, action='EDIT', details={'n': i}, created_at=start + timedelta(days=i)) for i in range(5)]
+            + [AuditLog(user=self.owner, folder=self.folder, action='RENAME', created_at=start)]
+            + [AuditLog(user=self.other, action='GRANT', created_at=start)]
+        )
+        self.start = start
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def test_filters_and_pages_newest_first(self):
+        response = self.client.get('/api/audit/', {'file': str(self.file.pk), 'page_size': 3})
+        self.assertEqual([row['details']['n'] for row in response.data['results']], [4, 3, 2])
+        self.assertEqual(response.data['results'][0]['username'], 'owner')
+        response = self.client.get(response.data['next'])
+        self.assertEqual([row['details']['n'] for row in response.data['results']], [1, 0])
+        self.assertIsNone(response.data['next'])
+
+        response = self.client.get('/api/audit/', {
+            'action': 'EDIT', 'since': (self.start + timedelta(days=1)).isoformat(), 'until': (self.start + timedelta(days=3)).isoformat(),
+        })
+        self.assertEqual([row['details']['n'] for row in response.data['results']], [2, 1])
+        self.assertEqual(len(self.client.get('/api/audit/', {'folder': str(self.folder.pk)}).data['results']), 1)
+        self.assertEqual(self.client.get('/api/audit/', {'action': 'NOPE'}).status_code, 400)
+
+    def test_visibility(self):
+        self.assertEqual(len(self.client.get('/api/audit/').data['results']), 6)
+        self.client.force_authenticate(self.other)
+        self.assertEqual([row['action'] for row in self.client.get('/api/audit/').data['results']], ['GRANT'])
+        self.assertEqual(self.client.get(f'/api/audit/{AuditLog.objects.filter(file=self.file).first().pk}/').status_code, 404)
+        self.other.is_staff = True
+        self.other.save()
+        self.assertEqual(len(self.client.get('/api/audit/').data['results']), 7)
+
+    def test_streams_csv_and_ndjson(self):
+        response = self.client.get('/api/audit/export/', {'file': str(self.file.pk)})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'id,created_at,action,user,username,file,folder,details')
+        self.assertEqual(len(lines), 6)
+        self.assertIn('"{""n"": 4}"', lines[1])
+
+        response = self.client.get('/api/audit/export/', {'as': 'ndjson', 'action': 'RENAME'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([(row['action'], row['folder']) for row in rows], [('RENAME', str(self.folder.pk))])
+        self.assertEqual(self.client.get('/api/audit/export/', {'as': 'xml'}).status_code, 400)
+
+    def test_export_under_asgi_reads_asynchronously(self):
+        token = str(RefreshToken.for_user(self.owner).access_token)
+
+        async def read():
+            response = await AsyncClient().get('/api/audit/export/?as=ndjson', headers={'Authorization': f'Bearer {token}'})
+            self.assertTrue(response.is_async)
+            return b''.join([chunk async for chunk in response.streaming_content])
+
+        self.assertEqual(len(async_to_sync(read)().splitlines()), 6)
+
+
+@override_settings(PERMISSION_CACHE='default', PERMISSION_CACHE_TIMEOUT=300)
+class RoleResolverTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.owner = User.objects.create_user('owner', 'owner@example.com', 'pw')
+        self.editor = User.objects.create_user('editor', 'editor@example.com', 'pw')
+        self.folder = Folder.objects.create(name='Docs', owner=self.owner)
+        self.file = File.objects.create(name='a.txt', file=ContentFile(b'a', name='a.txt'), size=1, type='text/plain', owner=self.owner, folder=self.folder)
+        self.other = File.objects.create(name='b.txt', file=ContentFile(b'b', name='b.txt'), size=1, type='text/plain', owner=self.owner)
+
+    def share(self, model, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return model.objects.create(shared_with=self.editor, **kwargs)
+
+    def test_memoised_per_request_and_cached_across_requests(self):
+        resolver = roles.Resolver(self.editor)
+        with self.assertNumQueries(2):  # one query per kind, however many objects
+            self.assertEqual(resolver.roles([self.file, self.other, self.folder]), {self.file.pk: None, self.other.pk: None, self.folder.pk: None})
+        with self.assertNumQueries(0):
+            self.assertFalse(resolver.allows(self.file))
+            self.assertTrue(roles.Resolver(self.owner).allows(self.file, 'OWNER'))
+            self.assertIsNone(roles.Resolver(self.editor).role(self.other))
+
+    def test_share_changes_invalidate_precisely(self):
+        self.assertIsNone(roles.Resolver(self.editor).role(self.file))
+        self.assertIsNone(roles.Resolver(self.editor).role(self.other))
+
+        share = self.share(FileShare, file=self.file, permission='EDIT')
+        self.assertEqual(roles.Resolver(self.editor).role(self.file), 'EDIT')
+        with self.assertNumQueries(0):
+            self.assertIsNone(roles.Resolver(self.editor).role(self.other))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            share.permission = 'VIEW'
+            share.save()
+        self.assertEqual(roles.Resolver(self.editor).role(self.file), 'VIEW')
+        with self.captureOnCommitCallbacks(execute=True):
+            share.delete()
+        self.assertIsNone(roles.Resolver(self.editor).role(self.file))
+
+        # A folder share is a grant on the folder only, not on the files in it
+        self.share(FolderShare, folder=self.folder, permission='EDIT')
+        self.assertEqual(roles.Resolver(self.editor).role(self.folder), 'EDIT')
+        self.assertIsNone(roles.Resolver(self.editor).role(self.file))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other.owner = self.editor
+            self.other.save()
+        self.assertIsNone(roles.Resolver(self.owner).role(self.other))
+
+    def test_expiring_grants_are_not_cached_past_expiry(self):
+        self.share(FileShare, file=self.file, permission='EDIT', expires_at=timezone.now() + timedelta(seconds=30))
+        self.assertEqual(roles.Resolver(self.editor).role(self.file), 'EDIT')
+        key = roles._cache_keys(cache, self.editor, [self.file])[('file', self.file.pk)]
+        self.assertLessEqual(cache._expire_info[cache.make_and_validate_key(key)] - timezone.now().timestamp(), 31)
+
+    def test_views_check_through_the_resolver(self):
+        self.share(FolderShare, folder=self.folder, permission='VIEW')
+        self.share(FileShare, file=self.file, permission='VIEW')
+        client = APIClient()
+        client.force_authenticate(self.editor)
+        self.assertEqual(client.patch(f'/api/folders/{self.folder.pk}/', {'name': 'x'}, format='json').status_code, 403)
+        self.assertEqual(client.post(f'/api/files/{self.file.pk}/lock/').status_code, 403)
+        self.assertEqual(client.post('/api/folders/', {'name': 'sub', 'parent': str(self.folder.pk)}, format='json').status_code, 403)
+
+        self.share(FileShare, file=self.file, permission='EDIT')
+        # The role annotated by the detail query answers the EDIT check
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(client.patch(f'/api/files/{self.file.pk}/', {'description': 'd'}, format='json').status_code, 200)
+        self.assertFalse([q for q in ctx.captured_queries if q['sql'].startswith('SELECT "api_fileaccess"')])
+
+
+@override_settings(AUTH_USER_CACHE='default')
+class TokenAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'Old-password-1', avatar='x' * 10000)
+
+    def login(self, password='Old-password-1'):
+        response = self.client.post('/api/auth/login/', {'username': 'alice', 'password': password})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def get(self, tokens, url='/api/notifications/unread_count/'):
+        return self.client.get(url, headers={'Authorization': f"Bearer {tokens['access']}"})
+
+    def test_user_comes_from_cache_without_the_avatar(self):
+        tokens = self.login()
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.get(tokens).status_code, 200)
+        users = [q['sql'] for q in ctx.captured_queries if 'FROM "api_user"' in q['sql']]
+        self.assertEqual(len(users), 1)
+        self.assertNotIn('avatar', users[0])
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.get(tokens).status_code, 200)
+        self.assertFalse([q for q in ctx.captured_queries if 'FROM "api_user"' in q['sql']])
+        self.assertEqual(len(self.get(tokens, '/api/auth/user/').data['avatar']), 10000)
+
+    def test_password_change_and_deactivation_revoke_tokens(self):
+        tokens = self.login()
+        self.assertEqual(self.get(tokens).status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.set_password('New-password-2')
+            self.user.save()
+        self.assertEqual(self.get(tokens).status_code, 401)
+        self.assertEqual(self.client.post('/api/auth/refresh/', {'refresh': tokens['refresh']}).status_code, 401)
+
+        tokens = self.login('New-password-2')
+        self.assertEqual(self.get(tokens).status_code, 200)
+        self.assertEqual(self.client.post('/api/auth/refresh/', {'refresh': tokens['refresh']}).status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.get(tokens).status_code, 401)
+
+    def test_privilege_changes_drop_the_cached_user(self):
+        self.user.is_staff = True
+        self.user.save()
+        tokens = self.login()
+        self.assertEqual(self.get(tokens).status_code, 200)
+        key = authentication._key(self.user.pk, self.user.token_version)
+        staff = authentication.USER_FIELDS.index('is_staff')
+        self.assertTrue(cache.get(key)[staff])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_staff = False
+            self.user.save()
+        self.assertIsNone(cache.get(key))
+        self.assertEqual(self.get(tokens).status_code, 200)
+        self.assertFalse(cache.get(key)[staff])
+
+    @override_settings(AUTH_USER_CACHE=None)
+    def test_without_a_shared_cache_every_request_reads_the_row(self):
+        tokens = self.login()
+        for _ in range(2):
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(self.get(tokens).status_code, 200)
+            self.assertEqual(len([q for q in ctx.captured_queries if 'FROM "api_user"' in q['sql']]), 1)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get(tokens).status_code, 401)
+
+
+@override_settings(FILE_LOCK_TTL=60)
+class FileLockTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', 'owner@example.com', 'pw')
+        self.editor = User.objects.create_user('editor', 'editor@example.com', 'pw')
+        self.file = File.objects.create(name='a.docx', file=ContentFile(b'a', name='a.docx'), size=1, type='text/plain', owner=self.owner)
+        FileShare.objects.create(file=self.file, shared_with=self.editor, permission='EDIT')
+        self.url = f'/api/files/{self.file.pk}/'
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def test_acquire_is_one_conditional_update(self):
+        owner, editor = self.client_for(self.owner), self.client_for(self.editor)
+        with CaptureQueriesContext(connection) as ctx:
+            response = owner.post(self.url + 'lock/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['ttl'], 60)
+        self.assertEqual([q['sql'].split()[0] for q in ctx.captured_queries], ['UPDATE'])
+
+        response = editor.post(self.url + 'lock/')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['error'], 'File is locked by owner')
+        self.assertEqual(editor.post(self.url + 'unlock/').status_code, 403)
+        self.assertEqual(editor.post(self.url + 'heartbeat/').status_code, 409)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(owner.post(self.url + 'heartbeat/').status_code, 200)
+        self.assertEqual(owner.post(self.url + 'unlock/').status_code, 200)
+        self.assertEqual(owner.post(self.url + 'unlock/').status_code, 409)
+        self.assertEqual(editor.post(self.url + 'lock/').status_code, 200)
+        self.assertEqual(self.client_for(User.objects.create_user('x', 'x@example.com', 'pw')).post(self.url + 'lock/').status_code, 404)
+        viewer = User.objects.create_user('viewer', 'viewer@example.com', 'pw')
+        FileShare.objects.create(file=self.file, shared_with=viewer, permission='VIEW')
+        self.assertEqual(self.client_for(viewer).post(self.url + 'unlock/').status_code, 403)
+        self.assertEqual(owner.post('/api/files/not-a-uuid/lock/').status_code, 404)
+
+    def test_lapsed_leases_are_reclaimed(self):
+        self.assertEqual(self.client_for(self.owner).post(self.url + 'lock/').status_code, 200)
+        File.objects.filter(pk=self.file.pk).update(lock_expires_at=timezone.now() - timedelta(seconds=1))
+        editor = self.client_for(self.editor)
+        self.assertIsNone(editor.get(self.url).data['locked_by'])
+        self.assertEqual(self.client_for(self.owner).post(self.url + 'heartbeat/').status_code, 409)
+
+        self.assertEqual(editor.post(self.url + 'unlock/').status_code, 409)
+        response = editor.post(self.url + 'lock/')
+        self.assertEqual(response.status_code, 200)
+        self.file.refresh_from_db()
+        self.assertEqual(self.file.locked_by, self.editor)
+        self.assertEqual(editor.get(self.url).data['locked_by'], self.editor.pk)
+        response = self.client_for(self.owner).post(self.url + 'save_content/', {'content': '<p>x</p>'}, format='json')
+        self.assertEqual(response.status_code, 409)
+
+
+class OptimisticConcurrencyTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', 'owner@example.com', 'pw')
+        self.file = File.objects.create(name='a.docx', file=ContentFile(b'a', name='a.docx'), size=1, type='text/plain', owner=self.owner)
+        self.folder = Folder.objects.create(name='Docs', owner=self.owner)
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        self.url = f'/api/files/{self.file.pk}/'
+
+    def test_if_match_guards_updates(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['ETag'], '"v1"')
+        response = self.client.patch(self.url, {'name': 'b.docx'}, format='json', HTTP_IF_MATCH='"v1"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['version'], response['ETag']), (2, '"v2"'))
+
+        # A second writer still holding v1 is refused instead of overwriting
+        response = self.client.patch(self.url, {'name': 'c.docx'}, format='json', HTTP_IF_MATCH='"v1"')
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual((response.data['version'], response['ETag']), (2, '"v2"'))
+        self.file.refresh_from_db()
+        self.assertEqual((self.file.name, self.file.version), ('b.docx', 2))
+
+        # Without If-Match (or with *) updates apply as before, still bumping the version
+        self.assertEqual(self.client.patch(self.url, {'name': 'd.docx'}, format='json').data['version'], 3)
+        self.assertEqual(self.client.patch(self.url, {'name': 'e.docx'}, format='json', HTTP_IF_MATCH='*').status_code, 200)
+
+        folder_url = f'/api/folders/{self.folder.pk}/'
+        self.assertEqual(self.client.patch(folder_url, {'name': 'Old'}, format='json', HTTP_IF_MATCH='"v7"').status_code, 412)
+        response = self.client.patch(folder_url, {'name': 'New'}, format='json', HTTP_IF_MATCH='"v1"')
+        self.assertEqual((response.status_code, response['ETag']), (200, '"v2"'))
+
+    def test_conditional_save_is_one_guarded_update(self):
+        first, second = File.objects.get(pk=self.file.pk), File.objects.get(pk=self.file.pk)
+        first.expected_version = second.expected_version = 1
+        first.name = 'first.docx'
+        first.save()
+        second.name = 'second.docx'
+        with self.assertRaises(concurrency.VersionConflict):
+            second.save()
+        self.assertIsNone(second.expected_version)
+        self.file.refresh_from_db()
+        self.assertEqual((self.file.name, self.file.version), ('first.docx', 2))
+
+    def test_save_content_and_batch(self):
+        response = self.client.post(self.url + 'save_content/', {'content': '<p>x</p>'}, format='json', HTTP_IF_MATCH='"v9"')
+        self.assertEqual(response.status_code, 412)
+        self.assertFalse(ConversionJob.objects.exists())
+
+        response = self.client.post('/api/files/batch/', {'operation': 'add_tags', 'ids': [str(self.file.pk)], 'tags': ['x']}, format='json')
+        self.assertEqual(response.data['updated'], [self.file.pk])
+        self.client.post('/api/files/batch/', {'operation': 'move', 'ids': [str(self.file.pk)], 'target': str(self.folder.pk)}, format='json')
+        self.file.refresh_from_db()
+        self.assertEqual(self.file.version, 3)
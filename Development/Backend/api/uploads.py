@@ -0,0 +1,167 @@
+"""
+Resumable chunked uploads.
+
+Each part is streamed from the request body straight into storage, so a
+worker never holds more than one read buffer of it. Completion concatenates
+the stored parts through a file-like reader that storage consumes chunk by
+chunk, producing an ordinary File row.
+"""
+import io
+
+from django.core.files import File as DjangoFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from . import render, usage
+from .models import File, UploadPart, UploadSession
+
+PART_PREFIX = 'upload_parts'
+READ_CHUNK = 64 * 1024
+
+
+class UploadError(Exception):
+    pass
+
+
+class LimitedReader:
+    """Read at most ``limit`` bytes from ``stream``, failing if it holds more."""
+
+    def __init__(self, stream, limit):
+        self.stream = stream
+        self.limit = limit
+        self.read_bytes = 0
+
+    def read(self, size=-1):
+        remaining = self.limit - self.read_bytes
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        data = self.stream.read(size) if size else b''
+        self.read_bytes += len(data)
+        if not data and self.stream.read(1):
+            raise UploadError("Part is larger than expected.")
+        return data
+
+
+class PartsReader:
+    """File-like view over a session's stored parts, read sequentially."""
+
+    def __init__(self, storage_names, size):
+        self.names = list(storage_names)
+        self.size = size
+        self.current = None
+
+    def read(self, size=-1):
+        chunks = []
+        want = size if size and size > 0 else None
+        while self.names or self.current:
+            if self.current is None:
+                self.current = default_storage.open(self.names.pop(0), 'rb')
+            data = self.current.read(want if want is not None else -1)
+            if not data:
+                self.current.close()
+                self.current = None
+                continue
+            chunks.append(data)
+            if want is not None:
+                want -= len(data)
+                if want <= 0:
+                    break
+        return b''.join(chunks)
+
+    def close(self):
+        if self.current:
+            self.current.close()
+            self.current = None
+
+
+def part_name(session, number):
+    return f'{PART_PREFIX}/{session.pk}/{number:05d}'
+
+
+def store_part(session, number, stream):
+    if session.status != UploadSession.SessionStatus.ACTIVE:
+        raise UploadError("Upload session is not active.")
+    if not 1 <= number <= session.part_count:
+        raise UploadError(f"Part number must be between 1 and {session.part_count}.")
+    expected = session.expected_part_size(number)
+    if stream is None:
+        # DRF leaves request.stream as None when the body is empty
+        if expected:
+            raise UploadError(f"Part {number} has no body.")
+        stream = io.BytesIO()
+    reader = LimitedReader(stream, expected)
+    name = default_storage.save(part_name(session, number), DjangoFile(reader))
+    if reader.read_bytes != expected:
+        default_storage.delete(name)
+        raise UploadError(f"Part {number} must be exactly {expected} bytes, got {reader.read_bytes}.")
+
+    with transaction.atomic():
+        previous = UploadPart.objects.select_for_update().filter(session=session, number=number).first()
+        UploadPart.objects.update_or_create(
+            session=session, number=number, defaults={'size': reader.read_bytes, 'storage_name': name}
+        )
+    # A retried part replaces the earlier copy
+    if previous and previous.storage_name != name:
+        default_storage.delete(previous.storage_name)
+    return reader.read_bytes
+
+
+def missing_parts(session):
+    received = set(session.parts.values_list('number', flat=True))
+    return [n for n in range(1, session.part_count + 1) if n not in received]
+
+
+def complete(session):
+    """Assemble the parts into a new File row and discard them."""
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(pk=session.pk)
+        if session.status == UploadSession.SessionStatus.COMPLETED:
+            if session.file is None:
+                raise UploadError("The file this upload created has since been deleted.")
+            return session.file
+        if session.status != UploadSession.SessionStatus.ACTIVE:
+            raise UploadError("Upload session is not active.")
+        if missing_parts(session):
+            raise UploadError("Upload is incomplete.")
+        # Other uploads may have used up the quota since this one started
+        usage.check_quota(session.owner, session.total_size)
+
+        names = list(session.parts.order_by('number').values_list('storage_name', flat=True))
+        reader = PartsReader(names, session.total_size)
+        file = File(
+            name=session.name,
+            size=session.total_size,
+            type=session.content_type,
+            folder=session.folder,
+            owner=session.owner,
+            description=session.description,
+            tags=session.tags,
+            metadata=session.metadata,
+        )
+        try:
+            file.file.save(session.name, DjangoFile(reader, name=session.name), save=False)
+        finally:
+            reader.close()
+        file.save()
+
+        session.status = UploadSession.SessionStatus.COMPLETED
+        session.file = file
+        session.save(update_fields=['status', 'file', 'updated_at'])
+        session.parts.all().delete()
+
+    transaction.on_commit(lambda: discard_parts(names))
+    transaction.on_commit(lambda: render.prewarm(file))
+    return file
+
+
+def abort(session):
+    names = list(session.parts.values_list('storage_name', flat=True))
+    session.parts.all().delete()
+    session.status = UploadSession.SessionStatus.ABORTED
+    session.save(update_fields=['status', 'updated_at'])
+    discard_parts(names)
+
+
+def discard_parts(names):
+    for name in names:
+        default_storage.delete(name)
@@ -3,7 +3,9 @@ from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from .views import (
     RegisterView, UserView, FolderViewSet, FileViewSet, 
-    FolderShareViewSet, FileShareViewSet, NotificationViewSet, VerifyOTPView
+    FolderShareViewSet, FileShareViewSet, NotificationViewSet, VerifyOTPView,
+    UploadSessionViewSet, ConversionJobViewSet, RenderAssetView, StorageUsageView,
+    SearchView, TagViewSet, BulkShareView, AuditLogViewSet, event_stream
 )
 
 router = DefaultRouter()
@@ -12,6 +14,10 @@ router.register(r'files', FileViewSet, basename='file')
 router.register(r'shares/folder', FolderShareViewSet, basename='folder-share')
 router.register(r'shares/file', FileShareViewSet, basename='file-share')
 router.register(r'notifications', NotificationViewSet, basename='notification')
+router.register(r'uploads', UploadSessionViewSet, basename='upload')
+router.register(r'jobs', ConversionJobViewSet, basename='job')
+router.register(r'tags', TagViewSet, basename='tag')
+router.register(r'audit', AuditLogViewSet, basename='audit')
 
 urlpatterns = [
     path('auth/register/', RegisterView.as_view(), name='register'),
@@ -19,5 +25,10 @@ urlpatterns = [
     path('auth/login/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('auth/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('auth/user/', UserView.as_view(), name='user_detail'),
+    path('usage/', StorageUsageView.as_view(), name='storage_usage'),
+    path('search/', SearchView.as_view(), name='search'),
+    path('shares/bulk/', BulkShareView.as_view(), name='bulk-share'),
+    path('events/', event_stream, name='events'),
+    path('render-assets/<str:token>/<str:name>', RenderAssetView.as_view(), name='render-asset'),
     path('', include(router.urls)),
 ]
@@ -0,0 +1,204 @@
+"""
+Storage accounting.
+
+StorageUsage keeps each user's stored bytes and file count. Files in the
+trash still occupy storage, so they count until they are purged; this is the
+counter the upload quota is checked against. FolderUsage keeps the ACTIVE
+bytes and files directly in each folder and in its whole subtree; subtree
+totals are adjusted along the FolderClosure ancestors of the folder.
+
+All adjustments are single relative UPDATEs, so they commit or roll back
+with the change that caused them (called from api.signals). Rebuild or check
+with `manage.py rebuild_usage`.
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+
+from .models import File, Folder, FolderClosure, FolderUsage, StorageUsage
+
+ACTIVE = File.FileStatus.ACTIVE
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+def adjust_user(user_id, size, count):
+    if not size and not count:
+        return
+    fields = {'used_bytes': F('used_bytes') + size, 'file_count': F('file_count') + count}
+    if StorageUsage.objects.filter(user_id=user_id).update(**fields) or size < 0 or count < 0:
+        # No row to decrement: the user is being deleted along with their files
+        return
+    try:
+        with transaction.atomic():
+            StorageUsage.objects.create(user_id=user_id, used_bytes=size, file_count=count)
+    except IntegrityError:
+        StorageUsage.objects.filter(user_id=user_id).update(**fields)
+
+
+def adjust_folder(folder_id, size, count):
+    if folder_id is None or (not size and not count):
+        return
+    FolderUsage.objects.filter(folder_id=folder_id).update(
+        bytes=F('bytes') + size, file_count=F('file_count') + count
+    )
+    _adjust_totals(FolderClosure.objects.filter(descendant_id=folder_id), size, count)
+
+
+def _adjust_totals(links, size, count):
+    FolderUsage.objects.filter(folder_id__in=links.values('ancestor_id')).update(
+        total_bytes=F('total_bytes') + size, total_files=F('total_files') + count
+    )
+
+
+def file_changed(old, new):
+    """
+    Apply the difference between two (owner_id, folder_id, size, status)
+    states of one file. ``old`` is None for a new file, ``new`` is None once
+    it has been purged.
+    """
+    if old and new and old[0] == new[0]:
+        adjust_user(new[0], new[2] - old[2], 0)
+    else:
+        if old:
+            adjust_user(old[0], -old[2], -1)
+        if new:
+            adjust_user(new[0], new[2], 1)
+
+    old_counted = bool(old) and old[3] == ACTIVE
+    new_counted = bool(new) and new[3] == ACTIVE
+    if old_counted and new_counted and old[1] == new[1]:
+        adjust_folder(new[1], new[2] - old[2], 0)
+    else:
+        if old_counted:
+            adjust_folder(old[1], -old[2], -1)
+        if new_counted:
+            adjust_folder(new[1], new[2], 1)
+
+
+def files_changed(changes):
+    """
+    file_changed for many files at once, e.g. after a queryset.update():
+    ``changes`` is an iterable of (old, new) states. Issues one UPDATE per
+    affected user and folder rather than per file.
+    """
+    users, folders = defaultdict(lambda: [0, 0]), defaultdict(lambda: [0, 0])
+    for old, new in changes:
+        for state, sign in ((old, -1), (new, 1)):
+            if not state:
+                continue
+            users[state[0]][0] += sign * state[2]
+            users[state[0]][1] += sign
+            if state[3] == ACTIVE:
+                folders[state[1]][0] += sign * state[2]
+                folders[state[1]][1] += sign
+    for user_id, (size, count) in users.items():
+        adjust_user(user_id, size, count)
+    for folder_id, (size, count) in folders.items():
+        adjust_folder(folder_id, size, count)
+
+
+def folder_created(folder):
+    FolderUsage.objects.get_or_create(folder_id=folder.pk)
+
+
+def folder_detaching(folder):
+    """Remove ``folder``'s subtree totals from its current ancestors (before a move or delete)."""
+    usage = FolderUsage.objects.filter(folder_id=folder.pk).values_list('total_bytes', 'total_files').first()
+    if usage and any(usage):
+        links = FolderClosure.objects.filter(descendant_id=folder.pk, depth__gt=0)
+        _adjust_totals(links, -usage[0], -usage[1])
+
+
+def folder_attached(folder):
+    """Add ``folder``'s subtree totals to its ancestors (after a move)."""
+    usage = FolderUsage.objects.filter(folder_id=folder.pk).values_list('total_bytes', 'total_files').first()
+    if usage and any(usage):
+        links = FolderClosure.objects.filter(descendant_id=folder.pk, depth__gt=0)
+        _adjust_totals(links, usage[0], usage[1])
+
+
+def check_quota(user, incoming):
+    """
+    Raise QuotaExceeded if storing ``incoming`` more bytes would exceed the
+    user's quota. Called inside the transaction that stores the file, it
+    holds the user's StorageUsage row (creating it if needed) until that
+    commits, so concurrent uploads are checked one after another against
+    the bytes the earlier ones added.
+    """
+    with transaction.atomic():
+        locked = StorageUsage.objects.select_for_update().filter(user=user).values_list('used_bytes', 'quota_bytes')
+        row = locked.first()
+        if row is None:
+            try:
+                with transaction.atomic():
+                    StorageUsage.objects.create(user=user)
+            except IntegrityError:
+                pass  # Created by a concurrent upload, which has committed by now
+            row = locked.get()
+    used, quota = row
+    if quota is None:
+        quota = getattr(settings, 'STORAGE_QUOTA', None)
+    if quota is not None and used + incoming > quota:
+        raise QuotaExceeded(f"Storage quota exceeded ({used + incoming} of {quota} bytes).")
+
+
+def expected():
+    """Compute the counters from the File rows. Returns (users, folders) dicts of tuples."""
+    users = {
+        row['owner_id']: (row['b'] or 0, row['n'])
+        for row in File.objects.values('owner_id').annotate(b=Sum('size'), n=Count('pk'))
+    }
+    direct = {
+        row['folder_id']: (row['b'] or 0, row['n'])
+        for row in File.objects.filter(status=ACTIVE, folder__isnull=False)
+        .values('folder_id').annotate(b=Sum('size'), n=Count('pk'))
+    }
+    totals = defaultdict(lambda: (0, 0))
+    for ancestor_id, descendant_id in FolderClosure.objects.values_list('ancestor_id', 'descendant_id').iterator():
+        b, n = direct.get(descendant_id, (0, 0))
+        totals[ancestor_id] = (totals[ancestor_id][0] + b, totals[ancestor_id][1] + n)
+    folders = {
+        pk: direct.get(pk, (0, 0)) + totals[pk]
+        for pk in Folder.objects.values_list('pk', flat=True).iterator()
+    }
+    return users, folders
+
+
+def check():
+    """Return (users, folders) whose stored counters differ from the computed ones."""
+    users, folders = expected()
+    stored_users = dict(
+        (pk, (b, n)) for pk, b, n in StorageUsage.objects.values_list('user_id', 'used_bytes', 'file_count')
+    )
+    stored_folders = dict(
+        (row[0], row[1:]) for row in FolderUsage.objects.values_list(
+            'folder_id', 'bytes', 'file_count', 'total_bytes', 'total_files'
+        )
+    )
+    bad_users = [pk for pk in set(users) | set(stored_users) if users.get(pk, (0, 0)) != stored_users.get(pk, (0, 0))]
+    bad_folders = [pk for pk in folders if folders[pk] != stored_folders.get(pk)]
+    return bad_users, bad_folders
+
+
+def rebuild():
+    users, folders = expected()
+    with transaction.atomic():
+        quotas = dict(StorageUsage.objects.exclude(quota_bytes=None).values_list('user_id', 'quota_bytes'))
+        StorageUsage.objects.all().delete()
+        FolderUsage.objects.all().delete()
+        StorageUsage.objects.bulk_create([
+            StorageUsage(user_id=pk, used_bytes=b, file_count=n, quota_bytes=quotas.get(pk))
+            for pk, (b, n) in users.items()
+        ] + [
+            StorageUsage(user_id=pk, quota_bytes=quota) for pk, quota in quotas.items() if pk not in users
+        ], batch_size=1000)
+        FolderUsage.objects.bulk_create([
+            FolderUsage(folder_id=pk, bytes=b, file_count=n, total_bytes=tb, total_files=tn)
+            for pk, (b, n, tb, tn) in folders.items()
+        ], batch_size=1000)
+    return len(users), len(folders)
@@ -1,56 +1,97 @@
-from rest_framework import viewsets, permissions, status, generics
+from rest_framework import viewsets, permissions, status, generics, mixins
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from django.db.models import Q
+from rest_framework.exceptions import APIException, AuthenticationFailed, NotFound, PermissionDenied
+from django.db.models import Q, Prefetch, F
 from django.utils import timezone
 from django.contrib.auth import get_user_model
+from django.conf import settings
 from .models import Folder, File, FolderShare, FileShare, Notification
 
 User = get_user_model()
 from .serializers import (
     UserSerializer, RegisterSerializer, FolderSerializer, FileSerializer,
-    FolderShareSerializer, FileShareSerializer, NotificationSerializer
+    FolderShareSerializer, FileShareSerializer, NotificationSerializer, UploadSessionSerializer,
+    ConversionJobSerializer, BulkShareSerializer, FileBatchSerializer, AuditLogSerializer,
+    AuditLogQuerySerializer, LargestQuerySerializer
 )
-from .models import Folder, File, FolderShare, FileShare, Notification, OTPVerification, AuditLog
+from .models import Folder, File, FolderShare, FileShare, Notification, OTPVerification, AuditLog, AccessLevel, UploadSession, ConversionJob, FolderUsage, StorageUsage
+from . import access, audit, authentication, batch, concurrency, conversion, downloads, events, jobs, locks, notifications, render, roles, search, sharing, tags, uploads, usage
+from docx import Document
+import re
+import secrets
+import uuid
 from .utils import generate_otp, send_otp_email
+from .pagination import KeysetPagination, LargestFirstPagination, RecentlyUpdatedPagination
 from datetime import timedelta
-import io
-from docx import Document
-from htmldocx import HtmlToDocx
-from django.core.files.base import ContentFile
+from django.core import signing
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.http import FileResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from rest_framework.views import APIView
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from asgiref.sync import sync_to_async
+import asyncio
+import json
+import mimetypes
+import os
+
+RENDER_ASSET_RE = re.compile(r'^image\d+\.[A-Za-z0-9]+$')
+
+class InsufficientStorage(APIException):
+    status_code = status.HTTP_507_INSUFFICIENT_STORAGE
+    default_detail = 'Storage quota exceeded.'
+    default_code = 'insufficient_storage'
 
 class IsOwnerOrEditor(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
-        if obj.owner == request.user:
-            return True
-        
-        # Check if user has EDIT permission via share
-        if isinstance(obj, File):
-            return FileShare.objects.filter(
-                file=obj, 
-                shared_with=request.user, 
-                permission='EDIT',
-                expires_at__gt=timezone.now()
-            ).exists() or FileShare.objects.filter(
-                file=obj, 
-                shared_with=request.user, 
-                permission='EDIT',
-                expires_at__isnull=True
-            ).exists()
-        
-        if isinstance(obj, Folder):
-            return FolderShare.objects.filter(
-                folder=obj, 
-                shared_with=request.user, 
-                permission='EDIT',
-                expires_at__gt=timezone.now()
-            ).exists() or FolderShare.objects.filter(
-                folder=obj, 
-                shared_with=request.user, 
-                permission='EDIT',
-                expires_at__isnull=True
-            ).exists()
-        return False
+        # Owner, or EDIT via a live share (see api.roles)
+        return roles.for_request(request).allows(obj, AccessLevel.EDIT)
+
+class AnnotatedRoleMixin:
+    """
+    For viewsets whose querysets go through access.with_role: the fetched
+    object already carries the user's role, so object permission checks
+    are answered without another query.
+    """
+    def check_object_permissions(self, request, obj):
+        if hasattr(obj, 'access_role'):
+            roles.for_request(request).remember(obj, obj.access_role)
+        super().check_object_permissions(request, obj)
+
+class VersionedMixin:
+    """
+    Optimistic concurrency for PUT/PATCH (api.concurrency). Responses carry
+    the object's version as ETag; perform_update() calls concurrency.expect(),
+    and an If-Match naming an older version is answered 412 with the current
+    one instead of overwriting the newer change.
+    """
+    def retrieve(self, request, *args, **kwargs):
+        return with_version_etag(super().retrieve(request, *args, **kwargs))
+
+    def update(self, request, *args, **kwargs):
+        try:
+            response = super().update(request, *args, **kwargs)
+        except concurrency.VersionConflict as e:
+            return version_conflict(e)
+        return with_version_etag(response)
+
+def with_version_etag(response):
+    if response.status_code == status.HTTP_200_OK and 'version' in response.data:
+        response['ETag'] = concurrency.etag(response.data['version'])
+    return response
+
+def version_conflict(error):
+    response = Response({"error": str(error), "version": error.current}, status=status.HTTP_412_PRECONDITION_FAILED)
+    if error.current is not None:
+        response['ETag'] = concurrency.etag(error.current)
+    return response
+
+def require_edit(request, obj, message):
+    if obj is not None and not roles.for_request(request).allows(obj, AccessLevel.EDIT):
+        raise PermissionDenied(message)
 
 class IsViewer(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
@@ -113,90 +154,382 @@ class UserView(generics.RetrieveUpdateAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_object(self):
-        return self.request.user
+        # request.user carries only the columns authentication needs (api.authentication)
+        return User.objects.get(pk=self.request.user.pk)
 
-class FolderViewSet(viewsets.ModelViewSet):
+class StorageUsageView(APIView):
+    """The user's stored bytes against their quota, plus their top-level folders by size."""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        row = StorageUsage.objects.filter(user=request.user).values('used_bytes', 'file_count', 'quota_bytes').first()
+        row = row or {'used_bytes': 0, 'file_count': 0, 'quota_bytes': None}
+        if row['quota_bytes'] is None:
+            row['quota_bytes'] = getattr(settings, 'STORAGE_QUOTA', None)
+        folders = FolderUsage.objects.filter(
+            folder__owner=request.user, folder__parent__isnull=True, folder__status='ACTIVE'
+        ).order_by('-total_bytes').values('folder_id', 'folder__name', 'total_bytes', 'total_files')[:100]
+        row['folders'] = [
+            {'id': f['folder_id'], 'name': f['folder__name'], 'total_bytes': f['total_bytes'], 'total_files': f['total_files']}
+            for f in folders
+        ]
+        return Response(row)
+
+def filter_by_tags(queryset, request):
+    # ?tags=a,b requires every tag; add &tags_mode=any to match at least one
+    slugs = tags.parse_param(request.query_params.get('tags'))
+    return tags.filter_queryset(queryset, slugs, match_all=request.query_params.get('tags_mode') != 'any')
+
+def query_limit(request, default, maximum):
+    try:
+        return min(max(int(request.query_params.get('limit', default)), 1), maximum)
+    except ValueError:
+        return default
+
+class SearchView(APIView):
+    """
+    GET /api/search/?q=<words>[&limit=n] - ranked full-text search over the
+    files the user can see. Every word must match, each as a prefix.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        limit = query_limit(request, 20, 100)
+        matches = with_file_details(search.search(request.user, request.query_params.get('q', '')), request.user)[:limit]
+        results = FileSerializer(matches, many=True, context={'request': request}).data
+        for row, match in zip(results, matches):
+            row['rank'] = match.rank
+        return Response({"results": results})
+
+class TagViewSet(viewsets.GenericViewSet):
+    """
+    GET /api/tags/?q=<prefix> - autocomplete over tags on things the user can access.
+    GET /api/tags/facets/?scope=files|folders[&tags=a,b] - tag counts over accessible items.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def list(self, request):
+        found = tags.autocomplete(request.user, request.query_params.get('q', ''), query_limit(request, 10, 50))
+        return Response([{'name': tag.name, 'slug': tag.slug} for tag in found])
+
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        scope = request.query_params.get('scope', 'files')
+        if scope not in ('files', 'folders'):
+            return Response({"error": "scope must be files or folders"}, status=status.HTTP_400_BAD_REQUEST)
+        counts = tags.facets(
+            request.user, scope,
+            slugs=tags.parse_param(request.query_params.get('tags')),
+            match_all=request.query_params.get('tags_mode') != 'any',
+            limit=query_limit(request, 50, 200),
+        )
+        return Response([{'name': row['tag__name'], 'slug': row['tag__slug'], 'count': row['count']} for row in counts])
+
+def with_file_details(queryset, user):
+    # Fetch owner, lock holder, shares and role up front so serializing is a fixed number of queries
+    return access.with_role(queryset, user).select_related('owner', 'locked_by').prefetch_related(
+        Prefetch('shares', queryset=FileShare.objects.select_related('shared_with'))
+    )
+
+def clean_block_changes(changes):
+    """
+    Validate a save_content patch. Inserted blocks without an id get a new
+    one; returns (changes, {index: assigned_id}). Inserts may not share an
+    id; one that is already in the document fails the job (PatchError).
+    """
+    if not isinstance(changes, list) or not changes:
+        raise ValueError("changes must be a non-empty list")
+    cleaned, assigned, inserted = [], {}, set()
+    for index, change in enumerate(changes):
+        op = change.get('op') if isinstance(change, dict) else None
+        if op not in ('replace', 'insert', 'delete'):
+            raise ValueError(f"changes[{index}]: op must be replace, insert or delete")
+        item = {'op': op}
+        if op in ('replace', 'delete') or change.get('id'):
+            if not isinstance(change.get('id'), str) or not re.fullmatch(r'[0-7][0-9A-Fa-f]{7}', change['id']):
+                raise ValueError(f"changes[{index}]: id must be an 8-digit block id")
+            item['id'] = change['id'].upper()
+        if op == 'insert':
+            after = change.get('after')
+            if after is not None and not (isinstance(after, str) and re.fullmatch(r'[0-7][0-9A-Fa-f]{7}', after)):
+                raise ValueError(f"changes[{index}]: after must be a block id or null")
+            item['after'] = after.upper() if after else None
+            if 'id' not in item:
+                item['id'] = assigned[index] = conversion.unused_id(inserted, secrets.token_hex(), index)
+            elif item['id'] in inserted:
+                raise ValueError(f"changes[{index}]: id {item['id']} is inserted twice")
+            inserted.add(item['id'])
+        if op != 'delete':
+            html = change.get('html')
+            if not isinstance(html, str):
+                raise ValueError(f"changes[{index}]: html is required")
+            if '<img' in html.lower():
+                raise ValueError(f"changes[{index}]: images cannot be patched in; use a full save")
+            item['html'] = html
+        cleaned.append(item)
+    return cleaned, assigned
+
+class FolderViewSet(VersionedMixin, AnnotatedRoleMixin, viewsets.ModelViewSet):
     serializer_class = FolderSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = RecentlyUpdatedPagination
 
     def get_queryset(self):
         user = self.request.user
         # Return folders owned by user OR shared with user (and not expired)
-        return Folder.objects.filter(status='ACTIVE').filter(
-            Q(owner=user) | 
-            Q(shares__shared_with=user, shares__expires_at__gt=timezone.now()) |
-            Q(shares__shared_with=user, shares__expires_at__isnull=True)
-        ).distinct()
+        queryset = Folder.objects.filter(status='ACTIVE', pk__in=access.folder_ids(user))
+        queryset = filter_by_tags(queryset, self.request)
+        # Fetch owner, shares and role up front so serializing is a fixed number of queries
+        return access.with_role(queryset, user).select_related('owner').prefetch_related(
+            Prefetch('shares', queryset=FolderShare.objects.select_related('shared_with'))
+        )
+
+    def get_permissions(self):
+        if self.action in ['update', 'partial_update', 'destroy']:
+            return [permissions.IsAuthenticated(), IsOwnerOrEditor()]
+        return [permissions.IsAuthenticated()]
 
     def perform_create(self, serializer):
+        require_edit(self.request, serializer.validated_data.get('parent'), "You do not have permission to create folders here.")
         serializer.save(owner=self.request.user)
 
-class FileViewSet(viewsets.ModelViewSet):
+    def perform_update(self, serializer):
+        parent = serializer.validated_data.get('parent')
+        if parent is not None and parent.pk != serializer.instance.parent_id:
+            require_edit(self.request, parent, "You do not have permission to move folders here.")
+        concurrency.expect(self.request, serializer.instance)
+        serializer.save()
+
+    @action(detail=True, methods=['get'])
+    def subtree(self, request, pk=None):
+        """Every accessible folder beneath this one, at any depth."""
+        folder = self.get_object()
+        queryset = self.get_queryset().filter(
+            ancestor_links__ancestor=folder, ancestor_links__depth__gt=0
+        ).annotate(depth=F('ancestor_links__depth'))
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        for row, folder_row in zip(serializer.data, page):
+            row['depth'] = folder_row.depth
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=['get'])
+    def breadcrumbs(self, request, pk=None):
+        """Path from the root down to this folder, skipping folders the user cannot see."""
+        folder = self.get_object()
+        path = Folder.objects.filter(
+            descendant_links__descendant=folder, pk__in=access.folder_ids(request.user)
+        ).order_by('-descendant_links__depth').values('id', 'name', 'color')
+        return Response(list(path))
+
+    @action(detail=True, methods=['get'])
+    def descendant_counts(self, request, pk=None):
+        """How many accessible folders and files lie beneath this folder, at any depth."""
+        folder = self.get_object()
+        return Response({
+            'folders': Folder.objects.filter(
+                status='ACTIVE',
+                ancestor_links__ancestor=folder,
+                ancestor_links__depth__gt=0,
+                pk__in=access.folder_ids(request.user),
+            ).count(),
+            'files': File.objects.filter(
+                status='ACTIVE',
+                folder__ancestor_links__ancestor=folder,
+                pk__in=access.file_ids(request.user),
+            ).count(),
+        })
+
+    @action(detail=True, methods=['get'])
+    def usage(self, request, pk=None):
+        """Bytes and files in this folder and its subtree, with a per-subfolder breakdown."""
+        folder = self.get_object()
+        fields = ('bytes', 'file_count', 'total_bytes', 'total_files')
+        totals = FolderUsage.objects.filter(folder=folder).values(*fields).first() or dict.fromkeys(fields, 0)
+        children = FolderUsage.objects.filter(
+            folder__parent=folder, folder__status='ACTIVE', folder_id__in=access.folder_ids(request.user)
+        ).order_by('-total_bytes').values('folder_id', 'folder__name', *fields)[:100]
+        return Response({**totals, 'folders': [
+            {'id': row.pop('folder_id'), 'name': row.pop('folder__name'), **row} for row in children
+        ]})
+
+    @action(detail=True, methods=['get'])
+    def files(self, request, pk=None):
+        """All accessible files anywhere under this folder."""
+        folder = self.get_object()
+        queryset = File.objects.filter(
+            status='ACTIVE',
+            folder__ancestor_links__ancestor=folder,
+            pk__in=access.file_ids(request.user),
+        )
+        page = self.paginate_queryset(with_file_details(queryset, request.user))
+        serializer = FileSerializer(page, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
+class FileViewSet(VersionedMixin, AnnotatedRoleMixin, viewsets.ModelViewSet):
     serializer_class = FileSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = RecentlyUpdatedPagination
 
     def get_queryset(self):
         user = self.request.user
         category = self.request.query_params.get('category', 'all')
         
-        base_query = File.objects.filter(status='ACTIVE')
+        # Trashed files are only reachable through restore/purge
+        trashed = self.action in ('restore', 'purge')
+        base_query = File.objects.filter(status='DELETED' if trashed else 'ACTIVE')
         
         if category == 'mine':
-            return base_query.filter(owner=user)
+            queryset = base_query.filter(owner=user)
         elif category == 'shared':
-            return base_query.filter(
-                shares__shared_with=user,
-                shares__expires_at__gt=timezone.now()
-            ).distinct() | base_query.filter(
-                shares__shared_with=user,
-                shares__expires_at__isnull=True
-            ).distinct()
-        
-        # Default: both (My Files + Shared With Me separately identified is handled in serializer)
-        return (base_query.filter(owner=user) | 
-                base_query.filter(shares__shared_with=user, shares__expires_at__gt=timezone.now()) |
-                base_query.filter(shares__shared_with=user, shares__expires_at__isnull=True)).distinct()
+            queryset = base_query.filter(pk__in=access.file_ids(user, access.SHARED_LEVELS))
+        else:
+            # Default: both (My Files + Shared With Me separately identified is handled in serializer)
+            queryset = base_query.filter(pk__in=access.file_ids(user))
+
+        queryset = filter_by_tags(queryset, self.request)
+        return with_file_details(queryset, user)
 
     def get_permissions(self):
-        if self.action in ['update', 'partial_update', 'destroy']:
+        if self.action in ['update', 'partial_update', 'destroy', 'restore', 'lock', 'unlock', 'heartbeat']:
             return [permissions.IsAuthenticated(), IsOwnerOrEditor()]
         return [permissions.IsAuthenticated()]
 
     def perform_create(self, serializer):
+        require_edit(self.request, serializer.validated_data.get('folder'), "You do not have permission to upload to this folder.")
         file_obj = self.request.FILES.get('file')
-        size = str(file_obj.size) if file_obj else "0"
+        size = file_obj.size if file_obj else 0
         file_type = file_obj.content_type if file_obj else "unknown"
-        serializer.save(owner=self.request.user, size=size, type=file_type)
+        # One transaction: the quota row and the blob stay locked until the row referencing it exists (api.usage, api.blobs)
+        with transaction.atomic():
+            try:
+                usage.check_quota(self.request.user, size)
+            except usage.QuotaExceeded as e:
+                raise InsufficientStorage(str(e))
+            instance = serializer.save(owner=self.request.user, size=size, type=file_type)
+        transaction.on_commit(lambda: render.prewarm(instance))
 
     def perform_update(self, serializer):
-        instance = serializer.save()
-        AuditLog.objects.create(
+        folder = serializer.validated_data.get('folder')
+        if folder is not None and folder.pk != serializer.instance.folder_id:
+            require_edit(self.request, folder, "You do not have permission to move files into this folder.")
+        concurrency.expect(self.request, serializer.instance)
+        with transaction.atomic():  # a new file body stays locked until this row references it (api.blobs)
+            instance = serializer.save()
+        audit.record(
             user=self.request.user,
             file=instance,
             action='RENAME' if 'name' in self.request.data else 'GRANT', # Simplified for now
             details={'updated_fields': list(self.request.data.keys())}
         )
 
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """
+        Apply one operation to many files: {operation, ids | folder, target, tags}.
+        ``folder`` selects every file in that folder's subtree. Files the
+        user cannot edit, or that the operation does not apply to, are
+        returned under ``skipped`` (for ids) and left unchanged.
+        """
+        serializer = FileBatchSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        folder, target = data.get('folder'), data.get('target')
+        if target is not None and not roles.for_request(request).allows(target, AccessLevel.EDIT):
+            return Response({"error": "You do not have permission to move files into this folder."}, status=status.HTTP_403_FORBIDDEN)
+        try:
+            changed = batch.apply(
+                request.user, data['operation'], data.get('ids'), folder, target, data.get('tags', ()),
+            )
+        except batch.TooManyFiles as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        done = set(changed)
+        return Response({
+            'updated': changed,
+            'skipped': [pk for pk in dict.fromkeys(data.get('ids', [])) if pk not in done],
+        })
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        """
+        Stream the file body. Supports Range/If-Range, ETag and
+        Last-Modified validators (304), and front-server offload via
+        settings.DOWNLOAD_OFFLOAD. Pass ?inline=1 to view instead of save.
+        """
+        file = self.get_object()
+        if not file.file:
+            return Response({"error": "File has no content"}, status=status.HTTP_404_NOT_FOUND)
+        as_attachment = request.query_params.get('inline') not in ('1', 'true')
+        return downloads.file_response(request, file, as_attachment=as_attachment)
+
+    @action(detail=True, methods=['get'])
+    def render(self, request, pk=None):
+        """
+        The DOCX rendered to HTML, cached per content version. Images are
+        served from signed, immutable /api/render-assets/ URLs. Responds 501
+        when server rendering is unavailable so clients can render locally.
+        """
+        file = self.get_object()
+        if not file.file or not render.is_renderable(file):
+            return Response({"error": "File is not a DOCX document"}, status=status.HTTP_400_BAD_REQUEST)
+        etag = downloads.etag_for(file)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+        try:
+            version, html = render.render(file)
+        except render.RenderUnavailable as e:
+            return Response({"error": str(e)}, status=status.HTTP_501_NOT_IMPLEMENTED)
+        except render.DocumentUnreadable:
+            return Response({"error": "File is not a readable DOCX document"}, status=status.HTTP_400_BAD_REQUEST)
+        asset_url = reverse('render-asset', args=[render.asset_token(version), 'index.html'])
+        assets = request.build_absolute_uri(asset_url.rsplit('/', 1)[0])
+        response = Response({"base": version, "html": html.replace(render.ASSET_PLACEHOLDER, assets)})
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+    def _lock_pk(self):
+        # The lock endpoints update by id without get_object(), which would 404 a malformed id itself
+        try:
+            return uuid.UUID(str(self.kwargs['pk']))
+        except ValueError:
+            raise NotFound("File not found")
+
+    def _lock_response(self, message, expires):
+        return Response({"status": message, "expires_at": expires, "ttl": settings.FILE_LOCK_TTL})
+
     @action(detail=True, methods=['post'])
     def lock(self, request, pk=None):
-        file = self.get_object()
-        if file.locked_by and file.locked_by != request.user:
+        """
+        Take the edit lease (see api.locks), or renew it if already held.
+        Keep it with heartbeat/ within ``ttl`` seconds or it lapses.
+        """
+        expires = locks.acquire(self._lock_pk(), request.user)
+        if expires is not None:
+            return self._lock_response("File locked successfully", expires)
+        file = self.get_object()  # 404 or 403 when the user may not lock it at all
+        if locks.holder(file) not in (None, request.user.pk):
             return Response({"error": f"File is locked by {file.locked_by.username}"}, status=status.HTTP_409_CONFLICT)
-        
-        file.locked_by = request.user
-        file.locked_at = timezone.now()
-        file.save()
-        return Response({"status": "File locked successfully"})
+        return Response({"error": "File could not be locked, please retry"}, status=status.HTTP_409_CONFLICT)
+
+    @action(detail=True, methods=['post'])
+    def heartbeat(self, request, pk=None):
+        """Renew the caller's lease; 409 once it has lapsed or been taken over."""
+        expires = locks.heartbeat(self._lock_pk(), request.user)
+        if expires is not None:
+            return self._lock_response("Lock renewed", expires)
+        self.get_object()
+        return Response({"error": "You no longer hold the lock for this file"}, status=status.HTTP_409_CONFLICT)
 
     @action(detail=True, methods=['post'])
     def unlock(self, request, pk=None):
-        file = self.get_object()
-        if file.locked_by and file.locked_by != request.user:
-             return Response({"error": "You do not hold the lock for this file"}, status=status.HTTP_403_FORBIDDEN)
-        
-        file.locked_by = None
-        file.locked_at = None
-        file.save()
+        """Release the caller's lease; 403 if someone else holds it, 409 if nobody does."""
+        if not locks.release(self._lock_pk(), request.user):
+            file = self.get_object()  # 404 or 403 when the user may not lock it at all
+            if locks.holder(file) is not None:
+                return Response({"error": "You do not hold the lock for this file"}, status=status.HTTP_403_FORBIDDEN)
+            return Response({"error": "You do not hold the lock for this file"}, status=status.HTTP_409_CONFLICT)
         return Response({"status": "File unlocked successfully"})
 
     @action(detail=True, methods=['post'])
@@ -204,90 +537,206 @@ class FileViewSet(viewsets.ModelViewSet):
         file = self.get_object()
         
         # Check permission and lock
-        if file.owner != request.user:
-            # Check share permission
-            can_edit = FileShare.objects.filter(
-                file=file, shared_with=request.user, permission='EDIT'
-            ).filter(Q(expires_at__gt=timezone.now()) | Q(expires_at__isnull=True)).exists()
-            if not can_edit:
-                return Response({"error": "No edit permission"}, status=status.HTTP_403_FORBIDDEN)
+        if not roles.for_request(request).allows(file, AccessLevel.EDIT):
+            return Response({"error": "No edit permission"}, status=status.HTTP_403_FORBIDDEN)
         
-        if file.locked_by and file.locked_by != request.user:
+        # Checked on the row already loaded; jobs.finish checks again under the row lock
+        if locks.holder(file) not in (None, request.user.pk):
             return Response({"error": "File is locked by another user"}, status=status.HTTP_409_CONFLICT)
 
-        html_content = request.data.get('content')
-        if not html_content:
-            return Response({"error": "No content provided"}, status=status.HTTP_400_BAD_REQUEST)
-
-        # Convert HTML to DOCX
+        # If-Match: only save over the version the editor loaded (checked again when the job lands)
         try:
-            new_docx = Document()
-            new_parser = HtmlToDocx()
-            new_parser.add_html_to_document(html_content, new_docx)
-            
-            buffer = io.BytesIO()
-            new_docx.save(buffer)
-            buffer.seek(0)
-            
-            # Save back to file field - ensuring we overwrite the existing file
-            import os
-            from django.conf import settings
-            
-            # Get the relative path for storage
-            old_path = file.file.name
-            
-            # Save new content - using the same name to encourage overwriting
-            # but Django FileField.save often appends suffixes if the file exists.
-            # To be sure, we delete the previous one if it exists.
-            if file.file.storage.exists(old_path):
-                file.file.storage.delete(old_path)
-            
-            file.file.save(os.path.basename(old_path), ContentFile(buffer.read()), save=True)
-            
-            # Update size
-            file.size = str(file.file.size)
-            file.save()
-
-            AuditLog.objects.create(
-                user=request.user,
-                file=file,
-                action=AuditLog.Action.EDIT,
-                details={'action': 'save_content'}
-            )
-            
-            return Response({"status": "Content saved successfully", "size": file.size})
-        except Exception as e:
-            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            version = file.version if concurrency.expect(request, file) else None
+        except concurrency.VersionConflict as e:
+            return version_conflict(e)
+
+        assigned_ids = {}
+        if request.data.get('mode') == 'patch':
+            # Block patch: {"mode": "patch", "base": <version from blocks/>, "changes": [...]}
+            base = request.data.get('base')
+            if base != downloads.content_version(file):
+                return Response({"error": "Document has changed since it was opened", "base": downloads.content_version(file)}, status=status.HTTP_409_CONFLICT)
+            try:
+                changes, assigned_ids = clean_block_changes(request.data.get('changes'))
+            except ValueError as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            submit = lambda: jobs.submit_patch(file, request.user, changes, base, version)
+        else:
+            html_content = request.data.get('content')
+            if not html_content:
+                return Response({"error": "No content provided"}, status=status.HTTP_400_BAD_REQUEST)
+            submit = lambda: jobs.submit(file, request.user, html_content, version)
+
+        # Convert in the background pool; poll /api/jobs/{id}/ for the result
+        try:
+            job = submit()
+        except jobs.PoolSaturated:
+            response = Response({"error": "Document conversion is busy, please retry shortly"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            response['Retry-After'] = str(settings.CONVERSION_RETRY_AFTER)
+            return response
+
+        data = ConversionJobSerializer(job).data
+        if assigned_ids:
+            data['assigned_ids'] = assigned_ids
+        return Response(data, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=True, methods=['get'])
+    def blocks(self, request, pk=None):
+        """
+        Top-level paragraphs/tables of a DOCX with stable ids, plus the
+        content version to send back as ``base`` with a patch save.
+        """
+        file = self.get_object()
+        try:
+            document = Document(file.file.path)
+        except Exception:
+            return Response({"error": "File is not a readable DOCX document"}, status=status.HTTP_400_BAD_REQUEST)
+        base = downloads.content_version(file)
+        return Response({"base": base, "blocks": conversion.describe_blocks(document, base)})
+
+    @action(detail=False, methods=['get'])
+    def largest(self, request):
+        """The user's own active files, largest first (optionally ?folder=<id>)."""
+        queryset = File.objects.filter(owner=request.user, status='ACTIVE')
+        params = LargestQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        if params.validated_data.get('folder'):
+            queryset = queryset.filter(folder_id=params.validated_data['folder'])
+        paginator = LargestFirstPagination()
+        page = paginator.paginate_queryset(queryset.only('pk', 'size'), request, view=self)
+        rows = with_file_details(File.objects.filter(pk__in=[f.pk for f in page]), request.user).order_by('-size', '-id')
+        return paginator.get_paginated_response(self.get_serializer(rows, many=True).data)
+
+    @action(detail=True, methods=['post'])
+    def restore(self, request, pk=None):
+        file = self.get_object()
+        file.status = 'ACTIVE'
+        file.save()
+        audit.record(
+            user=request.user,
+            file=file,
+            action=AuditLog.Action.EDIT,
+            details={'action': 'restore'}
+        )
+        return Response({"status": "File restored"})
+
+    @action(detail=True, methods=['post'])
+    def purge(self, request, pk=None):
+        """Permanently delete a trashed file; this is what frees its storage."""
+        file = self.get_object()
+        if not roles.for_request(request).allows(file, AccessLevel.OWNER):
+            return Response({"error": "Only the owner can permanently delete a file"}, status=status.HTTP_403_FORBIDDEN)
+        audit.record(
+            user=request.user,
+            folder=file.folder,
+            action=AuditLog.Action.DELETE,
+            details={'action': 'purge', 'file': str(file.pk), 'name': file.name, 'size': file.size}
+        )
+        file.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
     def perform_destroy(self, instance):
         instance.status = 'DELETED'
         instance.save()
-        AuditLog.objects.create(
+        audit.record(
             user=self.request.user,
             file=instance,
             action=AuditLog.Action.DELETE
         )
 
+class RenderAssetView(APIView):
+    """
+    Images extracted by FileViewSet.render. The signed token in the URL is
+    the authorisation, so <img> tags work without an Authorization header,
+    and the bytes behind a token never change.
+    """
+    authentication_classes = []
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request, token, name):
+        try:
+            version = render.version_from_token(token)
+        except signing.BadSignature:
+            return Response({"error": "Invalid asset link"}, status=status.HTTP_404_NOT_FOUND)
+        path = os.path.join(render.cache_dir(version), name)
+        if not RENDER_ASSET_RE.match(name) or not os.path.exists(path):
+            return Response({"error": "Asset not found"}, status=status.HTTP_404_NOT_FOUND)
+        response = FileResponse(open(path, 'rb'), content_type=mimetypes.guess_type(name)[0] or 'application/octet-stream')
+        response['Cache-Control'] = 'private, max-age=31536000, immutable'
+        return response
+
+class UploadSessionViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin,
+                           mixins.DestroyModelMixin, viewsets.GenericViewSet):
+    """
+    Resumable chunked upload:
+    POST /uploads/ (init) -> PUT /uploads/{id}/parts/{n}/ (raw bytes, any order)
+    -> GET /uploads/{id}/ (status / resume) -> POST /uploads/{id}/complete/.
+    DELETE aborts the session and discards stored parts.
+    """
+    serializer_class = UploadSessionSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(owner=self.request.user)
+
+    def perform_create(self, serializer):
+        require_edit(self.request, serializer.validated_data.get('folder'), "You do not have permission to upload to this folder.")
+        try:
+            usage.check_quota(self.request.user, serializer.validated_data['total_size'])
+        except usage.QuotaExceeded as e:
+            raise InsufficientStorage(str(e))
+        part_size = serializer.validated_data.get('part_size') or settings.UPLOAD_PART_SIZE
+        serializer.save(owner=self.request.user, part_size=min(part_size, settings.UPLOAD_MAX_PART_SIZE))
+
+    @action(detail=True, methods=['put'], url_path=r'parts/(?P<number>\d+)')
+    def part(self, request, pk=None, number=None):
+        session = self.get_object()
+        # Read the raw body stream; touching request.data would buffer the whole part
+        try:
+            size = uploads.store_part(session, int(number), request.stream)
+        except uploads.UploadError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"part": int(number), "size": size})
+
+    @action(detail=True, methods=['post'])
+    def complete(self, request, pk=None):
+        session = self.get_object()
+        try:
+            file = uploads.complete(session)
+        except usage.QuotaExceeded as e:
+            return Response({"error": str(e)}, status=status.HTTP_507_INSUFFICIENT_STORAGE)
+        except uploads.UploadError as e:
+            return Response({
+                "error": str(e), "missing_parts": uploads.missing_parts(session)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        file = with_file_details(File.objects.filter(pk=file.pk), request.user).get()
+        return Response(FileSerializer(file, context=self.get_serializer_context()).data, status=status.HTTP_201_CREATED)
+
+    def perform_destroy(self, instance):
+        uploads.abort(instance)
+
+class ConversionJobViewSet(viewsets.ReadOnlyModelViewSet):
+    serializer_class = ConversionJobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return ConversionJob.objects.filter(user=self.request.user)
+
 class FolderShareViewSet(viewsets.ModelViewSet):
     serializer_class = FolderShareSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
         # Users can see shares they created or shares sent to them
+        # Owned-folder shares via a subquery so each side of the OR can use an index
+        owned = Folder.objects.filter(owner=self.request.user).values('pk')
         return FolderShare.objects.filter(
-            Q(folder__owner=self.request.user) | Q(shared_with=self.request.user)
-        )
+            Q(folder_id__in=owned) | Q(shared_with=self.request.user)
+        ).select_related('shared_with', 'folder')
 
     def perform_create(self, serializer):
         folder = serializer.validated_data['folder']
-        # Check if Owner OR Editor
-        is_owner = folder.owner == self.request.user
-        is_editor = FolderShare.objects.filter(
-            folder=folder, shared_with=self.request.user, permission='EDIT'
-        ).filter(Q(expires_at__gt=timezone.now()) | Q(expires_at__isnull=True)).exists()
-
-        if not (is_owner or is_editor):
-            raise permissions.PermissionDenied("You do not have permission to share this folder.")
+        require_edit(self.request, folder, "You do not have permission to share this folder.")
         
         share = serializer.save(granted_by=self.request.user)
         # Create notification
@@ -298,25 +747,50 @@ class FolderShareViewSet(viewsets.ModelViewSet):
             type='SHARE'
         )
 
+    def perform_update(self, serializer):
+        require_edit(self.request, serializer.instance.folder, "You do not have permission to change this share.")
+        require_edit(self.request, serializer.validated_data.get('folder'), "You do not have permission to share this folder.")
+        serializer.save()
+
+    def perform_destroy(self, instance):
+        # Recipients may leave a share; revoking someone else's needs EDIT
+        if instance.shared_with_id != self.request.user.pk:
+            require_edit(self.request, instance.folder, "You do not have permission to revoke this share.")
+        instance.delete()
+
+class BulkShareView(APIView):
+    """
+    Share many files and folders with many recipients at once. Returns the
+    shares created and, per file/folder/recipient, anything that was refused.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        serializer = BulkShareSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        created, rejected = sharing.share(
+            request.user, {'file': data['files'], 'folder': data['folders']}, data['emails'],
+            data['permission'], data['expires_at'], data['message'],
+        )
+        return Response(
+            {'created': created, 'rejected': rejected},
+            status=status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST,
+        )
+
 class FileShareViewSet(viewsets.ModelViewSet):
     serializer_class = FileShareSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
+        owned = File.objects.filter(owner=self.request.user).values('pk')
         return FileShare.objects.filter(
-            Q(file__owner=self.request.user) | Q(shared_with=self.request.user)
-        )
+            Q(file_id__in=owned) | Q(shared_with=self.request.user)
+        ).select_related('shared_with', 'file')
 
     def perform_create(self, serializer):
         file = serializer.validated_data['file']
-        # Check if Owner OR Editor
-        is_owner = file.owner == self.request.user
-        is_editor = FileShare.objects.filter(
-            file=file, shared_with=self.request.user, permission='EDIT'
-        ).filter(Q(expires_at__gt=timezone.now()) | Q(expires_at__isnull=True)).exists()
-
-        if not (is_owner or is_editor):
-            raise permissions.PermissionDenied("You do not have permission to share this file.")
+        require_edit(self.request, file, "You do not have permission to share this file.")
         
         share = serializer.save(granted_by=self.request.user)
         Notification.objects.create(
@@ -326,14 +800,125 @@ class FileShareViewSet(viewsets.ModelViewSet):
             type='SHARE'
         )
 
+    def perform_update(self, serializer):
+        require_edit(self.request, serializer.instance.file, "You do not have permission to change this share.")
+        require_edit(self.request, serializer.validated_data.get('file'), "You do not have permission to share this file.")
+        serializer.save()
+
+    def perform_destroy(self, instance):
+        # Recipients may leave a share; revoking someone else's needs EDIT
+        if instance.shared_with_id != self.request.user.pk:
+            require_edit(self.request, instance.file, "You do not have permission to revoke this share.")
+        instance.delete()
+
+def _event_stream_user(request):
+    # EventSource cannot send headers, so the access token may come as ?token=
+    auth = authentication.JWTAuthentication()
+    header = auth.get_header(request)
+    raw = auth.get_raw_token(header) if header else request.GET.get('token')
+    if not raw:
+        return None
+    try:
+        return auth.get_user(auth.get_validated_token(raw))
+    except (AuthenticationFailed, InvalidToken, TokenError):
+        return None
+
+def _backlog(user_id, last_id):
+    rows = Notification.objects.filter(user_id=user_id, id__gt=last_id).order_by('id')[:settings.EVENTS_BACKLOG]
+    return [events.payload(n) for n in rows]
+
+def _sse(event):
+    return f"id: {event['id']}\nevent: notification\ndata: {json.dumps(event)}\n\n"
+
+async def _stream(user_id, last_id):
+    await events.connect()
+    entry = events.subscribe(user_id)
+    try:
+        yield f"retry: {settings.EVENTS_RETRY_MS}\n\n"
+        replayed = set()
+        if last_id is not None:
+            # Subscribed first, so nothing committed meanwhile is lost; duplicates are skipped
+            for event in await sync_to_async(_backlog)(user_id, last_id):
+                replayed.add(event['id'])
+                yield _sse(event)
+        while True:
+            try:
+                event = await asyncio.wait_for(entry[1].get(), settings.EVENTS_KEEPALIVE)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if event['id'] not in replayed:
+                yield _sse(event)
+    finally:
+        events.unsubscribe(user_id, entry)
+
+async def event_stream(request):
+    """
+    Server-Sent Events stream of the user's new notifications (see
+    api.events). Authenticates with the SimpleJWT access token in the
+    Authorization header or ?token=; resumes after Last-Event-ID (or
+    ?last_event_id=). Must be served by an ASGI server.
+    """
+    user = await sync_to_async(_event_stream_user)(request)
+    if user is None:
+        return JsonResponse({"error": "Authentication credentials were not provided or are invalid."}, status=401)
+    last = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    last_id = int(last) if last and last.isdigit() else None
+    response = StreamingHttpResponse(_stream(user.pk, last_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # nginx: do not buffer the stream
+    return response
+
+class AuditLogViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Audit trail (see api.audit): staff see every entry, other users the
+    entries on their own files and folders and their own actions. Filter
+    with ?file=, ?folder=, ?user=, ?action=, ?since= and ?until= (ISO 8601);
+    pages are keyset cursors, newest first.
+    """
+    serializer_class = AuditLogSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        if self.action == 'retrieve':
+            return audit.visible(self.request.user).select_related('user')
+        params = AuditLogQuerySerializer(data=self.request.query_params)
+        params.is_valid(raise_exception=True)
+        return audit.query(self.request.user, **params.validated_data).select_related('user')
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """The whole filtered trail as a download: ?as=csv (default) or ?as=ndjson."""
+        fmt = request.query_params.get('as', 'csv')
+        if fmt not in audit.EXPORT_FORMATS:
+            return Response({"error": "as must be csv or ndjson"}, status=status.HTTP_400_BAD_REQUEST)
+        queryset = self.get_queryset()
+        stream = audit.aexport if isinstance(request._request, ASGIRequest) else audit.export
+        response = StreamingHttpResponse(stream(queryset, fmt), content_type=audit.EXPORT_FORMATS[fmt])
+        response['Content-Disposition'] = f'attachment; filename="audit-log.{fmt}"'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
 class NotificationViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = NotificationSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return Notification.objects.filter(user=self.request.user).order_by('-created_at')
+        return Notification.objects.filter(user=self.request.user).order_by('-created_at', '-id')
 
     @action(detail=False, methods=['post'])
     def mark_all_read(self, request):
-        self.get_queryset().update(is_read=True)
+        notifications.mark_read(request.user)
         return Response({'status': 'marked all as read'})
+
+    @action(detail=False, methods=['post'])
+    def mark_read(self, request):
+        ids = request.data.get('ids')
+        if not isinstance(ids, list) or not all(isinstance(pk, int) for pk in ids):
+            return Response({"error": "ids must be a list of notification ids"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'marked': notifications.mark_read(request.user, ids), 'unread': notifications.unread_count(request.user)})
+
+    @action(detail=False, methods=['get'])
+    def unread_count(self, request):
+        return Response({'unread': notifications.unread_count(request.user)})
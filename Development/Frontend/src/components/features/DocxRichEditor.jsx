@@ -3,7 +3,7 @@ import ReactQuill from 'react-quill-new';
 import 'react-quill-new/dist/quill.snow.css';
 import mammoth from 'mammoth';
 import { useAuth } from '../../context/AuthContext';
-import { fileAPI } from '../../utils/api';
+import { fileAPI, jobAPI } from '../../utils/api';
 import { useToast } from '../common/Toast';
 import { Lock, Unlock, Loader2, Save, FileText, AlertCircle, Maximize2, Minimize2, ChevronDown } from 'lucide-react';
 import { Button } from '../common/Button';
@@ -15,6 +15,7 @@ const DocxRichEditor = ({ file, readOnly = false }) => {
   const [isSaving, setIsSaving] = useState(false);
   const [localLock, setLocalLock] = useState(false);
   const [isFullscreen, setIsFullscreen] = useState(false);
+  const lockTtl = useRef(120);
   const { user } = useAuth();
   const { showToast } = useToast();
   
@@ -25,14 +26,21 @@ const DocxRichEditor = ({ file, readOnly = false }) => {
   
   useEffect(() => {
     const loadFile = async () => {
-      if (!file?.file_url) return;
+      if (!file?.id) return;
       
       setIsLoading(true);
       try {
-        const response = await fetch(file.file_url);
-        const arrayBuffer = await response.arrayBuffer();
-        const result = await mammoth.convertToHtml({ arrayBuffer });
-        setContent(result.value);
+        try {
+          // Server-rendered HTML is cached per content version
+          const { data } = await fileAPI.render(file.id);
+          setContent(data.html);
+        } catch (renderError) {
+          if (renderError.response?.status !== 501) throw renderError;
+          // Server rendering unavailable: convert in the browser
+          const response = await fileAPI.download(file.id);
+          const result = await mammoth.convertToHtml({ arrayBuffer: response.data });
+          setContent(result.value);
+        }
       } catch (error) {
         console.error('Failed to load .docx:', error);
         showToast('Failed to load document content', 'error');
@@ -42,11 +50,26 @@ const DocxRichEditor = ({ file, readOnly = false }) => {
     };
 
     loadFile();
-  }, [file?.file_url]);
+  }, [file?.id, file?.updated_at]);
+
+  // Keep the lock's lease alive while we hold it; the server lets it lapse otherwise
+  useEffect(() => {
+    if (!localLock || !file?.id) return;
+    const timer = setInterval(async () => {
+      try {
+        await fileAPI.heartbeat(file.id);
+      } catch (error) {
+        setLocalLock(false);
+        showToast(error.response?.data?.error || 'Lost the lock on this document', 'warning');
+      }
+    }, (lockTtl.current * 1000) / 3);
+    return () => clearInterval(timer);
+  }, [localLock, file?.id]);
 
   const handleLock = async () => {
     try {
-      await fileAPI.lock(file.id);
+      const { data } = await fileAPI.lock(file.id);
+      lockTtl.current = data.ttl || lockTtl.current;
       setLocalLock(true);
       showToast('Document locked for editing', 'success');
     } catch (error) {
@@ -72,10 +95,11 @@ const DocxRichEditor = ({ file, readOnly = false }) => {
 
     setIsSaving(true);
     try {
-      await fileAPI.saveContent(file.id, content);
+      const { data: job } = await fileAPI.saveContent(file.id, content);
+      await jobAPI.wait(job.id);
       showToast('Document saved successfully', 'success');
     } catch (error) {
-      showToast(error.response?.data?.error || 'Failed to save document', 'error');
+      showToast(error.response?.data?.error || error.message || 'Failed to save document', 'error');
     } finally {
       setIsSaving(false);
     }
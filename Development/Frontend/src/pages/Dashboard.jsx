@@ -1,4 +1,4 @@
-import React, { useState } from "react";
+import React, { useState, useEffect } from "react";
 import { Plus, Upload, Search } from "lucide-react";
 import { useNavigate } from "react-router-dom";
 import DashboardLayout from "../components/layout/DashboardLayout";
@@ -13,6 +13,7 @@ import { Input } from "../components/common/Input";
 import { cn } from "../utils/cn";
 import ContextMenu from "../components/common/ContextMenu";
 import ShareModal from "../components/features/ShareModal";
+import { searchAPI } from "../utils/api";
 
 const Dashboard = () => {
   console.log("Dashboard rendering...");
@@ -34,6 +35,7 @@ const Dashboard = () => {
   const [isCreateFolderOpen, setIsCreateFolderOpen] = useState(false);
   const [isUploadModalOpen, setIsUploadModalOpen] = useState(false);
   const [searchQuery, setSearchQuery] = useState("");
+  const [searchResults, setSearchResults] = useState(null); // server-side search hits, null when not searching
   const [activeTab, setActiveTab] = useState('mine'); // 'mine' or 'shared'
   
   // Context Menu & Share Modal State
@@ -59,6 +61,29 @@ const Dashboard = () => {
     });
   };
 
+  // Search file names, tags, metadata and document text on the server
+  useEffect(() => {
+    const q = searchQuery.trim();
+    if (q.length < 2) {
+      setSearchResults(null);
+      return;
+    }
+    let cancelled = false;
+    const timer = setTimeout(async () => {
+      try {
+        const { data } = await searchAPI.search(q);
+        if (!cancelled) setSearchResults(data.results);
+      } catch (error) {
+        console.error('Search failed:', error);
+        if (!cancelled) setSearchResults(null);
+      }
+    }, 250);
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
+  }, [searchQuery]);
+
   const currentFiles = activeTab === 'mine' ? myFiles : sharedFiles;
 
   const filteredFolders = (folders || []).filter(
@@ -71,7 +96,9 @@ const Dashboard = () => {
       )
   );
 
-  const filteredFiles = (currentFiles || []).filter(
+  const filteredFiles = searchResults
+    ? searchResults.filter((f) => (activeTab === 'mine') === (f.role === 'OWNER'))
+    : (currentFiles || []).filter(
     (f) =>
       f && (
       f.name?.toLowerCase().includes(searchQuery.toLowerCase()) ||
@@ -58,6 +58,18 @@ api.interceptors.response.use(
   }
 );
 
+// List endpoints are cursor-paginated ({ next, previous, results }).
+// Follow `next` until exhausted and hand back a plain array in `data`.
+const listAll = async (url, params) => {
+  let response = await api.get(url, { params });
+  const results = [...response.data.results];
+  while (response.data.next) {
+    response = await api.get(response.data.next);
+    results.push(...response.data.results);
+  }
+  return { ...response, data: results };
+};
+
 // API endpoints
 export const authAPI = {
   register: (data) => api.post('/auth/register/', {
@@ -79,38 +91,91 @@ export const authAPI = {
   updateUser: (data) => api.patch('/auth/user/', data),
 };
 
+// Optimistic concurrency: only apply the write if the object is still at `version`
+const ifMatch = (version) => (version == null ? undefined : { headers: { 'If-Match': `"v${version}"` } });
+
 export const folderAPI = {
-  list: () => api.get('/folders/'),
+  list: () => listAll('/folders/'),
   create: (data) => api.post('/folders/', data),
   get: (id) => api.get(`/folders/${id}/`),
-  update: (id, data) => api.patch(`/folders/${id}/`, data),
+  // Pass the folder's `version` to refuse overwriting a newer change (412)
+  update: (id, data, version) => api.patch(`/folders/${id}/`, data, ifMatch(version)),
   delete: (id) => api.delete(`/folders/${id}/`),
 };
 
 export const fileAPI = {
-  list: () => api.get('/files/'),
+  list: () => listAll('/files/'),
   upload: (formData) => api.post('/files/', formData, {
     headers: { 'Content-Type': 'multipart/form-data' },
   }),
   get: (id) => api.get(`/files/${id}/`),
-  update: (id, data) => api.patch(`/files/${id}/`, data),
+  update: (id, data, version) => api.patch(`/files/${id}/`, data, ifMatch(version)),
   delete: (id) => api.delete(`/files/${id}/`),
+  download: (id) => api.get(`/files/${id}/download/`, { responseType: 'arraybuffer' }),
   lock: (id) => api.post(`/files/${id}/lock/`),
   unlock: (id) => api.post(`/files/${id}/unlock/`),
-  saveContent: (id, content) => api.post(`/files/${id}/save_content/`, { content }),
+  // Locks are leases: renew within the `ttl` seconds returned by lock/heartbeat
+  heartbeat: (id) => api.post(`/files/${id}/heartbeat/`),
+  saveContent: (id, content, version) => api.post(`/files/${id}/save_content/`, { content }, ifMatch(version)),
+  // Block-level saves: fetch ids + base version, then send only changed blocks
+  blocks: (id) => api.get(`/files/${id}/blocks/`),
+  render: (id) => api.get(`/files/${id}/render/`),
+  savePatch: (id, base, changes) => api.post(`/files/${id}/save_content/`, { mode: 'patch', base, changes }),
+  // { operation, ids | folder, target, tags } -> { updated, skipped }
+  batch: (data) => api.post('/files/batch/', data),
 };
 
 export const shareAPI = {
   shareFolder: (data) => api.post('/shares/folder/', data),
   shareFile: (data) => api.post('/shares/file/', data),
-  listFolderShares: () => api.get('/shares/folder/'),
-  listFileShares: () => api.get('/shares/file/'),
+  // { files, folders, emails, permission, expires_at, message } -> { created, rejected }
+  shareBulk: (data) => api.post('/shares/bulk/', data),
+  listFolderShares: () => listAll('/shares/folder/'),
+  listFileShares: () => listAll('/shares/file/'),
   revokeShare: (type, id) => api.delete(`/shares/${type}/${id}/`),
 };
 
+export const jobAPI = {
+  get: (id) => api.get(`/jobs/${id}/`),
+  // Poll a background job until it finishes; resolves with the final job
+  wait: async (id, intervalMs = 1000) => {
+    for (;;) {
+      const { data } = await api.get(`/jobs/${id}/`);
+      if (data.status === 'SUCCEEDED') return data;
+      if (data.status === 'FAILED') throw new Error(data.error || 'Job failed');
+      await new Promise((resolve) => setTimeout(resolve, intervalMs));
+    }
+  },
+};
+
+export const searchAPI = {
+  search: (q, limit = 50) => api.get('/search/', { params: { q, limit } }),
+};
+
+export const tagAPI = {
+  autocomplete: (q, limit = 10) => api.get('/tags/', { params: { q, limit } }),
+  facets: (scope = 'files', tags) => api.get('/tags/facets/', { params: { scope, tags } }),
+};
+
 export const notificationAPI = {
-  list: () => api.get('/notifications/'),
+  list: (params) => api.get('/notifications/', { params }),
   markAllRead: () => api.post('/notifications/mark_all_read/'),
+  markRead: (ids) => api.post('/notifications/mark_read/', { ids }),
+  unreadCount: () => api.get('/notifications/unread_count/'),
+  // Push stream of new notifications; EventSource reconnects and resumes by itself.
+  // Returns a function that closes the stream.
+  subscribe: (onNotification) => {
+    const token = localStorage.getItem('access_token');
+    const source = new EventSource(`${API_BASE_URL}/events/?token=${encodeURIComponent(token)}`);
+    source.addEventListener('notification', (e) => onNotification(JSON.parse(e.data)));
+    return () => source.close();
+  },
+};
+
+export const auditAPI = {
+  list: (params) => api.get('/audit/', { params }),
+  // format: 'csv' or 'ndjson'
+  export: (params, format = 'csv') => api.get('/audit/export/', { params: { ...params, as: format }, responseType: 'blob' }),
 };
 
 export default api;